@@ -0,0 +1,206 @@
+import asyncio
+import logging
+from enum import Enum
+from typing import Awaitable, Callable, List, Optional, Set, TypedDict
+
+import backoff
+import nats
+import nats.aio.client
+
+from octoprint_nanny.env import (
+    MAX_BACKOFF_TIME,
+    NATS_CONNECT_TIMEOUT,
+    NATS_MAX_PENDING_BYTES,
+    NATS_MAX_RECONNECT_ATTEMPTS,
+    NATS_RECONNECT_TIME_WAIT,
+)
+from octoprint_nanny.metrics import NATS_CONNECTION_EVENTS
+
+logger = logging.getLogger("octoprint.plugins.octoprint_nanny.clients.nats")
+
+
+class NatsConnectionState(Enum):
+    DISCONNECTED = "disconnected"
+    CONNECTING = "connecting"
+    CONNECTED = "connected"
+    RECONNECTING = "reconnecting"
+    CLOSED = "closed"
+
+
+class NatsConnectionStats(TypedDict):
+    state: str
+    servers: List[str]
+    pending_bytes: int
+    max_pending_bytes: int
+    connects: int
+    reconnects: int
+    disconnects: int
+    errors: int
+
+
+class NatsConnectionManager:
+    """
+    Long-lived connection to PrintNanny OS's NATS server
+
+    start() connects with exponential backoff, then nats-py reconnects on its own. Once nats-py gives up
+    after max_reconnect_attempts the connection closes, and start() takes over again.
+    Publishers check healthy before building a message, so a broker outage costs
+    one attribute lookup per event instead of a failed await and an error log line
+    """
+
+    def __init__(
+        self,
+        servers: List[str],
+        connect_timeout: int = NATS_CONNECT_TIMEOUT,
+        reconnect_time_wait: int = NATS_RECONNECT_TIME_WAIT,
+        max_pending_bytes: int = NATS_MAX_PENDING_BYTES,
+        max_reconnect_attempts: int = NATS_MAX_RECONNECT_ATTEMPTS,
+    ):
+        self.servers = servers
+        self.connect_timeout = connect_timeout
+        self.reconnect_time_wait = reconnect_time_wait
+        self.max_pending_bytes = max_pending_bytes
+        self.max_reconnect_attempts = max_reconnect_attempts
+
+        self.nc: Optional[nats.aio.client.Client] = None
+        self.state = NatsConnectionState.DISCONNECTED
+        self._task: Optional[asyncio.Future] = None
+        self._closing = False
+        self._connected_callbacks: List[Callable[[], Awaitable[None]]] = []
+        self._callback_tasks: Set[asyncio.Future] = set()
+
+        self.connects = 0
+        self.reconnects = 0
+        self.disconnects = 0
+        self.errors = 0
+
+    @property
+    def healthy(self) -> bool:
+        """
+        True if connected and the outbound buffer is below max_pending_bytes
+        """
+        if self.state is not NatsConnectionState.CONNECTED or self.nc is None:
+            return False
+        return self.nc.pending_data_size < self.max_pending_bytes
+
+    async def connect(self):
+        """
+        Single connection attempt, raises on failure
+
+        nats-py tries each server up to max_reconnect_attempts times before raising NoServersError.
+        With max_reconnect_attempts=-1 it would retry the first connect forever and never raise
+        """
+        self.state = NatsConnectionState.CONNECTING
+        try:
+            self.nc = await nats.connect(
+                servers=self.servers,
+                connect_timeout=self.connect_timeout,
+                reconnect_time_wait=self.reconnect_time_wait,
+                # must be finite, see connect() docs
+                max_reconnect_attempts=max(1, self.max_reconnect_attempts),
+                pending_size=self.max_pending_bytes,
+                error_cb=self._error_cb,
+                disconnected_cb=self._disconnected_cb,
+                reconnected_cb=self._reconnected_cb,
+                closed_cb=self._closed_cb,
+            )
+        except Exception:
+            self.state = NatsConnectionState.DISCONNECTED
+            raise
+        self.connects += 1
+        NATS_CONNECTION_EVENTS.labels("connect").inc()
+        self.state = NatsConnectionState.CONNECTED
+        logger.info("Connected to NATS server: %s", self.servers)
+        self._run_connected_callbacks()
+
+    def add_connected_callback(self, cb: Callable[[], Awaitable[None]]):
+        """
+        Register a coroutine function to run after every successful connect or reconnect
+        """
+        self._connected_callbacks.append(cb)
+
+    def _run_connected_callbacks(self):
+        for cb in self._connected_callbacks:
+            task = asyncio.ensure_future(cb())
+            self._callback_tasks.add(task)
+            task.add_done_callback(self._callback_tasks.discard)
+
+    @backoff.on_exception(
+        backoff.expo,
+        Exception,
+        logger=logger,
+        max_value=MAX_BACKOFF_TIME,
+        jitter=backoff.full_jitter,
+    )
+    async def _connect_with_backoff(self):
+        await self.connect()
+
+    async def start(self):
+        """
+        Connect in the background, retrying with exponential backoff until connected or close() is called
+        """
+        self._closing = False
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._connect_with_backoff())
+
+    async def close(self):
+        self._closing = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+        if self.nc is not None and not self.nc.is_closed:
+            await self.nc.drain()
+        self.state = NatsConnectionState.CLOSED
+
+    async def publish(self, subject: str, payload: bytes):
+        if self.nc is None:
+            raise nats.errors.ConnectionClosedError
+        await self.nc.publish(subject, payload)
+
+    async def flush(self, timeout: int = 10):
+        if self.nc is None:
+            raise nats.errors.ConnectionClosedError
+        await self.nc.flush(timeout=timeout)
+
+    async def _error_cb(self, e: Exception):
+        self.errors += 1
+        NATS_CONNECTION_EVENTS.labels("error").inc()
+        # nats-py calls error_cb for every failed reconnect attempt, only log the first one
+        if self.state is NatsConnectionState.CONNECTED:
+            logger.error("NATS connection error: %s", e)
+        else:
+            logger.debug("NATS connection error: %s", e)
+
+    async def _disconnected_cb(self):
+        self.disconnects += 1
+        NATS_CONNECTION_EVENTS.labels("disconnect").inc()
+        if self.state is NatsConnectionState.CONNECTED and not self._closing:
+            self.state = NatsConnectionState.RECONNECTING
+            logger.warning("Disconnected from NATS server, reconnecting")
+
+    async def _reconnected_cb(self):
+        self.reconnects += 1
+        NATS_CONNECTION_EVENTS.labels("reconnect").inc()
+        self.state = NatsConnectionState.CONNECTED
+        logger.info(
+            "Reconnected to NATS server: %s",
+            self.nc.connected_url if self.nc is not None else self.servers,
+        )
+        self._run_connected_callbacks()
+
+    async def _closed_cb(self):
+        self.state = NatsConnectionState.CLOSED
+        if not self._closing:
+            logger.warning("NATS connection closed, starting new connection")
+            await self.start()
+
+    def stats(self) -> NatsConnectionStats:
+        return NatsConnectionStats(
+            state=self.state.value,
+            servers=self.servers,
+            pending_bytes=self.nc.pending_data_size if self.nc is not None else 0,
+            max_pending_bytes=self.max_pending_bytes,
+            connects=self.connects,
+            reconnects=self.reconnects,
+            disconnects=self.disconnects,
+            errors=self.errors,
+        )
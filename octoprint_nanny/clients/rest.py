@@ -1,9 +1,11 @@
 import aiohttp
+import asyncio
+import functools
 import logging
+import ssl
 import urllib.parse
-import backoff
 import os
-from typing import Optional
+from typing import Dict, Optional
 
 import printnanny_api_client
 from printnanny_api_client import ApiClient as AsyncApiClient
@@ -11,13 +13,25 @@ from printnanny_api_client.models import PatchedOctoPrintServerRequest
 from printnanny_api_client.api.accounts_api import AccountsApi
 from printnanny_api_client.api.octoprint_api import OctoprintApi
 
-from octoprint_nanny.env import MAX_BACKOFF_TIME
+from octoprint_nanny.clients.upload import ProgressCallback, StreamingUpload
+from octoprint_nanny.env import (
+    REST_CONNECTION_LIMIT,
+    REST_DNS_CACHE_TTL,
+    REST_KEEPALIVE_TIMEOUT,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_TIMEOUT,
+)
+from octoprint_nanny.exceptions import CircuitOpenError
+from octoprint_nanny.metrics import REST_REQUESTS
+from octoprint_nanny.retry import CircuitBreaker, RetryBudget, RetryPolicy, retry
 
 logger = logging.getLogger("octoprint.plugins.octoprint_nanny.clients.rest")
 
 API_CLIENT_EXCEPTIONS = (
     printnanny_api_client.exceptions.ApiException,
     aiohttp.client_exceptions.ClientError,
+    # aiohttp's total request timeout
+    asyncio.TimeoutError,
 )
 
 
@@ -27,89 +41,180 @@ def fatal_code(e) -> bool:
     """
     if isinstance(e, aiohttp.ClientConnectionError):
         return False
-    return 400 <= e.response.status_code < 500
+    # ApiException and aiohttp.ClientResponseError both carry the HTTP status as .status
+    status = getattr(e, "status", None)
+    if status in (408, 429):
+        return False
+    return status is not None and 400 <= status < 500
 
 
-def backoff_hdlr(details):
-    logger.warning(
-        "Backing off {wait:0.1f} seconds afters {tries} tries "
-        "calling function {target} with args {args} and kwargs "
-        "{kwargs}".format(**details)
-    )
+# shared by every PrintNanny Cloud endpoint, an outage affects all of them
+PRINTNANNY_CLOUD_CIRCUIT_BREAKER = CircuitBreaker("printnanny_cloud")
+PRINTNANNY_CLOUD_RETRY_BUDGET = RetryBudget()
+
+REST_RETRY_POLICIES: Dict[str, RetryPolicy] = {
+    "get_user": RetryPolicy(retry_on=API_CLIENT_EXCEPTIONS, giveup=fatal_code),
+    "update_octoprint_server_api_key": RetryPolicy(
+        retry_on=API_CLIENT_EXCEPTIONS, giveup=fatal_code
+    ),
+    # every try re-sends the whole archive, only retry once the connection is back
+    "create_backup": RetryPolicy(
+        retry_on=API_CLIENT_EXCEPTIONS,
+        giveup=fatal_code,
+        max_tries=3,
+        base_delay=5.0,
+        max_delay=60.0,
+    ),
+}
 
 
-def giveup_hdlr(details):
-    logger.error(
-        "Giving up {elapsed:0.1f} seconds afters {tries} tries "
-        "calling function {target} with args {args} and kwargs "
-        "{kwargs}".format(**details)
+def rest_retry(endpoint: str):
+    """
+    Apply endpoint's retry policy and count every attempt in REST_REQUESTS by HTTP status
+    """
+    with_retry = retry(
+        REST_RETRY_POLICIES[endpoint],
+        PRINTNANNY_CLOUD_CIRCUIT_BREAKER,
+        PRINTNANNY_CLOUD_RETRY_BUDGET,
     )
 
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def attempt(*args, **kwargs):
+            status = "error"
+            try:
+                result = await fn(*args, **kwargs)
+                status = "2xx"
+                return result
+            except (
+                printnanny_api_client.exceptions.ApiException,
+                aiohttp.ClientResponseError,
+            ) as e:
+                status = str(e.status)
+                raise
+            except aiohttp.ClientError:
+                status = "connection_error"
+                raise
+            finally:
+                REST_REQUESTS.labels(endpoint, status).inc()
+
+        retried = with_retry(attempt)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            try:
+                return await retried(*args, **kwargs)
+            except CircuitOpenError:
+                REST_REQUESTS.labels(endpoint, "circuit_open").inc()
+                raise
+
+        return wrapper
+
+    return decorator
+
+
+class StreamingApiClient(AsyncApiClient):
+    """
+    ApiClient that streams StreamingUpload file parameters from disk
+
+    The generated files_parameters() reads every file into memory before the request is sent
+    """
+
+    def files_parameters(self, files=None):
+        params = []
+        for k, v in (files or {}).items():
+            if isinstance(v, StreamingUpload):
+                params.append((k, (v.filename, v.open(), v.content_type)))
+            else:
+                params.extend(super().files_parameters({k: v}))
+        return params
+
 
 class PrintNannyCloudAPIClient:
     """
     webapp rest API calls and retry behavior
     """
 
-    def __init__(self, base_path: str, bearer_access_token: Optional[str] = None):
+    def __init__(
+        self,
+        base_path: str,
+        bearer_access_token: Optional[str] = None,
+        connection_limit: int = REST_CONNECTION_LIMIT,
+        dns_cache_ttl: int = REST_DNS_CACHE_TTL,
+        keepalive_timeout: float = REST_KEEPALIVE_TIMEOUT,
+    ):
         self.base_path = base_path
         self.bearer_access_token = bearer_access_token
+        self.connection_limit = connection_limit
+        self.dns_cache_ttl = dns_cache_ttl
+        self.keepalive_timeout = keepalive_timeout
 
-    @property
-    def _api_config(self):
         parsed_uri = urllib.parse.urlparse(self.base_path)
         host = f"{parsed_uri.scheme}://{parsed_uri.netloc}"
-        config = printnanny_api_client.Configuration(host=host)
+        self._api_config = printnanny_api_client.Configuration(host=host)
+        self._api_config.access_token = self.bearer_access_token
+        # sizes the generated client's own connector too, see _get_api_client
+        self._api_config.connection_pool_maxsize = self.connection_limit
+        self._api_client: Optional[StreamingApiClient] = None
 
-        config.access_token = self.bearer_access_token
-        return config
+    def _create_session(self) -> aiohttp.ClientSession:
+        ssl_context = ssl.create_default_context(cafile=self._api_config.ssl_ca_cert)
+        if self._api_config.cert_file:
+            ssl_context.load_cert_chain(
+                self._api_config.cert_file, keyfile=self._api_config.key_file
+            )
+        if not self._api_config.verify_ssl:
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+        connector = aiohttp.TCPConnector(
+            limit=self.connection_limit,
+            ttl_dns_cache=self.dns_cache_ttl,
+            keepalive_timeout=self.keepalive_timeout,
+            ssl=ssl_context,
+        )
+        # same as the generated RESTClientObject: honor HTTP(S)_PROXY and .netrc
+        return aiohttp.ClientSession(connector=connector, trust_env=True)
 
-    @backoff.on_exception(
-        backoff.expo,
-        aiohttp.ClientConnectionError,
-        logger=logger,
-        max_time=MAX_BACKOFF_TIME,
-        jitter=backoff.random_jitter,
-        giveup=fatal_code,
-        on_backoff=backoff_hdlr,
-        on_giveup=giveup_hdlr,
-    )
+    async def _get_api_client(self) -> StreamingApiClient:
+        """
+        Shared ApiClient, created on first use inside the event loop that makes the requests
+        """
+        if self._api_client is None:
+            api_client = StreamingApiClient(self._api_config)
+            # swap the per-client session for one pooled session with keep-alive and DNS caching.
+            # RESTClientObject.pool_manager is the generated client's aiohttp.ClientSession as of
+            # printnanny-api-client 0.131.x, its constructor doesn't take a session or connector
+            default_session = api_client.rest_client.pool_manager
+            api_client.rest_client.pool_manager = self._create_session()
+            self._api_client = api_client
+            await default_session.close()
+        return self._api_client
+
+    async def close(self):
+        if self._api_client is not None:
+            api_client = self._api_client
+            self._api_client = None
+            await api_client.close()
+
+    @rest_retry("get_user")
     async def get_user(self):
-        async with AsyncApiClient(self._api_config) as api_client:
-            api_instance = AccountsApi(api_client=api_client)
-            user = await api_instance.accounts_user_retrieve()
-            return user
-
-    # @backoff.on_exception(
-    #     backoff.expo,
-    #     aiohttp.ClientConnectionError,
-    #     logger=logger,
-    #     max_time=MAX_BACKOFF_TIME,
-    #     jitter=backoff.random_jitter,
-    #     giveup=fatal_code,
-    #     on_backoff=backoff_hdlr,
-    #     on_giveup=giveup_hdlr,
-    # )
+        api_client = await self._get_api_client()
+        api_instance = AccountsApi(api_client=api_client)
+        user = await api_instance.accounts_user_retrieve()
+        return user
+
+    @rest_retry("update_octoprint_server_api_key")
     async def update_octoprint_server_api_key(self, octoprint_server_id, api_key):
-        async with AsyncApiClient(self._api_config) as api_client:
-            api_instance = OctoprintApi(api_client=api_client)
-            request = PatchedOctoPrintServerRequest(api_key=api_key)
-            result = await api_instance.octoprint_partial_update(
-                octoprint_server_id,
-                patched_octo_print_server_request=request,
-            )
-            return result
-
-    # @backoff.on_exception(
-    #     backoff.expo,
-    #     aiohttp.ClientConnectionError,
-    #     logger=logger,
-    #     max_time=MAX_BACKOFF_TIME,
-    #     jitter=backoff.random_jitter,
-    #     giveup=fatal_code,
-    #     on_backoff=backoff_hdlr,
-    #     on_giveup=giveup_hdlr,
-    # )
+        api_client = await self._get_api_client()
+        api_instance = OctoprintApi(api_client=api_client)
+        request = PatchedOctoPrintServerRequest(api_key=api_key)
+        result = await api_instance.octoprint_partial_update(
+            octoprint_server_id,
+            patched_octo_print_server_request=request,
+        )
+        return result
+
+    # @rest_retry("update_or_create_printer_profile")
     # async def update_or_create_printer_profile(
     #     self, printer_profile, octoprint_device_id
     # ):
@@ -158,16 +263,37 @@ class PrintNannyCloudAPIClient:
     #         )
     #         return printer_profile
 
+    @rest_retry("create_backup")
     async def create_backup(
-        self, hostname: str, name: str, octoprint_version: str, file: str
+        self,
+        hostname: str,
+        name: str,
+        octoprint_version: str,
+        file: str,
+        progress_callback: Optional[ProgressCallback] = None,
+        chunked: bool = False,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+        timeout: int = UPLOAD_TIMEOUT,
     ):
-        async with AsyncApiClient(self._api_config) as api_client:
-            api_instance = printnanny_api_client.OctoprintApi(api_client=api_client)
-
-            backup = await api_instance.octoprint_backups_create(
-                hostname,
-                name,
-                octoprint_version,
-                file,
-            )
-            return backup
+        """
+        Upload backup archive at path file, streaming it from disk
+
+        progress_callback is called with (bytes_sent, total_bytes), see StreamingUpload for chunked mode
+        """
+        api_client = await self._get_api_client()
+        api_instance = printnanny_api_client.OctoprintApi(api_client=api_client)
+        upload = StreamingUpload(
+            file,
+            progress_callback=progress_callback,
+            chunked=chunked,
+            chunk_size=chunk_size,
+        )
+
+        backup = await api_instance.octoprint_backups_create(
+            hostname,
+            name,
+            octoprint_version,
+            upload,
+            _request_timeout=timeout,
+        )
+        return backup
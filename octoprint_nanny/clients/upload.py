@@ -0,0 +1,98 @@
+import asyncio
+import io
+import logging
+import mimetypes
+import os
+from typing import AsyncIterator, Callable, Optional, Union
+
+from octoprint_nanny.env import UPLOAD_CHUNK_SIZE
+
+logger = logging.getLogger("octoprint.plugins.octoprint_nanny.clients.upload")
+
+# called with (bytes_sent, total_bytes)
+ProgressCallback = Callable[[int, int], None]
+
+
+class ProgressBufferedReader(io.BufferedReader):
+    """
+    BufferedReader that reports progress on every read
+
+    aiohttp streams BufferedReader payloads in 64KB reads from its executor,
+    so progress_callback runs in a worker thread and should return quickly
+    """
+
+    def __init__(
+        self,
+        raw: io.RawIOBase,
+        total: int,
+        progress_callback: Optional[ProgressCallback] = None,
+        buffer_size: int = UPLOAD_CHUNK_SIZE,
+    ):
+        super().__init__(raw, buffer_size=buffer_size)
+        self.total = total
+        self.sent = 0
+        self.progress_callback = progress_callback
+
+    def read(self, size: Optional[int] = -1) -> bytes:
+        data = super().read(size)
+        if data:
+            self.sent += len(data)
+            if self.progress_callback is not None:
+                self.progress_callback(self.sent, self.total)
+        return data
+
+
+class StreamingUpload:
+    """
+    File on disk, uploaded as a multipart/form-data field without reading it into memory
+
+    By default the file is sent as a sized stream (Content-Length is known up front).
+    With chunked=True it is sent with chunked transfer encoding, chunk_size bytes at a time,
+    with progress_callback called from the event loop.
+
+    Resuming an interrupted upload is not supported, the PrintNanny Cloud backups endpoint
+    only accepts whole files
+    """
+
+    def __init__(
+        self,
+        path: str,
+        progress_callback: Optional[ProgressCallback] = None,
+        chunked: bool = False,
+        chunk_size: int = UPLOAD_CHUNK_SIZE,
+    ):
+        self.path = path
+        self.filename = os.path.basename(path)
+        self.content_type = (
+            mimetypes.guess_type(self.filename)[0] or "application/octet-stream"
+        )
+        self.size = os.path.getsize(path)
+        self.progress_callback = progress_callback
+        self.chunked = chunked
+        self.chunk_size = chunk_size
+
+    def open(self) -> Union[ProgressBufferedReader, AsyncIterator[bytes]]:
+        """
+        Returns a value aiohttp.FormData streams from, the file is closed once the request body is written
+        """
+        if self.chunked:
+            return self._iter_chunks()
+        return ProgressBufferedReader(
+            io.FileIO(self.path, "rb"),
+            self.size,
+            progress_callback=self.progress_callback,
+            buffer_size=self.chunk_size,
+        )
+
+    async def _iter_chunks(self) -> AsyncIterator[bytes]:
+        loop = asyncio.get_running_loop()
+        sent = 0
+        with open(self.path, "rb") as f:
+            while True:
+                chunk = await loop.run_in_executor(None, f.read, self.chunk_size)
+                if not chunk:
+                    break
+                sent += len(chunk)
+                yield chunk
+                if self.progress_callback is not None:
+                    self.progress_callback(sent, self.size)
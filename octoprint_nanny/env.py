@@ -1,4 +1,5 @@
 import os
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -6,3 +7,135 @@ logger = logging.getLogger(__name__)
 MAX_BACKOFF_TIME = int(os.environ.get("OCTOPRINT_NANNY_MAX_BACKOFF_TIME", 120))
 
 logger.info(f"OCTOPRINT_NANNY_MAX_BACKOFF_TIME={MAX_BACKOFF_TIME}")
+
+# bounded in-memory queue between OctoPrint's event dispatch thread and the AsyncTaskWorker loop
+EVENT_QUEUE_MAXSIZE = int(os.environ.get("OCTOPRINT_NANNY_EVENT_QUEUE_MAXSIZE", 256))
+# one of: drop_oldest, drop_newest, coalesce
+EVENT_QUEUE_OVERFLOW_POLICY = os.environ.get(
+    "OCTOPRINT_NANNY_EVENT_QUEUE_OVERFLOW_POLICY", "drop_oldest"
+)
+
+# per-subject NATS batch flush thresholds, overrides events.DEFAULT_NATS_BATCH_POLICIES
+# JSON object keyed by subject template, e.g. '{"pi.{pi_id}.octoprint.event.gcode": {"max_messages": 25, "max_delay_ms": 100}}'
+NATS_BATCH_POLICIES = json.loads(
+    os.environ.get("OCTOPRINT_NANNY_NATS_BATCH_POLICIES", "{}")
+)
+
+# PrintNanny OS NATS connection
+NATS_CONNECT_TIMEOUT = int(os.environ.get("OCTOPRINT_NANNY_NATS_CONNECT_TIMEOUT", 2))
+NATS_RECONNECT_TIME_WAIT = int(
+    os.environ.get("OCTOPRINT_NANNY_NATS_RECONNECT_TIME_WAIT", 5)
+)
+# attempts per server, reconnect_time_wait apart, before nats-py gives up on a connect or reconnect.
+# NatsConnectionManager.start() then retries with exponential backoff
+NATS_MAX_RECONNECT_ATTEMPTS = int(
+    os.environ.get("OCTOPRINT_NANNY_NATS_MAX_RECONNECT_ATTEMPTS", 6)
+)
+# outbound buffer limit, publishers back off once this many bytes are waiting to be written
+NATS_MAX_PENDING_BYTES = int(
+    os.environ.get("OCTOPRINT_NANNY_NATS_MAX_PENDING_BYTES", 512 * 1024)
+)
+
+# on-disk outbox for NATS messages published while PrintNanny OS's NATS server is unavailable
+OUTBOX_MAX_SEGMENT_BYTES = int(
+    os.environ.get("OCTOPRINT_NANNY_OUTBOX_MAX_SEGMENT_BYTES", 256 * 1024)
+)
+OUTBOX_MAX_BYTES = int(
+    os.environ.get("OCTOPRINT_NANNY_OUTBOX_MAX_BYTES", 8 * 1024 * 1024)
+)
+OUTBOX_FSYNC_EVERY = int(os.environ.get("OCTOPRINT_NANNY_OUTBOX_FSYNC_EVERY", 16))
+OUTBOX_FSYNC_INTERVAL = float(
+    os.environ.get("OCTOPRINT_NANNY_OUTBOX_FSYNC_INTERVAL", 2.0)
+)
+# messages per second
+OUTBOX_REPLAY_RATE = float(os.environ.get("OCTOPRINT_NANNY_OUTBOX_REPLAY_RATE", 50))
+
+# coalescing windows in milliseconds, overrides events.DEFAULT_NATS_COALESCE_WINDOWS
+# JSON object keyed by subject template, e.g. '{"pi.{pi_id}.octoprint.event.printer.job_progress": 5000}'
+NATS_COALESCE_WINDOWS = json.loads(
+    os.environ.get("OCTOPRINT_NANNY_NATS_COALESCE_WINDOWS", "{}")
+)
+
+# per-subject token buckets, overrides events.DEFAULT_NATS_RATE_LIMITS, null removes a default limit
+# JSON object keyed by subject template, e.g. '{"pi.{pi_id}.octoprint.event.gcode": {"rate": 10, "burst": 50}}'
+NATS_RATE_LIMITS = json.loads(os.environ.get("OCTOPRINT_NANNY_NATS_RATE_LIMITS", "{}"))
+
+# JSON serializer used for outgoing messages, one of: auto, orjson, json
+# auto uses orjson if installed (pip install octoprint-nanny[speedups]), otherwise the standard library
+JSON_BACKEND = os.environ.get("OCTOPRINT_NANNY_JSON_BACKEND", "auto")
+
+# seconds before `printnanny settings show` output is reloaded by utils.printnanny_os.SystemInfoCache
+# /etc/os-release and /etc/issue are reloaded whenever their mtime changes
+SYSTEM_INFO_TTL = float(os.environ.get("OCTOPRINT_NANNY_SYSTEM_INFO_TTL", 300))
+
+# printnanny CLI subprocesses, see utils.printnanny_os.run_printnanny_cli
+PRINTNANNY_CLI_TIMEOUT = float(
+    os.environ.get("OCTOPRINT_NANNY_PRINTNANNY_CLI_TIMEOUT", 30)
+)
+PRINTNANNY_CLI_MAX_CONCURRENCY = int(
+    os.environ.get("OCTOPRINT_NANNY_PRINTNANNY_CLI_MAX_CONCURRENCY", 2)
+)
+
+# PrintNanny Cloud REST API connection pool, see clients.rest.PrintNannyCloudAPIClient
+REST_CONNECTION_LIMIT = int(os.environ.get("OCTOPRINT_NANNY_REST_CONNECTION_LIMIT", 10))
+# seconds
+REST_DNS_CACHE_TTL = int(os.environ.get("OCTOPRINT_NANNY_REST_DNS_CACHE_TTL", 300))
+REST_KEEPALIVE_TIMEOUT = float(
+    os.environ.get("OCTOPRINT_NANNY_REST_KEEPALIVE_TIMEOUT", 60)
+)
+
+# backup uploads, see clients.upload.StreamingUpload
+UPLOAD_CHUNK_SIZE = int(os.environ.get("OCTOPRINT_NANNY_UPLOAD_CHUNK_SIZE", 256 * 1024))
+# seconds, total time allowed for one upload request
+UPLOAD_TIMEOUT = int(os.environ.get("OCTOPRINT_NANNY_UPLOAD_TIMEOUT", 60 * 60))
+
+# retry.CircuitBreaker, consecutive failures before calls fail fast, and seconds before a trial call is let through
+CIRCUIT_BREAKER_FAILURE_THRESHOLD = int(
+    os.environ.get("OCTOPRINT_NANNY_CIRCUIT_BREAKER_FAILURE_THRESHOLD", 5)
+)
+CIRCUIT_BREAKER_RESET_TIMEOUT = float(
+    os.environ.get("OCTOPRINT_NANNY_CIRCUIT_BREAKER_RESET_TIMEOUT", 30)
+)
+# retry.RetryBudget, retries allowed as a fraction of calls, plus a floor of retries per second
+RETRY_BUDGET_RATIO = float(os.environ.get("OCTOPRINT_NANNY_RETRY_BUDGET_RATIO", 0.2))
+RETRY_BUDGET_MIN_PER_SECOND = float(
+    os.environ.get("OCTOPRINT_NANNY_RETRY_BUDGET_MIN_PER_SECOND", 1)
+)
+
+# AsyncTaskWorker, threads available to run_in_executor (blocking file i/o, upload reads)
+WORKER_EXECUTOR_MAX_WORKERS = int(
+    os.environ.get("OCTOPRINT_NANNY_WORKER_EXECUTOR_MAX_WORKERS", 4)
+)
+# seconds on_shutdown waits for queued events and NATS batches to be published
+WORKER_SHUTDOWN_TIMEOUT = float(
+    os.environ.get("OCTOPRINT_NANNY_WORKER_SHUTDOWN_TIMEOUT", 5)
+)
+# seconds between event loop lag samples
+WORKER_LAG_INTERVAL = float(os.environ.get("OCTOPRINT_NANNY_WORKER_LAG_INTERVAL", 1))
+
+# pi.{pi_id}.octoprint.event.printer.job_progress message format, one of: full, delta
+# delta sends a full keyframe on job start and every PROGRESS_KEYFRAME_INTERVAL messages, only changed
+# progress fields in between, see events.ProgressDeltaEncoder
+PROGRESS_ENCODING = os.environ.get("OCTOPRINT_NANNY_PROGRESS_ENCODING", "full")
+PROGRESS_KEYFRAME_INTERVAL = int(
+    os.environ.get("OCTOPRINT_NANNY_PROGRESS_KEYFRAME_INTERVAL", 30)
+)
+
+# plugin logging, see utils.logs
+# recent events kept in memory for /printnanny/debug/events instead of logged to disk
+LOG_BUFFER_SIZE = int(os.environ.get("OCTOPRINT_NANNY_LOG_BUFFER_SIZE", 500))
+# sampled log lines: the first LOG_SAMPLE_FIRST occurrences of a key, then one in every LOG_SAMPLE_EVERY
+LOG_SAMPLE_FIRST = int(os.environ.get("OCTOPRINT_NANNY_LOG_SAMPLE_FIRST", 10))
+LOG_SAMPLE_EVERY = int(os.environ.get("OCTOPRINT_NANNY_LOG_SAMPLE_EVERY", 100))
+# characters of a payload's repr written to the log, full payloads are kept in the ring buffer
+LOG_PAYLOAD_MAXLEN = int(os.environ.get("OCTOPRINT_NANNY_LOG_PAYLOAD_MAXLEN", 200))
+
+# pi.{pi_id}.octoprint.telemetry.temperature, see telemetry.TemperatureTelemetry
+# seconds between PrinterInterface.get_current_temperatures() samples. 0 disables telemetry
+TELEMETRY_TEMPERATURE_SAMPLE_INTERVAL = float(
+    os.environ.get("OCTOPRINT_NANNY_TELEMETRY_TEMPERATURE_SAMPLE_INTERVAL", 2)
+)
+# seconds per aggregated window, one message is published per window. 0 disables telemetry
+TELEMETRY_TEMPERATURE_PUBLISH_INTERVAL = float(
+    os.environ.get("OCTOPRINT_NANNY_TELEMETRY_TEMPERATURE_PUBLISH_INTERVAL", 30)
+)
@@ -1,9 +1,51 @@
+import asyncio
+import functools
 import logging
 import nats
-from typing import Dict, Any, Optional, TypedDict, Callable, List
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Set,
+    Tuple,
+    TypedDict,
+)
 import socket
 import os
+import threading
+import time
+from octoprint_nanny.clients.nats import NatsConnectionManager
+from octoprint_nanny.env import (
+    NATS_BATCH_POLICIES,
+    NATS_COALESCE_WINDOWS,
+    NATS_RATE_LIMITS,
+    PROGRESS_ENCODING,
+    PROGRESS_KEYFRAME_INTERVAL,
+)
+from octoprint_nanny.exceptions import CircuitOpenError
+from octoprint_nanny.metrics import (
+    EVENT_PUBLISH_LATENCY,
+    NATS_MSG_BUILD_TIME,
+    NATS_MSG_SERIALIZE_TIME,
+    NATS_MSGS_FAILED,
+    NATS_RATE_LIMITED,
+)
+from octoprint_nanny.outbox import NatsOutbox
+from octoprint_nanny.ratelimit import RateLimit, RateLimiter
+from octoprint_nanny.retry import (
+    CircuitBreaker,
+    RetryBudget,
+    RetryPolicy,
+    call_with_retry,
+)
 from octoprint_nanny.utils import printnanny_os
+from octoprint_nanny.utils.encoder import dumps
+from octoprint_nanny.utils.logs import DEBUG_BUFFER, LazyRepr, log_sampled
+from octoprint_nanny.worker import CURRENT_EVENT, EventOutcome
 
 import printnanny_api_client.models
 
@@ -12,13 +54,24 @@ import printnanny_octoprint_models
 
 logger = logging.getLogger("octoprint.plugins.octoprint_nanny.events")
 
-PRINTNANNY_OS_NATS_URL = os.environ.get(
-    "PRINTNANNY_OS_NATS_URL", f"nats://{socket.gethostname()}:4223"
-)
+
+@functools.lru_cache(maxsize=None)
+def local_hostname() -> str:
+    return socket.gethostname()
+
+
+def printnanny_os_nats_url() -> str:
+    """
+    PrintNanny OS NATS server, resolved when a connection is created instead of at import
+    """
+    return os.environ.get("PRINTNANNY_OS_NATS_URL", f"nats://{local_hostname()}:4223")
+
 
 logger = logging.getLogger("octoprint.plugins.octoprint_nanny.nats")
 
-NATS_CONNECTION: Optional[nats.aio.client.Client] = None
+# default connection, used when try_publish_nats is called without a publisher
+NATS_CONNECTION: Optional[NatsConnectionManager] = None
+NATS_BATCH_PUBLISHER: Optional["NatsBatchPublisher"] = None
 
 
 class PrintJobDataMissing(Exception):
@@ -42,7 +95,8 @@ def octoprint_state_data_to_gcode_file(
         )
         return None
 
-    file_path = file_data.get("file_path")
+    # OctoPrint's job data calls it path
+    file_path = file_data.get("file_path", file_data.get("path"))
     if file_path is None:
         raise PrintJobDataMissing(
             "octoprint_state_data_to_gcode_file missing gcode file path: %s", file_data
@@ -50,12 +104,12 @@ def octoprint_state_data_to_gcode_file(
         return None
 
     return printnanny_octoprint_models.GcodeFile(
-        file_name=file_name,
-        file_path=file_path,
+        fileName=file_name,
+        filePath=file_path,
         display=file_data.get("display"),
         path=file_data.get("path"),
         origin=file_data.get("origin"),
-        timestamp=file_data.get("timestamp"),
+        timestamp=file_data.get("timestamp", file_data.get("date")),
         size=file_data.get("size"),
     )
 
@@ -71,6 +125,10 @@ def octoprint_state_data_to_filaments(
             toolName=k, length=v["length"], volume=v["volume"]
         )
         for k, v in filaments.items()
+        # length and volume are None until OctoPrint has analysed the file, e.g. SD card prints
+        if isinstance(v, dict)
+        and v.get("length") is not None
+        and v.get("volume") is not None
     ]
 
 
@@ -86,7 +144,8 @@ def octoprint_state_data_to_job(
     filaments = octoprint_state_data_to_filaments(job)
     return printnanny_octoprint_models.Job(
         file=file,
-        averagePrintTime=job["averagePrintTime"],
+        # only present once the file has been printed
+        averagePrintTime=job.get("averagePrintTime"),
         estimatedPrintTime=job["estimatedPrintTime"],
         lastPrintTime=job["lastPrintTime"],
         filaments=filaments,
@@ -101,75 +160,185 @@ def octoprint_state_data_to_progress(
         raise PrintJobDataMissing(
             "octoprint_state_data_to_progress missing progress data: %s", state_data
         )
+    # every field is optional, and None while no print is running
     return printnanny_octoprint_models.JobProgress(
-        completion=progress["completion"],
-        filepos=progress["filepos"],
-        printTime=progress["printTime"],
-        printTimeLeft=progress["printTimeLeft"],
-        printTimeLeftOrigin=progress["printTimeLeftOrigin"],
+        completion=progress.get("completion"),
+        filepos=progress.get("filepos"),
+        printTime=progress.get("printTime"),
+        printTimeLeft=progress.get("printTimeLeft"),
+        printTimeLeftOrigin=progress.get("printTimeLeftOrigin"),
     )
 
 
-# begin NATS message builders
-def printnanny_nats_gcode_event_msg(
-    event: str, *args
-) -> printnanny_octoprint_models.OctoPrintGcode:
-    if event == "Alert":
-        return printnanny_octoprint_models.OctoPrintGcode(
-            gcode=printnanny_octoprint_models.GcodeEvent.ALERT_M300
-        )
+# events the plugin's on_event enriches with the current job
+JOB_ENRICHED_EVENTS = frozenset(
+    [
+        "PrinterStateChanged",
+        printnanny_octoprint_models.JobStatus.PRINT_STARTED.value,
+        printnanny_octoprint_models.JobStatus.PRINT_FAILED.value,
+        printnanny_octoprint_models.JobStatus.PRINT_CANCELLING.value,
+        printnanny_octoprint_models.JobStatus.PRINT_CANELLED.value,
+        # OctoPrint's spelling of PRINT_CANELLED
+        "PrintCancelled",
+        printnanny_octoprint_models.JobStatus.PRINT_PAUSED.value,
+        printnanny_octoprint_models.JobStatus.PRINT_RESUMED.value,
+    ]
+)
 
-    elif event == "Cooling":
-        return printnanny_octoprint_models.OctoPrintGcode(
-            gcode=printnanny_octoprint_models.GcodeEvent.COOLING_M245
-        )
 
-    elif event == "Dwell":
-        return printnanny_octoprint_models.OctoPrintGcode(
-            gcode=printnanny_octoprint_models.GcodeEvent.DWELL_G4
-        )
+class JobSnapshotStats(TypedDict):
+    hits: int
+    misses: int
+    failures: int
+    key: Optional[str]
 
-    elif event == "Estop":
-        return printnanny_octoprint_models.OctoPrintGcode(
-            gcode=printnanny_octoprint_models.GcodeEvent.ESTOP_M112
-        )
-    # note: M600 is hard-coded here because OctoPrint doesn't pass along underlying gocde
-    # FilamentChange event can be triggered by M600, M701, M702 https://github.com/bitsy-ai/printnanny-os/issues/131#issuecomment-1314855952
-    # This will result in M701 and M702 events being ingested into PrintNanny's event system as M600 codes
-    elif event == "FilamentChange":
-        return printnanny_octoprint_models.OctoPrintGcode(
-            gcode=printnanny_octoprint_models.GcodeEvent.FILAMENT_CHANGE_M600
-        )
 
-    elif event == "Home":
-        return printnanny_octoprint_models.OctoPrintGcode(
-            gcode=printnanny_octoprint_models.GcodeEvent.HOME_G28
-        )
+def job_snapshot_key(job_data: Dict[Any, Any]) -> Tuple[Any, ...]:
+    """
+    Every field of OctoPrint's job data that octoprint_state_data_to_job copies into the Job model
+    """
+    file_data = job_data.get("file") or {}
+    filaments = job_data.get("filament") or {}
+    return (
+        file_data.get("name"),
+        file_data.get("path"),
+        file_data.get("file_path"),
+        file_data.get("display"),
+        file_data.get("origin"),
+        file_data.get("timestamp"),
+        file_data.get("date"),
+        file_data.get("size"),
+        job_data.get("averagePrintTime"),
+        job_data.get("estimatedPrintTime"),
+        job_data.get("lastPrintTime"),
+        tuple(
+            (k, v.get("length"), v.get("volume")) if isinstance(v, dict) else (k, v)
+            for k, v in sorted(filaments.items())
+        ),
+    )
 
-    elif event == "PowerOn":
-        return printnanny_octoprint_models.OctoPrintGcode(
-            gcode=printnanny_octoprint_models.GcodeEvent.POWER_ON_M80
-        )
 
-    elif event == "PowerOff":
-        return printnanny_octoprint_models.OctoPrintGcode(
-            printnanny_octoprint_models.GcodeEvent.POWER_ON_M81
+class JobSnapshot:
+    """
+    Last Job model built from OctoPrint's printer state data
+
+    Status and progress events during a print carry the same job, the Job, GcodeFile and Filament
+    models are only rebuilt when job_snapshot_key changes. Job data that doesn't validate (no file
+    selected, unanalysed SD card file) is cached as None. Called from OctoPrint's event and comm threads
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key: Optional[Tuple[Any, ...]] = None
+        self._job: Optional[printnanny_octoprint_models.Job] = None
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+
+    def get(
+        self, state_data: Dict[Any, Any]
+    ) -> Optional[printnanny_octoprint_models.Job]:
+        job_data = state_data.get("job")
+        if job_data is None:
+            raise PrintJobDataMissing(
+                "JobSnapshot.get missing job data: %s", state_data
+            )
+        key = job_snapshot_key(job_data)
+        with self._lock:
+            if key == self._key:
+                self.hits += 1
+                return self._job
+        try:
+            job = octoprint_state_data_to_job(state_data)
+        # pydantic.ValidationError is a ValueError
+        except (PrintJobDataMissing, KeyError, TypeError, ValueError) as e:
+            self.failures += 1
+            log_sampled(
+                logger,
+                logging.DEBUG,
+                "job_snapshot_failed",
+                "Job data did not validate, publishing job=None: %s",
+                LazyRepr(e),
+            )
+            job = None
+        with self._lock:
+            self._key = key
+            self._job = job
+            self.misses += 1
+        return job
+
+    def clear(self):
+        with self._lock:
+            self._key = None
+            self._job = None
+
+    def stats(self) -> JobSnapshotStats:
+        with self._lock:
+            key = self._key
+        return JobSnapshotStats(
+            hits=self.hits,
+            misses=self.misses,
+            failures=self.failures,
+            key=repr(key[:3]) if key is not None else None,
         )
-    raise ValueError(f"printnanny_nats_gcode_event_msg not support event={event}")
+
+
+JOB_SNAPSHOT = JobSnapshot()
+
+
+# begin NATS message builders
+
+# note: M600 is hard-coded here because OctoPrint doesn't pass along underlying gocde
+# FilamentChange event can be triggered by M600, M701, M702 https://github.com/bitsy-ai/printnanny-os/issues/131#issuecomment-1314855952
+# This will result in M701 and M702 events being ingested into PrintNanny's event system as M600 codes
+GCODE_EVENTS: Dict[str, printnanny_octoprint_models.GcodeEvent] = {
+    "Alert": printnanny_octoprint_models.GcodeEvent.ALERT_M300,
+    "Cooling": printnanny_octoprint_models.GcodeEvent.COOLING_M245,
+    "Dwell": printnanny_octoprint_models.GcodeEvent.DWELL_G4,
+    "Estop": printnanny_octoprint_models.GcodeEvent.ESTOP_M112,
+    "FilamentChange": printnanny_octoprint_models.GcodeEvent.FILAMENT_CHANGE_M600,
+    "Home": printnanny_octoprint_models.GcodeEvent.HOME_G28,
+    "PowerOn": printnanny_octoprint_models.GcodeEvent.POWER_ON_M80,
+    "PowerOff": printnanny_octoprint_models.GcodeEvent.POWER_OFF_M81,
+}
+
+OCTOPRINT_SERVER_STATUS_EVENTS: Dict[
+    str, printnanny_octoprint_models.OctoPrintServerStatus
+] = {
+    "Startup": printnanny_octoprint_models.OctoPrintServerStatus.STARTUP,
+    "Shutdown": printnanny_octoprint_models.OctoPrintServerStatus.SHUTDOWN,
+}
+
+JOB_STATUS_EVENTS: Dict[str, printnanny_octoprint_models.JobStatus] = {
+    status.value: status for status in printnanny_octoprint_models.JobStatus
+}
+# OctoPrint's event is PrintCancelled, printnanny_octoprint_models spells the value PrintCanelled
+JOB_STATUS_EVENTS[
+    "PrintCancelled"
+] = printnanny_octoprint_models.JobStatus.PRINT_CANELLED
+
+# PrinterStateChanged payload's state_id is the PrinterStatus member name
+PRINTER_STATUSES: Dict[
+    str, printnanny_octoprint_models.PrinterStatus
+] = printnanny_octoprint_models.PrinterStatus.__members__
+
+
+def printnanny_nats_gcode_event_msg(
+    event: str, *args
+) -> printnanny_octoprint_models.OctoPrintGcode:
+    gcode = GCODE_EVENTS.get(event)
+    if gcode is None:
+        raise ValueError(f"printnanny_nats_gcode_event_msg not support event={event}")
+    return printnanny_octoprint_models.OctoPrintGcode(gcode=gcode)
 
 
 def printnanny_nats_octoprint_server_status_msg(
     event: str, _payload: Dict[Any, Any]
 ) -> printnanny_octoprint_models.OctoPrintServerStatusChanged:
-    if event == "Startup":
-        return printnanny_octoprint_models.OctoPrintServerStatusChanged(
-            status=printnanny_octoprint_models.OctoPrintServerStatus.STARTUP
-        )
-    elif event == "Shutdown":
-        return printnanny_octoprint_models.OctoPrintServerStatusChanged(
-            status=printnanny_octoprint_models.OctoPrintServerStatus.SHUTDOWN
-        )
-    raise ValueError(f"build_gcode_event_msg does not support event={event}")
+    status = OCTOPRINT_SERVER_STATUS_EVENTS.get(event)
+    if status is None:
+        raise ValueError(f"build_gcode_event_msg does not support event={event}")
+    return printnanny_octoprint_models.OctoPrintServerStatusChanged(status=status)
 
 
 def printnanny_nats_printer_status_msg(
@@ -181,7 +350,11 @@ def printnanny_nats_printer_status_msg(
         raise ValueError(
             "Failed to get state_id field from event=%s payload=%s", event, payload
         )
-    status = getattr(printnanny_octoprint_models.PrinterStatus, status_str)
+    status = PRINTER_STATUSES.get(status_str)
+    if status is None:
+        raise ValueError(
+            "Unknown state_id field from event=%s payload=%s", event, payload
+        )
     return printnanny_octoprint_models.PrinterStatusChanged(status=status, job=job)
 
 
@@ -194,27 +367,12 @@ def printnanny_nats_print_progress_msg(
 def printnanny_nats_print_job_status_msg(
     event: str, payload: Dict[Any, Any]
 ) -> printnanny_octoprint_models.JobStatusChanged:
-    if event == printnanny_octoprint_models.JobStatus.PRINT_STARTED.value:
-        status = printnanny_octoprint_models.JobStatus.PRINT_STARTED
-    elif event == printnanny_octoprint_models.JobStatus.PRINT_FAILED.value:
-        status = printnanny_octoprint_models.JobStatus.PRINT_FAILED
-    elif event == printnanny_octoprint_models.JobStatus.PRINT_DONE.value:
-        status = printnanny_octoprint_models.JobStatus.PRINT_DONE
-    elif event == printnanny_octoprint_models.JobStatus.PRINT_CANCELLING.value:
-        status = printnanny_octoprint_models.JobStatus.PRINT_CANCELLING
-    elif event == printnanny_octoprint_models.JobStatus.PRINT_CANELLED.value:
-        status = printnanny_octoprint_models.JobStatus.PRINT_CANELLED
-    elif event == printnanny_octoprint_models.JobStatus.PRINT_PAUSED.value:
-        status = printnanny_octoprint_models.JobStatus.PRINT_PAUSED
-    elif event == printnanny_octoprint_models.JobStatus.PRINT_RESUMED.value:
-        status = printnanny_octoprint_models.JobStatus.PRINT_RESUMED
-
-    else:
+    status = JOB_STATUS_EVENTS.get(event)
+    if status is None:
         raise ValueError(
             "printnanny_nats_print_job_status_msg not configured to handle event=%s",
             event,
         )
-
     return printnanny_octoprint_models.JobStatusChanged(status=status)
 
 
@@ -312,15 +470,125 @@ EVENT_MAPPINGS: Dict[str, EventMapping] = {
 }
 
 
+# builders whose message does not depend on the event payload
+CONSTANT_MSG_BUILDERS = frozenset(
+    [printnanny_nats_gcode_event_msg, printnanny_nats_octoprint_server_status_msg]
+)
+
+
+class CompiledEventMapping(NamedTuple):
+    # resolved for the current Pi by NATS_SUBJECTS
+    nats_subject_template: str
+    msg_builder: Callable
+    # prebuilt message for events handled by CONSTANT_MSG_BUILDERS, otherwise None
+    constant_msg: Optional[Any]
+
+
+def compile_event_mappings(
+    mappings: Dict[str, EventMapping]
+) -> Dict[str, CompiledEventMapping]:
+    """
+    Resolve EVENT_MAPPINGS into a dispatch table, so publishing an event is a single dict lookup
+    """
+    registry = {}
+    for event, mapping in mappings.items():
+        builder_fn = mapping["msg_builder"]
+        if builder_fn is None:
+            raise ValueError(f"No msg_builder fn configured for event={event}")
+        constant_msg = (
+            builder_fn(event, {}) if builder_fn in CONSTANT_MSG_BUILDERS else None
+        )
+        registry[event] = CompiledEventMapping(
+            nats_subject_template=mapping["nats_subject"],
+            msg_builder=builder_fn,
+            constant_msg=constant_msg,
+        )
+    return registry
+
+
+EVENT_REGISTRY: Dict[str, CompiledEventMapping] = compile_event_mappings(EVENT_MAPPINGS)
+
+
+class NatsSubjectResolverStats(TypedDict):
+    pi_id: str
+    source: str
+    refreshes: int
+
+
+class NatsSubjectResolver:
+    """
+    NATS subject of every mapped event, resolved for the current Pi identity
+
+    The PrintNanny Cloud Pi id loaded into printnanny_os.PRINTNANNY_CLOUD_PI is preferred, the hostname is
+    used until it is loaded. Subjects are formatted once per pi_id, subject() checks that the loaded Pi
+    is the same object as last time and then does a single dict lookup
+    """
+
+    def __init__(self, mappings: Dict[str, EventMapping]):
+        self.mappings = mappings
+        self.refreshes = 0
+        self._by_pi_id: Dict[str, Dict[str, str]] = {}
+        self._pi: Optional[Any] = None
+        self._pi_id = ""
+        self._subjects: Dict[str, str] = {}
+        self._refresh(printnanny_os.PRINTNANNY_CLOUD_PI)
+
+    def _refresh(self, pi: Optional[Any]):
+        cloud_pi_id = getattr(pi, "id", None)
+        pi_id = str(cloud_pi_id) if cloud_pi_id is not None else local_hostname()
+        if pi_id != self._pi_id:
+            self._subjects = self.subjects_for(pi_id)
+            self._pi_id = pi_id
+            self.refreshes += 1
+            logger.info("Publishing NATS messages for pi_id=%s", pi_id)
+        self._pi = pi
+
+    def subjects_for(self, pi_id: str) -> Dict[str, str]:
+        subjects = self._by_pi_id.get(pi_id)
+        if subjects is None:
+            subjects = {
+                event: mapping["nats_subject"].format(pi_id=pi_id)
+                for event, mapping in self.mappings.items()
+            }
+            self._by_pi_id[pi_id] = subjects
+        return subjects
+
+    def subject(self, event: str) -> str:
+        pi = printnanny_os.PRINTNANNY_CLOUD_PI
+        if pi is not self._pi:
+            self._refresh(pi)
+        return self._subjects[event]
+
+    @property
+    def pi_id(self) -> str:
+        pi = printnanny_os.PRINTNANNY_CLOUD_PI
+        if pi is not self._pi:
+            self._refresh(pi)
+        return self._pi_id
+
+    def stats(self) -> NatsSubjectResolverStats:
+        return NatsSubjectResolverStats(
+            pi_id=self.pi_id,
+            source="hostname" if getattr(self._pi, "id", None) is None else "cloud",
+            refreshes=self.refreshes,
+        )
+
+
+NATS_SUBJECTS = NatsSubjectResolver(EVENT_MAPPINGS)
+
+# published by telemetry.TemperatureTelemetry, not mapped from an OctoPrint event
+TEMPERATURE_TELEMETRY_SUBJECT = "pi.{pi_id}.octoprint.telemetry.temperature"
+
+
 def should_publish_event(event: str, payload: Dict[Any, Any]) -> bool:
-    return event in EVENT_MAPPINGS.keys()
+    return event in EVENT_REGISTRY
 
 
 def octoprint_event_to_nats_subject(event: str, pi_id: str) -> Optional[str]:
-    mapping: Optional[EventMapping] = EVENT_MAPPINGS.get(event)
-    if mapping is None:
+    subject = NATS_SUBJECTS.subjects_for(pi_id).get(event)
+    if subject is None:
         raise ValueError("No NATS msg subject configured for OctoPrint event=%s", event)
-    return mapping["nats_subject"].format(pi_id=pi_id)
+    return subject
 
 
 async def sanitize_payload(data: Dict[Any, Any]) -> Dict[Any, Any]:
@@ -328,55 +596,606 @@ async def sanitize_payload(data: Dict[Any, Any]) -> Dict[Any, Any]:
         return client.sanitize_for_serialization(data)
 
 
-def build_nats_msg(event: str, payload: Dict[Any, Any]) -> str:
-    mapping: Optional[EventMapping] = EVENT_MAPPINGS.get(event)
-    if mapping is None:
+def build_nats_msg(event: str, payload: Dict[Any, Any]) -> bytes:
+    entry: Optional[CompiledEventMapping] = EVENT_REGISTRY.get(event)
+    if entry is None:
         raise ValueError("No NATS msg handler configured for OctoPrint event=%s", event)
-    builder_fn = mapping["msg_builder"]
-    if builder_fn is None:
-        raise ValueError(f"No msg_builder fn configured for event={event}")
 
-    msg = builder_fn(event, payload)
+    started = time.perf_counter()
+    msg = entry.constant_msg
+    if msg is None:
+        msg = entry.msg_builder(event, payload)
     if msg is None:
         raise ValueError(
             "Failed to build NATS message event=%s payload=%s", event, payload
         )
-    msg_json = msg.json()
-    return msg_json
+    built = time.perf_counter()
+    result = dumps(msg.dict())
+    NATS_MSG_BUILD_TIME.labels(event).observe(built - started)
+    NATS_MSG_SERIALIZE_TIME.labels(event).observe(time.perf_counter() - built)
+    return result
 
 
-async def try_publish_nats(event: str, payload: Dict[Any, Any]) -> bool:
-    if should_publish_event(event, payload):
+class ProgressDeltaEncoderStats(TypedDict):
+    seq: int
+    keyframe_seq: int
+    keyframes: int
+    deltas: int
 
-        global NATS_CONNECTION
-        if NATS_CONNECTION is None:
-            NATS_CONNECTION = await nats.connect(
-                servers=[PRINTNANNY_OS_NATS_URL],
+
+class ProgressDeltaEncoder:
+    """
+    Compact encoding of PrintProgress messages
+
+    Keyframes are the full JobProgressChanged message plus encoding="keyframe" and seq. Deltas carry
+    encoding="delta", seq, the seq of the keyframe they apply to and only the progress fields that changed
+    since the previous message. seq increases by one per message, so consumers can detect gaps and wait
+    for the next keyframe. A keyframe is sent after reset(), every keyframe_interval messages, and whenever
+    anything besides progress (job, storage, path) changes. Not thread-safe, used on the worker's event loop
+    """
+
+    def __init__(self, keyframe_interval: int = PROGRESS_KEYFRAME_INTERVAL):
+        if keyframe_interval < 1:
+            raise ValueError(f"keyframe_interval must be >= 1, got {keyframe_interval}")
+        self.keyframe_interval = keyframe_interval
+        self.seq = 0
+        self.keyframe_seq = 0
+        self.keyframes = 0
+        self.deltas = 0
+        self._base: Optional[Dict[str, Any]] = None
+        self._progress: Dict[str, Any] = {}
+        self._since_keyframe = 0
+
+    def reset(self):
+        """
+        Send a keyframe next, called when a job starts or changes status
+        """
+        self._base = None
+
+    def encode(self, msg: Dict[str, Any]) -> Dict[str, Any]:
+        self.seq += 1
+        progress = msg.get("progress") or {}
+        base = {k: v for k, v in msg.items() if k != "progress"}
+        if (
+            self._base is None
+            # the keyframe counts as one of keyframe_interval messages
+            or self._since_keyframe + 1 >= self.keyframe_interval
+            or base != self._base
+        ):
+            self._base = base
+            self._progress = dict(progress)
+            self._since_keyframe = 0
+            self.keyframe_seq = self.seq
+            self.keyframes += 1
+            return dict(msg, encoding="keyframe", seq=self.seq)
+
+        self._since_keyframe += 1
+        self.deltas += 1
+        changed = {k: v for k, v in progress.items() if self._progress.get(k) != v}
+        self._progress.update(changed)
+        return dict(
+            encoding="delta",
+            seq=self.seq,
+            keyframe_seq=self.keyframe_seq,
+            progress=changed,
+        )
+
+    def stats(self) -> ProgressDeltaEncoderStats:
+        return ProgressDeltaEncoderStats(
+            seq=self.seq,
+            keyframe_seq=self.keyframe_seq,
+            keyframes=self.keyframes,
+            deltas=self.deltas,
+        )
+
+
+def load_progress_delta_encoder(encoding: str) -> Optional[ProgressDeltaEncoder]:
+    if encoding == "full":
+        return None
+    if encoding == "delta":
+        return ProgressDeltaEncoder()
+    raise ValueError(f"Unsupported progress encoding: {encoding}")
+
+
+# None when OCTOPRINT_NANNY_PROGRESS_ENCODING=full
+PROGRESS_DELTA_ENCODER = load_progress_delta_encoder(PROGRESS_ENCODING)
+
+
+def build_nats_progress_payload(
+    event: str, payload: Dict[Any, Any], encoder: ProgressDeltaEncoder
+) -> bytes:
+    entry = EVENT_REGISTRY[event]
+    started = time.perf_counter()
+    msg = entry.msg_builder(event, payload)
+    built = time.perf_counter()
+    result = dumps(encoder.encode(msg.dict()))
+    NATS_MSG_BUILD_TIME.labels(event).observe(built - started)
+    NATS_MSG_SERIALIZE_TIME.labels(event).observe(time.perf_counter() - built)
+    return result
+
+
+# encoded payloads of events with a constant_msg, filled on first publish
+# cleared by the plugin on (re)load, see clear_constant_payload_cache
+CONSTANT_PAYLOAD_CACHE: Dict[str, bytes] = {}
+
+
+def build_nats_payload(event: str, payload: Dict[Any, Any]) -> bytes:
+    """
+    Build encoded NATS message payload for event, using CONSTANT_PAYLOAD_CACHE when possible
+    and PROGRESS_DELTA_ENCODER for PrintProgress when OCTOPRINT_NANNY_PROGRESS_ENCODING=delta
+    """
+    cached = CONSTANT_PAYLOAD_CACHE.get(event)
+    if cached is not None:
+        return cached
+    if PROGRESS_DELTA_ENCODER is not None:
+        if event == "PrintProgress":
+            return build_nats_progress_payload(event, payload, PROGRESS_DELTA_ENCODER)
+        if event in JOB_STATUS_EVENTS:
+            # first progress message of a started, resumed or restarted job is a keyframe
+            PROGRESS_DELTA_ENCODER.reset()
+    msg = build_nats_msg(event, payload)
+    if EVENT_REGISTRY[event].constant_msg is not None:
+        CONSTANT_PAYLOAD_CACHE[event] = msg
+    return msg
+
+
+def clear_constant_payload_cache():
+    CONSTANT_PAYLOAD_CACHE.clear()
+
+
+def constant_payload_cache_info() -> Dict[str, str]:
+    """
+    Cached payloads by event name, decoded for display
+    """
+    return {
+        event: payload.decode("utf-8")
+        for event, payload in CONSTANT_PAYLOAD_CACHE.items()
+    }
+
+
+class BatchPolicy(NamedTuple):
+    # flush after this many messages are buffered for a subject
+    max_messages: int
+    # flush this many milliseconds after the first message is buffered for a subject
+    max_delay_ms: float
+
+
+# max_messages=1 publishes and flushes immediately
+IMMEDIATE_BATCH_POLICY = BatchPolicy(max_messages=1, max_delay_ms=0)
+
+# keyed by nats_subject template (see EVENT_MAPPINGS)
+# server and job status transitions are rare and important, so they are not batched
+DEFAULT_NATS_BATCH_POLICIES: Dict[str, BatchPolicy] = {
+    "pi.{pi_id}.octoprint.event.printer.status": BatchPolicy(
+        max_messages=10, max_delay_ms=100
+    ),
+    "pi.{pi_id}.octoprint.event.printer.job_progress": BatchPolicy(
+        max_messages=10, max_delay_ms=250
+    ),
+    "pi.{pi_id}.octoprint.event.gcode": BatchPolicy(max_messages=25, max_delay_ms=100),
+}
+
+
+def load_nats_batch_policies(
+    overrides: Dict[str, Dict[str, Any]]
+) -> Dict[str, BatchPolicy]:
+    policies = dict(DEFAULT_NATS_BATCH_POLICIES)
+    for subject, policy in overrides.items():
+        policies[subject] = BatchPolicy(**policy)
+    return policies
+
+
+NATS_BATCH_POLICIES_BY_SUBJECT = load_nats_batch_policies(NATS_BATCH_POLICIES)
+
+
+def nats_batch_policy(event: str) -> BatchPolicy:
+    mapping: Optional[EventMapping] = EVENT_MAPPINGS.get(event)
+    if mapping is None:
+        return IMMEDIATE_BATCH_POLICY
+    return NATS_BATCH_POLICIES_BY_SUBJECT.get(
+        mapping["nats_subject"], IMMEDIATE_BATCH_POLICY
+    )
+
+
+# messages on these subjects are written to NatsOutbox while the NATS connection is down,
+# and replayed once it comes back. keyed by nats_subject template (see EVENT_MAPPINGS)
+NATS_OUTBOX_SUBJECTS = frozenset(
+    [
+        "pi.{pi_id}.octoprint.event.server.startup",
+        "pi.{pi_id}.octoprint.event.server.shutdown",
+        "pi.{pi_id}.octoprint.event.printer.status",
+        "pi.{pi_id}.octoprint.event.printer.job_status",
+    ]
+)
+
+
+def nats_outbox_enabled(event: str) -> bool:
+    mapping: Optional[EventMapping] = EVENT_MAPPINGS.get(event)
+    return mapping is not None and mapping["nats_subject"] in NATS_OUTBOX_SUBJECTS
+
+
+# short: nats-py already buffers and reconnects on its own, and a stuck batch holds up its subject
+NATS_RETRY_POLICY = RetryPolicy(
+    retry_on=(nats.errors.Error, asyncio.TimeoutError),
+    max_tries=3,
+    max_time=5,
+    base_delay=0.1,
+    max_delay=1.0,
+)
+
+
+class NatsBatchPublisher:
+    """
+    Buffers built NATS messages per subject and publishes them as a batch,
+    calling flush() once per batch instead of once per message
+
+    A subject's batch is flushed when it holds policy.max_messages or
+    policy.max_delay_ms after its first message was buffered, whichever happens first
+
+    If an outbox is configured, durable messages are written to it instead when the
+    connection is unhealthy, when their batch fails to publish, or while older messages are waiting to be replayed
+
+    Failed batches are retried per retry_policy. Once breaker opens, batches fail
+    immediately (going to the outbox if durable) until the broker recovers
+    """
+
+    def __init__(
+        self,
+        connection: NatsConnectionManager,
+        flush_timeout: int = 10,
+        outbox: Optional[NatsOutbox] = None,
+        retry_policy: RetryPolicy = NATS_RETRY_POLICY,
+    ):
+        self.connection = connection
+        self.flush_timeout = flush_timeout
+        self.outbox = outbox
+        self.retry_policy = retry_policy
+        self.breaker = CircuitBreaker("nats")
+        self.retry_budget = RetryBudget()
+        # subjects whose messages are written to outbox on failure
+        self._durable: Set[str] = set()
+        self._batches: Dict[str, List[bytes]] = {}
+        # (event, enqueued_at) for batched messages built from a queued event, see worker.CURRENT_EVENT
+        self._enqueued: Dict[str, List[Tuple[str, float]]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        # hold references to timer-driven flushes until they finish
+        self._tasks: Set[asyncio.Future] = set()
+        self.published = 0
+        self.failed = 0
+
+    async def publish(
+        self,
+        subject: str,
+        msg: bytes,
+        policy: BatchPolicy = IMMEDIATE_BATCH_POLICY,
+        durable: bool = False,
+    ) -> bool:
+        if durable and self.outbox is not None:
+            # preserve ordering: nothing durable skips ahead of the outbox backlog
+            if not self.connection.healthy or self.outbox:
+                self.outbox.append(subject, msg)
+                if self.connection.healthy:
+                    # resume a replay that stopped on a failed publish
+                    task = asyncio.ensure_future(self.replay_outbox())
+                    self._tasks.add(task)
+                    task.add_done_callback(self._tasks.discard)
+                return True
+            self._durable.add(subject)
+        batch = self._batches.setdefault(subject, [])
+        batch.append(msg)
+        current = CURRENT_EVENT.get()
+        if current is not None:
+            self._enqueued.setdefault(subject, []).append(current)
+        if len(batch) >= policy.max_messages or policy.max_delay_ms <= 0:
+            return await self.flush_subject(subject)
+        if subject not in self._timers:
+            loop = asyncio.get_running_loop()
+            self._timers[subject] = loop.call_later(
+                policy.max_delay_ms / 1000, self._on_timer, subject
             )
-            logger.info("Connected to NATS server: %s", PRINTNANNY_OS_NATS_URL)
+        return True
+
+    def _on_timer(self, subject: str):
+        self._timers.pop(subject, None)
+        task = asyncio.ensure_future(self.flush_subject(subject))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush_subject(self, subject: str) -> bool:
+        timer = self._timers.pop(subject, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._batches.pop(subject, None)
+        enqueued = self._enqueued.pop(subject, [])
+        if not batch:
+            return True
+        # messages already handed to the connection, a retry only publishes the rest and flushes again
+        sent = 0
+
+        async def publish_batch():
+            nonlocal sent
+            for msg in batch[sent:]:
+                await self.connection.publish(subject, msg)
+                sent += 1
+            await self.connection.flush(timeout=self.flush_timeout)
 
-        hostname = socket.gethostname()
-        subject = octoprint_event_to_nats_subject(event, hostname)
-        if subject is None:
-            return False
-        msg = build_nats_msg(event, payload)
         try:
-            if msg:
-                await NATS_CONNECTION.publish(subject, msg.encode("utf-8"))
-                logger.info(
-                    "Published NATS message: subject=%s message=%s", subject, msg
-                )
+            await call_with_retry(
+                publish_batch,
+                policy=self.retry_policy,
+                breaker=self.breaker,
+                budget=self.retry_budget,
+            )
+        except Exception as e:
+            self.failed += len(batch)
+            NATS_MSGS_FAILED.labels(type(e).__name__).inc(len(batch))
+            # the breaker already logged the outage
+            log = logger.debug if isinstance(e, CircuitOpenError) else logger.error
+            log(
+                "Error publishing NATS batch subject=%s count=%s error=%s",
+                subject,
+                len(batch),
+                str(e),
+            )
+            if self.outbox is not None and subject in self._durable:
+                for msg in batch:
+                    self.outbox.append(subject, msg)
                 return True
             return False
+        self.published += len(batch)
+        flushed_at = time.monotonic()
+        for event, enqueued_at in enqueued:
+            EVENT_PUBLISH_LATENCY.labels(event).observe(flushed_at - enqueued_at)
+        size = sum(len(msg) for msg in batch)
+        DEBUG_BUFFER.record("nats_batch", subject, count=len(batch), msgs=batch)
+        log_sampled(
+            logger,
+            logging.INFO,
+            subject,
+            "Published NATS batch: subject=%s count=%s bytes=%s",
+            subject,
+            len(batch),
+            size,
+        )
+        return True
+
+    async def flush(self) -> bool:
+        results = [await self.flush_subject(subject) for subject in list(self._batches)]
+        return all(results)
+
+    async def _publish_replayed(self, subject: str, msg: bytes) -> bool:
+        if not self.connection.healthy:
+            return False
+        try:
+            await self.connection.publish(subject, msg)
+            await self.connection.flush(timeout=self.flush_timeout)
         except Exception as e:
-            logger.error(
-                "Error publishing NATS message subject=%s error=%s", subject, str(e)
+            logger.warning(
+                "Error replaying NATS outbox message subject=%s error=%s", subject, e
             )
             return False
+        self.published += 1
+        return True
+
+    async def replay_outbox(self):
+        """
+        Replay messages queued in outbox, called when the NATS connection is (re)established
+        """
+        if self.outbox:
+            await self.outbox.replay(self._publish_replayed)
+
+
+async def default_nats_publisher() -> NatsBatchPublisher:
+    """
+    Lazily create the module-level NatsConnectionManager, connecting in the background
+
+    Never waits for the connection, messages published before it is up are dropped
+    """
+    global NATS_CONNECTION
+    global NATS_BATCH_PUBLISHER
+    if NATS_CONNECTION is None:
+        NATS_CONNECTION = NatsConnectionManager(servers=[printnanny_os_nats_url()])
+        await NATS_CONNECTION.start()
+    if NATS_BATCH_PUBLISHER is None:
+        NATS_BATCH_PUBLISHER = NatsBatchPublisher(NATS_CONNECTION)
+    return NATS_BATCH_PUBLISHER
+
+
+# keyed by nats_subject template (see EVENT_MAPPINGS), window in milliseconds
+# job_status and server subjects are never coalesced
+DEFAULT_NATS_COALESCE_WINDOWS: Dict[str, float] = {
+    "pi.{pi_id}.octoprint.event.printer.status": 1000,
+    "pi.{pi_id}.octoprint.event.printer.job_progress": 1000,
+}
+
+PublishFn = Callable[[str, Dict[Any, Any]], Awaitable[EventOutcome]]
+
+
+class EventCoalescer:
+    """
+    Keeps only the latest event per NATS subject inside a time window, before any message is built
+
+    The first event for a subject is published right away and opens a window. Events received while
+    the window is open replace each other, and the latest one is published when the window closes.
+    flush() publishes held events early, so a pass-through event never overtakes older state
+    """
+
+    def __init__(self, windows: Dict[str, float]):
+        # subject template -> window in seconds
+        self.windows = {k: v / 1000 for k, v in windows.items() if v > 0}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        self._pending: Dict[str, Tuple[str, Dict[Any, Any], PublishFn]] = {}
+        self._tasks: Set[asyncio.Future] = set()
+        self.coalesced = 0
+
+    def coalesces(self, event: str) -> bool:
+        mapping: Optional[EventMapping] = EVENT_MAPPINGS.get(event)
+        return mapping is not None and mapping["nats_subject"] in self.windows
+
+    def submit(self, event: str, payload: Dict[Any, Any], publish: PublishFn) -> bool:
+        """
+        Returns True if the caller should publish event now, False if it is held for the end of the window
+        """
+        key = EVENT_MAPPINGS[event]["nats_subject"]
+        if key in self._timers:
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = (event, payload, publish)
+            return False
+        self._open_window(key)
+        return True
+
+    def _open_window(self, key: str):
+        loop = asyncio.get_running_loop()
+        self._timers[key] = loop.call_later(self.windows[key], self._close_window, key)
+
+    def _close_window(self, key: str):
+        self._timers.pop(key, None)
+        pending = self._pending.pop(key, None)
+        if pending is not None:
+            event, payload, publish = pending
+            # publishing now starts a new window
+            self._open_window(key)
+            task = asyncio.ensure_future(publish(event, payload))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def hold(self, event: str, payload: Dict[Any, Any], publish: PublishFn):
+        """
+        Hold event for the end of its subject's window, replacing any event already held
+        """
+        key = EVENT_MAPPINGS[event]["nats_subject"]
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = (event, payload, publish)
+        if key not in self._timers:
+            self._open_window(key)
+
+    async def flush(self) -> None:
+        pending = list(self._pending.values())
+        self._pending.clear()
+        for event, payload, publish in pending:
+            await publish(event, payload)
+
+
+NATS_EVENT_COALESCER = EventCoalescer(
+    {**DEFAULT_NATS_COALESCE_WINDOWS, **NATS_COALESCE_WINDOWS}
+)
+
+
+# keyed by nats_subject template (see EVENT_MAPPINGS), checked before any message is built
+# a firmware loop repeating Dwell/Home, or a flood of progress or state changes, can't saturate the Pi
+# server and job status subjects are never limited
+DEFAULT_NATS_RATE_LIMITS: Dict[str, RateLimit] = {
+    "pi.{pi_id}.octoprint.event.gcode": RateLimit(rate=10, burst=50),
+    "pi.{pi_id}.octoprint.event.printer.status": RateLimit(rate=5, burst=20),
+    "pi.{pi_id}.octoprint.event.printer.job_progress": RateLimit(rate=2, burst=10),
+}
+
+
+def load_nats_rate_limits(
+    overrides: Dict[str, Optional[Dict[str, Any]]]
+) -> Dict[str, RateLimit]:
+    limits = dict(DEFAULT_NATS_RATE_LIMITS)
+    for subject, limit in overrides.items():
+        if limit is None:
+            limits.pop(subject, None)
+        else:
+            limits[subject] = RateLimit(**limit)
+    return limits
+
+
+NATS_RATE_LIMITER = RateLimiter(load_nats_rate_limits(NATS_RATE_LIMITS))
+
+
+async def publish_nats_event(
+    event: str, payload: Dict[Any, Any], publisher: NatsBatchPublisher
+) -> EventOutcome:
+    """
+    Build NATS message for event and hand it to publisher
+    """
+    durable = publisher.outbox is not None and nats_outbox_enabled(event)
+    # check connection health before doing any work to build the message
+    if not publisher.connection.healthy and not durable:
+        logger.debug("NATS connection is not healthy, skipping event=%s", event)
+        return EventOutcome.NATS_UNAVAILABLE
+
+    subject = NATS_SUBJECTS.subject(event)
+    msg = build_nats_payload(event, payload)
+    try:
+        if msg and await publisher.publish(
+            subject,
+            msg,
+            nats_batch_policy(event),
+            durable=durable,
+        ):
+            return EventOutcome.PUBLISHED
+        return EventOutcome.FAILED
+    except Exception as e:
+        logger.error(
+            "Error publishing NATS message subject=%s error=%s", subject, str(e)
+        )
+        return EventOutcome.FAILED
+
+
+async def publish_nats_telemetry(
+    msg: bytes,
+    publisher: NatsBatchPublisher,
+    subject: str = TEMPERATURE_TELEMETRY_SUBJECT,
+) -> bool:
+    """
+    Publish a telemetry message built outside of EVENT_MAPPINGS, subject is a pi_id template
+    """
+    if not publisher.connection.healthy:
+        logger.debug("NATS connection is not healthy, skipping subject=%s", subject)
+        return False
+    return await publisher.publish(
+        subject.format(pi_id=NATS_SUBJECTS.pi_id),
+        msg,
+        NATS_BATCH_POLICIES_BY_SUBJECT.get(subject, IMMEDIATE_BATCH_POLICY),
+    )
+
+
+async def try_publish_nats(
+    event: str,
+    payload: Dict[Any, Any],
+    publisher: Optional[NatsBatchPublisher] = None,
+    coalescer: EventCoalescer = NATS_EVENT_COALESCER,
+    rate_limiter: RateLimiter = NATS_RATE_LIMITER,
+) -> EventOutcome:
+    """
+    Publish event to its NATS subject, unless it is coalesced, rate limited or untracked
+    """
+    if should_publish_event(event, payload):
+        if publisher is None:
+            publisher = await default_nats_publisher()
+        publish = functools.partial(publish_nats_event, publisher=publisher)
+        subject = EVENT_MAPPINGS[event]["nats_subject"]
+
+        coalesces = coalescer.coalesces(event)
+        if coalesces and not coalescer.submit(event, payload, publish):
+            return EventOutcome.COALESCED
+        # over budget: coalescing subjects keep the latest event for the end of the window,
+        # others are dropped, either way without building a message
+        if not rate_limiter.allow(subject):
+            if coalesces:
+                NATS_RATE_LIMITED.labels(subject, "coalesced").inc()
+                coalescer.hold(event, payload, publish)
+                return EventOutcome.COALESCED
+            NATS_RATE_LIMITED.labels(subject, "dropped").inc()
+            return EventOutcome.RATE_LIMITED
+        if not coalesces:
+            # publish held progress/status before a state transition, so it can't arrive late
+            await coalescer.flush()
+        return await publish(event, payload)
     else:
-        logger.info(
+        DEBUG_BUFFER.record("untracked", event, payload=payload)
+        log_sampled(
+            logger,
+            logging.INFO,
+            f"untracked:{event}",
             "NATS subject not configured for event=%s, refusing to publish payload=%s",
             event,
-            payload,
+            LazyRepr(payload),
         )
-        return False
+        return EventOutcome.UNTRACKED
@@ -9,3 +9,20 @@ class SetupIncompleteError(Exception):
         **kwargs,
     ):
         super().__init__(msg, *args, **kwargs)
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling a dependency whose circuit breaker is open
+    """
+
+    def __init__(self, name: str, retry_in: float):
+        self.name = name
+        self.retry_in = retry_in
+        super().__init__(f"Circuit {name} is open, retrying in {retry_in:0.1f}s")
+
+
+class StartupStepError(Exception):
+    """
+    Raised by a StartupPipeline step that ran but could not finish its work
+    """
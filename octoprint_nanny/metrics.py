@@ -0,0 +1,328 @@
+import bisect
+import math
+import threading
+from typing import Dict, Generic, List, Sequence, Tuple, TypeVar, Union
+
+# Prometheus text exposition format
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def hdr_buckets(
+    lowest: float = 1e-5, highest: float = 60.0, sub_buckets: int = 2
+) -> Tuple[float, ...]:
+    """
+    Bucket upper bounds covering [lowest, highest] with constant relative error, like an HDR histogram:
+    each power of two is split into sub_buckets linear steps
+    """
+    bounds = []
+    exponent = math.floor(math.log2(lowest))
+    while True:
+        base = 2.0**exponent
+        for step in range(1, sub_buckets + 1):
+            bound = base * (1 + step / sub_buckets)
+            if bound >= lowest:
+                bounds.append(bound)
+            if bound >= highest:
+                return tuple(bounds)
+        exponent += 1
+
+
+DEFAULT_BUCKETS = hdr_buckets()
+
+
+def _format_labels(labelnames: Sequence[str], labelvalues: Sequence[str]) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in zip(labelnames, labelvalues)
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, int) or value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Histogram:
+    """
+    Fixed-size histogram: a count per bucket, allocated once, plus sum and total count
+
+    observe() is a bisect and two additions, so it's cheap enough for the publish hot path.
+    Observations are expected from AsyncTaskWorker's event loop thread only
+    """
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.bounds = bounds
+        # last slot counts observations above the highest bound
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """
+        Upper bound of the bucket holding the q-th quantile
+        """
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return math.inf
+
+
+class Counter:
+    """
+    Monotonic counter, safe to increment from any thread without a lock
+
+    Each thread adds to its own cell, so increments never race. Reading sums the cells
+    """
+
+    __slots__ = ("_cells",)
+
+    def __init__(self):
+        self._cells: Dict[int, List[float]] = {}
+
+    def inc(self, amount: float = 1):
+        ident = threading.get_ident()
+        cell = self._cells.get(ident)
+        if cell is None:
+            # dict.setdefault is atomic under the GIL
+            cell = self._cells.setdefault(ident, [0])
+        cell[0] += amount
+
+    @property
+    def value(self) -> float:
+        return sum(cell[0] for cell in list(self._cells.values()))
+
+
+T = TypeVar("T", Counter, Histogram)
+
+
+class MetricFamily(Generic[T]):
+    """
+    Metrics of one name, one child per combination of label values
+    """
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], T] = {}
+
+    def _new_child(self) -> T:
+        raise NotImplementedError
+
+    def labels(self, *labelvalues: str) -> T:
+        child = self._children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(
+                    f"{self.name} expects labels {self.labelnames}, got {labelvalues}"
+                )
+            child = self._children.setdefault(labelvalues, self._new_child())
+        return child
+
+    def render(self, lines: List[str]):
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.type}")
+        for labelvalues, child in list(self._children.items()):
+            self._render_child(lines, labelvalues, child)
+
+    def _render_child(self, lines: List[str], labelvalues: Tuple[str, ...], child: T):
+        raise NotImplementedError
+
+
+class CounterFamily(MetricFamily[Counter]):
+    type = "counter"
+
+    def _new_child(self) -> Counter:
+        return Counter()
+
+    def inc(self, amount: float = 1):
+        self.labels().inc(amount)
+
+    def _render_child(
+        self, lines: List[str], labelvalues: Tuple[str, ...], child: Counter
+    ):
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}{labels} {_format_value(child.value)}")
+
+
+class HistogramFamily(MetricFamily[Histogram]):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        bounds: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.bounds = bounds
+        # formatted "name_bucket{labels,le=...} " strings, they never change once a child exists
+        self._bucket_prefixes: Dict[Tuple[str, ...], List[str]] = {}
+
+    def _new_child(self) -> Histogram:
+        return Histogram(self.bounds)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _render_child(
+        self, lines: List[str], labelvalues: Tuple[str, ...], child: Histogram
+    ):
+        prefixes = self._bucket_prefixes.get(labelvalues)
+        if prefixes is None:
+            prefixes = self._bucket_prefixes[labelvalues] = [
+                self.name
+                + "_bucket"
+                + _format_labels(
+                    self.labelnames + ("le",),
+                    labelvalues + (_format_value(bound),),
+                )
+                + " "
+                for bound in self.bounds + (math.inf,)
+            ]
+        cumulative = 0
+        for prefix, count in zip(prefixes, child.counts):
+            cumulative += count
+            lines.append(prefix + str(cumulative))
+        labels = _format_labels(self.labelnames, labelvalues)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Union[CounterFamily, HistogramFamily]] = {}
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> CounterFamily:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = CounterFamily(name, documentation, labelnames)
+            self._metrics[name] = metric
+        assert isinstance(metric, CounterFamily)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        bounds: Tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> HistogramFamily:
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = HistogramFamily(name, documentation, labelnames, bounds)
+            self._metrics[name] = metric
+        assert isinstance(metric, HistogramFamily)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            metric.render(lines)
+        lines.append("")
+        return "\n".join(lines)
+
+
+REGISTRY = MetricsRegistry()
+
+EVENT_LOOP_LAG = REGISTRY.histogram(
+    "octoprint_nanny_worker_loop_lag_seconds",
+    "Delay between when AsyncTaskWorker's event loop should have woken a timer and when it did",
+)
+EVENT_PUBLISH_LATENCY = REGISTRY.histogram(
+    "octoprint_nanny_event_publish_latency_seconds",
+    "Time from on_event enqueueing an OctoPrint event to its NATS batch being flushed",
+    ["event"],
+)
+NATS_MSG_BUILD_TIME = REGISTRY.histogram(
+    "octoprint_nanny_nats_msg_build_seconds",
+    "Time spent building the NATS message model for an OctoPrint event",
+    ["event"],
+)
+NATS_MSG_SERIALIZE_TIME = REGISTRY.histogram(
+    "octoprint_nanny_nats_msg_serialize_seconds",
+    "Time spent serializing a NATS message model to JSON",
+    ["event"],
+)
+
+EVENTS_SEEN = REGISTRY.counter(
+    "octoprint_nanny_events_seen_total",
+    "OctoPrint events received by on_event",
+    ["event"],
+)
+EVENTS_PUBLISHED = REGISTRY.counter(
+    "octoprint_nanny_events_published_total",
+    "OctoPrint events handed to the NATS publisher",
+    ["event"],
+)
+EVENTS_COALESCED = REGISTRY.counter(
+    "octoprint_nanny_events_coalesced_total",
+    "OctoPrint events held or replaced by a newer event of the same NATS subject",
+    ["event"],
+)
+EVENTS_DROPPED = REGISTRY.counter(
+    "octoprint_nanny_events_dropped_total",
+    "OctoPrint events discarded before publishing, by reason",
+    ["reason"],
+)
+EVENTS_FAILED = REGISTRY.counter(
+    "octoprint_nanny_events_failed_total",
+    "OctoPrint events whose publish handler failed, by reason",
+    ["reason"],
+)
+NATS_MSGS_FAILED = REGISTRY.counter(
+    "octoprint_nanny_nats_msgs_failed_total",
+    "NATS messages in batches that failed to publish, by error",
+    ["reason"],
+)
+NATS_RATE_LIMITED = REGISTRY.counter(
+    "octoprint_nanny_nats_rate_limited_total",
+    "OctoPrint events over their NATS subject's rate limit, by subject template and action (dropped, coalesced)",
+    ["subject", "action"],
+)
+NATS_CONNECTION_EVENTS = REGISTRY.counter(
+    "octoprint_nanny_nats_connection_events_total",
+    "NATS connection lifecycle events: connect, reconnect, disconnect, error",
+    ["event"],
+)
+PRINTNANNY_CLI_CALLS = REGISTRY.counter(
+    "octoprint_nanny_printnanny_cli_calls_total",
+    "printnanny CLI subprocesses, by command and result",
+    ["command", "result"],
+)
+PRINTNANNY_CLI_DURATION = REGISTRY.histogram(
+    "octoprint_nanny_printnanny_cli_duration_seconds",
+    "printnanny CLI subprocess run time",
+    ["command"],
+)
+REST_REQUESTS = REGISTRY.counter(
+    "octoprint_nanny_rest_requests_total",
+    "PrintNanny Cloud REST API calls, by endpoint and HTTP status",
+    ["endpoint", "status"],
+)
@@ -0,0 +1,368 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import time
+import zlib
+from typing import (
+    IO,
+    Awaitable,
+    Callable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    TypedDict,
+)
+
+from octoprint_nanny.env import (
+    OUTBOX_FSYNC_EVERY,
+    OUTBOX_FSYNC_INTERVAL,
+    OUTBOX_MAX_BYTES,
+    OUTBOX_MAX_SEGMENT_BYTES,
+    OUTBOX_REPLAY_RATE,
+)
+
+logger = logging.getLogger("octoprint.plugins.octoprint_nanny.outbox")
+
+# frame header: subject length (u16), payload length (u32), crc32 of subject + payload (u32)
+FRAME_HEADER = struct.Struct(">HII")
+SEGMENT_SUFFIX = ".seg"
+# segments with a frame that fails its crc check are renamed, not deleted, for inspection
+CORRUPT_SUFFIX = ".corrupt"
+CURSOR_FILENAME = "cursor.json"
+
+
+class OutboxStats(TypedDict):
+    path: str
+    segments: int
+    bytes: int
+    appended: int
+    replayed: int
+    dropped_bytes: int
+    corrupt: int
+    corrupt_bytes: int
+
+
+def encode_frame(subject: str, payload: bytes) -> bytes:
+    subject_bytes = subject.encode("utf-8")
+    crc = zlib.crc32(payload, zlib.crc32(subject_bytes))
+    return (
+        FRAME_HEADER.pack(len(subject_bytes), len(payload), crc)
+        + subject_bytes
+        + payload
+    )
+
+
+class CorruptFrameError(Exception):
+    def __init__(self, seq: int, offset: int):
+        super().__init__(
+            f"Corrupt frame in NATS outbox segment {seq} at offset {offset}"
+        )
+        self.seq = seq
+        self.offset = offset
+
+
+class NatsOutbox:
+    """
+    Append-only, segment-based on-disk queue of NATS messages that could not be published
+
+    Messages are appended to numbered segment files in a compact binary framing (see FRAME_HEADER).
+    Each append is written through to the OS, fsync is batched every fsync_every appends or fsync_interval seconds.
+    replay() publishes messages in append order at no more than replay_rate messages per second,
+    deleting segments once they are fully replayed. The replay position is persisted in cursor.json,
+    so delivery is at-least-once across restarts.
+
+    A partial frame at the end of a segment is a torn write and ends the segment. A frame failing its
+    crc check moves the segment aside (CORRUPT_SUFFIX), frames after it are counted in corrupt_bytes.
+
+    Not thread-safe, all calls are expected to come from AsyncTaskWorker's event loop. File i/o runs on
+    the loop too: append() writes one frame, and only every fsync_every-th append (or one per
+    fsync_interval) waits for fsync. Only rare status transitions are durable (see NATS_OUTBOX_SUBJECTS)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_segment_bytes: int = OUTBOX_MAX_SEGMENT_BYTES,
+        max_bytes: int = OUTBOX_MAX_BYTES,
+        fsync_every: int = OUTBOX_FSYNC_EVERY,
+        fsync_interval: float = OUTBOX_FSYNC_INTERVAL,
+        replay_rate: float = OUTBOX_REPLAY_RATE,
+    ):
+        self.path = path
+        self.max_segment_bytes = max_segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.replay_rate = replay_rate
+
+        os.makedirs(path, exist_ok=True)
+        self._segments: List[int] = self._list_segments()
+        self._bytes = sum(self._segment_size(seq) for seq in self._segments)
+        self._cursor: Tuple[int, int] = self._load_cursor()
+        self._writer: Optional[IO[bytes]] = None
+        self._writer_seq: Optional[int] = None
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._replaying = False
+        # segment replay() is reading
+        self._replay_seq: Optional[int] = None
+        # segments opened for writing by this instance
+        self._written_segments: Set[int] = set()
+
+        self.appended = 0
+        self.replayed = 0
+        self.dropped_bytes = 0
+        self.corrupt = 0
+        self.corrupt_bytes = 0
+
+    def __bool__(self) -> bool:
+        """
+        True if there are messages waiting to be replayed
+        """
+        if not self._segments:
+            return False
+        seq, offset = self._cursor
+        consumed = offset if seq == self._segments[0] else 0
+        return self._bytes > consumed
+
+    def _segment_path(self, seq: int) -> str:
+        return os.path.join(self.path, f"{seq:012d}{SEGMENT_SUFFIX}")
+
+    def _segment_size(self, seq: int) -> int:
+        try:
+            return os.path.getsize(self._segment_path(seq))
+        except FileNotFoundError:
+            return 0
+
+    def _list_segments(self) -> List[int]:
+        return sorted(
+            int(name[: -len(SEGMENT_SUFFIX)])
+            for name in os.listdir(self.path)
+            if name.endswith(SEGMENT_SUFFIX)
+        )
+
+    def _load_cursor(self) -> Tuple[int, int]:
+        try:
+            with open(os.path.join(self.path, CURSOR_FILENAME), "r") as f:
+                cursor = json.load(f)
+            return cursor["segment"], cursor["offset"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            logger.warning("Ignoring invalid outbox cursor in %s: %s", self.path, e)
+        return (self._segments[0] if self._segments else 0, 0)
+
+    def _save_cursor(self):
+        cursor_path = os.path.join(self.path, CURSOR_FILENAME)
+        tmp_path = f"{cursor_path}.tmp"
+        seq, offset = self._cursor
+        with open(tmp_path, "w") as f:
+            json.dump(dict(segment=seq, offset=offset), f)
+        os.replace(tmp_path, cursor_path)
+
+    def _open_writer(self, rotate: bool = False):
+        # a segment left by a previous run may end in a torn write, never append after it
+        if (
+            not rotate
+            and self._segments
+            and self._segments[-1] in self._written_segments
+            and self._segment_size(self._segments[-1]) < self.max_segment_bytes
+        ):
+            seq = self._segments[-1]
+        else:
+            seq = self._segments[-1] + 1 if self._segments else self._cursor[0]
+            self._segments.append(seq)
+            self._written_segments.add(seq)
+        self._writer = open(self._segment_path(seq), "ab")
+        self._writer_seq = seq
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self.sync()
+            self._writer.close()
+            self._writer = None
+            self._writer_seq = None
+
+    def _delete_segment(self, seq: int):
+        if seq == self._writer_seq:
+            self._close_writer()
+        size = self._segment_size(seq)
+        try:
+            os.remove(self._segment_path(seq))
+        except FileNotFoundError:
+            pass
+        self._segments.remove(seq)
+        self._bytes -= size
+
+    def _quarantine_segment(self, seq: int, offset: int):
+        """
+        Move segment seq aside after a corrupt frame at offset, nothing after it can be trusted
+        """
+        if seq == self._writer_seq:
+            self._close_writer()
+        size = self._segment_size(seq)
+        lost = max(0, size - offset)
+        self.corrupt += 1
+        self.corrupt_bytes += lost
+        path = self._segment_path(seq)
+        try:
+            os.replace(path, path[: -len(SEGMENT_SUFFIX)] + CORRUPT_SUFFIX)
+        except FileNotFoundError:
+            pass
+        self._segments.remove(seq)
+        self._bytes -= size
+        logger.error(
+            "Corrupt frame in NATS outbox segment %s at offset %s, moved segment aside, %s bytes not replayed",
+            seq,
+            offset,
+            lost,
+        )
+
+    def _enforce_max_bytes(self):
+        # drop whole segments, oldest first, but never the segment being written
+        # or the one replay() is reading, appends happen while replay() awaits publish
+        while self._bytes > self.max_bytes:
+            droppable = [seq for seq in self._segments[:-1] if seq != self._replay_seq]
+            if not droppable:
+                break
+            seq = droppable[0]
+            size = self._segment_size(seq)
+            if self._cursor[0] == seq:
+                # account only for bytes that were never replayed
+                size -= self._cursor[1]
+                self._cursor = (self._segments[self._segments.index(seq) + 1], 0)
+            self.dropped_bytes += size
+            logger.warning(
+                "NATS outbox over max_bytes=%s, dropped segment %s", self.max_bytes, seq
+            )
+            self._delete_segment(seq)
+        self._save_cursor()
+
+    def append(self, subject: str, payload: bytes):
+        frame = encode_frame(subject, payload)
+        if self._writer is None:
+            self._open_writer()
+        elif self._writer.tell() + len(frame) > self.max_segment_bytes:
+            self._close_writer()
+            self._open_writer(rotate=True)
+        assert self._writer is not None
+        self._writer.write(frame)
+        # hand off to the OS on every append, so a plugin crash doesn't lose messages
+        self._writer.flush()
+        self._bytes += len(frame)
+        self._unsynced += 1
+        self.appended += 1
+
+        if self._bytes > self.max_bytes:
+            self._enforce_max_bytes()
+        if (
+            self._unsynced >= self.fsync_every
+            or time.monotonic() - self._last_sync >= self.fsync_interval
+        ):
+            self.sync()
+
+    def sync(self):
+        """
+        fsync the segment being written
+        """
+        if self._writer is not None and self._unsynced > 0:
+            self._writer.flush()
+            os.fsync(self._writer.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self._close_writer()
+        self._save_cursor()
+
+    def _read_frames(self, seq: int, offset: int) -> Iterator[Tuple[int, str, bytes]]:
+        """
+        Yields (next_offset, subject, payload) for each frame in segment seq, starting at offset
+
+        Stops at a partial frame at the end of the segment, raises CorruptFrameError on a crc mismatch
+        """
+        with open(self._segment_path(seq), "rb") as f:
+            f.seek(offset)
+            while True:
+                frame_offset = f.tell()
+                header = f.read(FRAME_HEADER.size)
+                if not header:
+                    return
+                torn = len(header) < FRAME_HEADER.size
+                if not torn:
+                    subject_len, payload_len, crc = FRAME_HEADER.unpack(header)
+                    subject_bytes = f.read(subject_len)
+                    payload = f.read(payload_len)
+                    torn = (
+                        len(subject_bytes) != subject_len or len(payload) != payload_len
+                    )
+                if torn:
+                    # short reads only happen at EOF: a torn write, e.g. power loss before fsync
+                    self.corrupt += 1
+                    logger.warning(
+                        "Truncated frame at the end of NATS outbox segment %s", seq
+                    )
+                    return
+                if zlib.crc32(payload, zlib.crc32(subject_bytes)) != crc:
+                    raise CorruptFrameError(seq, frame_offset)
+                yield f.tell(), subject_bytes.decode("utf-8"), payload
+
+    async def replay(self, publish: Callable[[str, bytes], Awaitable[bool]]) -> int:
+        """
+        Publish queued messages in order, stopping at the first failed publish
+
+        Returns the number of messages replayed
+        """
+        if self._replaying:
+            return 0
+        self._replaying = True
+        count = 0
+        started = time.monotonic()
+        try:
+            # make sure everything appended so far is visible to the reader
+            if self._writer is not None:
+                self._writer.flush()
+            while self._segments:
+                seq = self._replay_seq = self._segments[0]
+                offset = self._cursor[1] if self._cursor[0] == seq else 0
+                try:
+                    for next_offset, subject, payload in self._read_frames(seq, offset):
+                        if not await publish(subject, payload):
+                            self._save_cursor()
+                            return count
+                        self._cursor = (seq, next_offset)
+                        count += 1
+                        self.replayed += 1
+                        # rate limit, so catching up doesn't flood the broker
+                        delay = started + count / self.replay_rate - time.monotonic()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                except CorruptFrameError as e:
+                    self._quarantine_segment(seq, e.offset)
+                else:
+                    # segment is fully replayed
+                    self._delete_segment(seq)
+                self._cursor = (self._segments[0] if self._segments else seq + 1, 0)
+                self._save_cursor()
+            return count
+        finally:
+            self._replaying = False
+            self._replay_seq = None
+            if count:
+                logger.info("Replayed %s messages from NATS outbox", count)
+
+    def stats(self) -> OutboxStats:
+        return OutboxStats(
+            path=self.path,
+            segments=len(self._segments),
+            bytes=self._bytes,
+            appended=self.appended,
+            replayed=self.replayed,
+            dropped_bytes=self.dropped_bytes,
+            corrupt=self.corrupt,
+            corrupt_bytes=self.corrupt_bytes,
+        )
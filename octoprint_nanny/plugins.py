@@ -1,25 +1,36 @@
-import asyncio
 import logging
 import os
+import sys
+import threading
 
-import functools
+import flask
 import octoprint.plugin
 import octoprint.util
 
-from typing import Any, Dict, List, Optional
+from types import ModuleType
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
 from octoprint.events import Events
 
-from octoprint_nanny.clients.rest import PrintNannyCloudAPIClient
-from octoprint_nanny.events import (
-    try_publish_nats,
-    octoprint_state_data_to_job,
-    octoprint_state_data_to_progress,
-    PrintJobDataMissing,
+from octoprint_nanny.exceptions import StartupStepError
+from octoprint_nanny.env import EVENT_QUEUE_MAXSIZE, EVENT_QUEUE_OVERFLOW_POLICY
+from octoprint_nanny.metrics import (
+    CONTENT_TYPE as METRICS_CONTENT_TYPE,
+    EVENTS_SEEN,
+    REGISTRY,
 )
+from octoprint_nanny.outbox import NatsOutbox
+from octoprint_nanny.startup import StartupPipeline
+from octoprint_nanny.telemetry import TemperatureTelemetry
 from octoprint_nanny.utils import printnanny_os
-from octoprint_nanny.worker import AsyncTaskWorker
+from octoprint_nanny.utils.logs import DEBUG_BUFFER, LOG_SAMPLER, LazyRepr, log_sampled
+from octoprint_nanny.worker import AsyncTaskWorker, EventOutcome, EventQueue
 
-import printnanny_octoprint_models
+# nats-py, aiohttp, the generated REST client and the pydantic message models
+# are imported on first use, OctoPrint imports this module during plugin discovery
+if TYPE_CHECKING:
+    from octoprint_nanny.clients.nats import NatsConnectionManager
+    from octoprint_nanny.clients.rest import PrintNannyCloudAPIClient
+    from octoprint_nanny.events import NatsBatchPublisher
 
 
 logger = logging.getLogger("octoprint.plugins.octoprint_nanny")
@@ -35,6 +46,13 @@ Events.PRINT_PROGRESS = "PrintProgress"
 DEFAULT_SETTINGS = dict(chatEnabled=True, posthogEnabled=False, apiToken=None)
 
 
+def _loaded_events_module() -> Optional[ModuleType]:
+    """
+    octoprint_nanny.events if something already imported it, without importing it
+    """
+    return sys.modules.get("octoprint_nanny.events")
+
+
 class OctoPrintNannyPlugin(
     octoprint.plugin.SettingsPlugin,
     octoprint.plugin.AssetPlugin,
@@ -54,20 +72,89 @@ class OctoPrintNannyPlugin(
 
     def __init__(self, *args, **kwargs):
         self._log_path = None
-        self._printnanny_api_client: Optional[PrintNannyCloudAPIClient] = None
+        self._printnanny_api_client: Optional["PrintNannyCloudAPIClient"] = None
 
         # create a thread pool for asyncio tasks
         self.worker = AsyncTaskWorker()
+        # created on first use by _init_nats, connected in on_after_startup
+        self._nats_connection: Optional["NatsConnectionManager"] = None
+        self._nats_publisher: Optional["NatsBatchPublisher"] = None
+        self._nats_lock = threading.Lock()
+        # on_event enqueues without blocking, the worker's event loop drains and publishes
+        self.event_queue = EventQueue(
+            self.publish_event,
+            maxsize=EVENT_QUEUE_MAXSIZE,
+            overflow_policy=EVENT_QUEUE_OVERFLOW_POLICY,
+        )
+        # samples self._printer temperatures, started by on_after_startup
+        self.temperature_telemetry = TemperatureTelemetry(
+            self.read_temperatures, self.publish_temperature_telemetry
+        )
+        # run by on_after_startup, independent steps load concurrently and event publishing
+        # doesn't wait on any of them
+        self.startup = StartupPipeline()
+        self.startup.add_step("nats", self.start_nats)
+        self.startup.add_step("printnanny_cloud_data", self.load_printnanny_cloud_data)
+        self.startup.add_step("printnanny_settings", self.load_printnanny_settings)
+        self.startup.add_step(
+            "printnanny_cloud_api_client",
+            self.init_cloud_api_client,
+            requires=["printnanny_settings"],
+        )
 
         super().__init__(*args, **kwargs)
 
-    def _init_cloud_api_client(self):
+    def _init_nats(self):
+        from octoprint_nanny.clients.nats import NatsConnectionManager
+        from octoprint_nanny.events import NatsBatchPublisher, printnanny_os_nats_url
+
+        with self._nats_lock:
+            if self._nats_publisher is not None:
+                return
+            connection = NatsConnectionManager(servers=[printnanny_os_nats_url()])
+            publisher = NatsBatchPublisher(connection)
+            # persist durable NATS messages across broker outages and OctoPrint restarts
+            publisher.outbox = NatsOutbox(
+                os.path.join(self.get_plugin_data_folder(), "outbox")
+            )
+            connection.add_connected_callback(publisher.replay_outbox)
+            self._nats_connection = connection
+            self._nats_publisher = publisher
+
+    @property
+    def nats_connection(self) -> "NatsConnectionManager":
+        if self._nats_connection is None:
+            self._init_nats()
+        return self._nats_connection  # type: ignore
+
+    @property
+    def nats_publisher(self) -> "NatsBatchPublisher":
+        if self._nats_publisher is None:
+            self._init_nats()
+        return self._nats_publisher  # type: ignore
+
+    async def publish_event(self, event: str, payload: Dict[Any, Any]) -> EventOutcome:
+        from octoprint_nanny.events import try_publish_nats
+
+        return await try_publish_nats(event, payload, publisher=self.nats_publisher)
+
+    def read_temperatures(self) -> Dict[str, Dict[str, Any]]:
+        return self._printer.get_current_temperatures()
+
+    async def publish_temperature_telemetry(self, msg: bytes) -> bool:
+        from octoprint_nanny.events import publish_nats_telemetry
+
+        return await publish_nats_telemetry(msg, publisher=self.nats_publisher)
+
+    async def init_cloud_api_client(self):
+        # PRINTNANNY_CLOUD_API is loaded from printnanny settings
         if printnanny_os.PRINTNANNY_CLOUD_API is None:
-            logger.info(
-                "_init_cloud_api_client failed, printnanny_os.PRINTNANNY_CLOUD_API is None"
+            raise StartupStepError(
+                "PrintNanny settings have no cloud section, printnanny_os.PRINTNANNY_CLOUD_API is None"
             )
-            return
         if self._printnanny_api_client is None:
+            from octoprint_nanny.clients.rest import PrintNannyCloudAPIClient
+
             self._printnanny_api_client = PrintNannyCloudAPIClient(
                 base_path=printnanny_os.PRINTNANNY_CLOUD_API.get(
                     "base_path", "https://printnanny.ai"
@@ -87,68 +174,168 @@ class OctoPrintNannyPlugin(
     @octoprint.plugin.BlueprintPlugin.route("/printnanny/test", methods=["POST"])
     def test_printnanny_cloud_nats(self):
         # reload config
+        printnanny_os.SYSTEM_INFO.refresh()
         self._event_bus.fire(Events.PLUGIN_OCTOPRINT_NANNY_SERVER_TEST)
         return dict(ok=True)
 
+    @octoprint.plugin.BlueprintPlugin.route("/printnanny/stats", methods=["GET"])
+    def get_printnanny_stats(self):
+        from octoprint_nanny.clients.rest import (
+            PRINTNANNY_CLOUD_CIRCUIT_BREAKER,
+            PRINTNANNY_CLOUD_RETRY_BUDGET,
+        )
+        from octoprint_nanny.events import (
+            JOB_SNAPSHOT,
+            NATS_RATE_LIMITER,
+            NATS_SUBJECTS,
+            PROGRESS_DELTA_ENCODER,
+            constant_payload_cache_info,
+        )
+
+        publisher = self.nats_publisher
+        return dict(
+            startup=dict(ready=self.startup.ready(), steps=self.startup.stats()),
+            event_queue=self.event_queue.stats(),
+            worker=self.worker.stats(),
+            nats_connection=self.nats_connection.stats(),
+            nats_subjects=NATS_SUBJECTS.stats(),
+            nats_outbox=publisher.outbox.stats()
+            if publisher.outbox is not None
+            else None,
+            constant_payload_cache=constant_payload_cache_info(),
+            job_snapshot=JOB_SNAPSHOT.stats(),
+            progress_encoder=PROGRESS_DELTA_ENCODER.stats()
+            if PROGRESS_DELTA_ENCODER is not None
+            else None,
+            system_info=printnanny_os.SYSTEM_INFO.stats(),
+            temperature_telemetry=self.temperature_telemetry.stats(),
+            circuit_breakers=[
+                publisher.breaker.stats(),
+                PRINTNANNY_CLOUD_CIRCUIT_BREAKER.stats(),
+            ],
+            rate_limits=NATS_RATE_LIMITER.stats(),
+            retry_budgets=dict(
+                nats=publisher.retry_budget.stats(),
+                printnanny_cloud=PRINTNANNY_CLOUD_RETRY_BUDGET.stats(),
+            ),
+        )
+
+    @octoprint.plugin.BlueprintPlugin.route("/printnanny/debug/events", methods=["GET"])
+    def get_printnanny_debug_events(self):
+        # ?limit=50&kind=event, kinds: event, progress, nats_batch, untracked, telemetry
+        limit = flask.request.args.get("limit", type=int)
+        kind = flask.request.args.get("kind")
+        return dict(
+            buffer=DEBUG_BUFFER.stats(),
+            sampler=LOG_SAMPLER.stats(),
+            records=DEBUG_BUFFER.dump(limit=limit, kind=kind),
+        )
+
+    @octoprint.plugin.BlueprintPlugin.route("/printnanny/metrics", methods=["GET"])
+    def get_printnanny_metrics(self):
+        return flask.Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
     def register_custom_events(self) -> List[str]:
         return ["server_test"]
 
+    def initialize(self):
+        # module state outlives a plugin reload, drop payloads cached by the previous instance
+        events = _loaded_events_module()
+        if events is not None:
+            events.clear_constant_payload_cache()
+            events.JOB_SNAPSHOT.clear()
+
     def on_shutdown(self):
-        # drain and shutdown thread pool
-        self._thread_pool.shutdown()
+        logger.info("EventQueue stats at shutdown: %s", self.event_queue.stats())
+        logger.info("AsyncTaskWorker stats at shutdown: %s", self.worker.stats())
+        self.worker.shutdown(drain=self.drain)
+        events = _loaded_events_module()
+        if events is not None:
+            events.clear_constant_payload_cache()
+            events.JOB_SNAPSHOT.clear()
+
+    async def drain(self):
+        # publish queued events, then flush NATS batches and close connections
+        self.temperature_telemetry.stop()
+        await self.event_queue.drain()
+        try:
+            await self.close_nats()
+        except Exception as e:
+            logger.error("Error closing NATS connection: %s", e)
+        if self._printnanny_api_client is not None:
+            try:
+                await self._printnanny_api_client.close()
+            except Exception as e:
+                logger.error("Error closing PrintNanny Cloud API client: %s", e)
 
     def on_startup(self, *args, **kwargs):
-        pass
-
-    async def load_printnanny(self):
-        cloud_result = await printnanny_os.load_printnanny_cloud_data()
-        logger.debug("load_printnanny_cloud_data result %s", cloud_result)
-        # run blocking i/o in a thread, pre-allocated using ThreadPoolExecutor
-        settings_result = self.worker.run_coroutine_threadsafe(
-            printnanny_os.load_printnanny_settings()
-        )
-        logger.debug("load_printnanny_settings result %s", settings_result)
+        # start draining events queued by on_event
+        self.event_queue.start(self.worker)
+
+    async def load_printnanny_cloud_data(self):
+        result = await printnanny_os.load_printnanny_cloud_data()
+        logger.debug("load_printnanny_cloud_data result %s", result)
+        if result is None:
+            raise StartupStepError("Failed to load PrintNanny Cloud pi data")
+        return result
+
+    async def load_printnanny_settings(self):
+        result = await printnanny_os.SYSTEM_INFO.load_settings()
+        logger.debug("load_printnanny_settings result %s", result)
+        if result["config"] is None:
+            raise StartupStepError(
+                f"Failed to load PrintNanny settings, returncode={result['returncode']}"
+            )
+        return result
 
-    def on_after_startup(self, *args, **kwargs):
-        # load PrintNanny Cloud data models
-        self.worker.run_coroutine_threadsafe(self.load_printnanny())
+    async def start_nats(self):
+        # first use of nats_connection imports nats-py, keep that off OctoPrint's main thread
+        await self.nats_connection.start()
 
-        # configure PrintNanny Cloud REST api credentials
-        try:
-            self._init_cloud_api_client()
-        except Exception as e:
-            logger.error("Error initializing PrintNanny Cloud API client: %s", e)
+    async def close_nats(self):
+        if self._nats_publisher is None:
+            # nothing was ever published
+            return
+        from octoprint_nanny.events import NATS_EVENT_COALESCER
+
+        # trailing coalesced messages, then everything still batched
+        await NATS_EVENT_COALESCER.flush()
+        await self._nats_publisher.flush()
+        await self.nats_connection.close()
+        if self._nats_publisher.outbox is not None:
+            self._nats_publisher.outbox.close()
+
+    def on_after_startup(self, *args, **kwargs):
+        # connect to PrintNanny OS NATS, load PrintNanny Cloud data models and settings,
+        # then configure PrintNanny Cloud REST api credentials. Temperature telemetry samples
+        # right away, windows published before NATS connects are dropped
+        self.worker.run_coroutine_threadsafe(self.startup.run())
+        self.temperature_telemetry.start(self.worker)
 
     def on_event(self, event: str, payload: Dict[Any, Any]):
+        from octoprint_nanny.events import (
+            JOB_ENRICHED_EVENTS,
+            JOB_SNAPSHOT,
+            PrintJobDataMissing,
+            should_publish_event,
+        )
 
-        # enrich with job data
-        if event == "PrinterStateChanged":
-            current_state_data = self._printer.get_current_data()
-            try:
-                job = octoprint_state_data_to_job(current_state_data)
-                payload = dict(job=job, **payload)
-            except PrintJobDataMissing:
-                payload = dict(job=None, **payload)
+        EVENTS_SEEN.labels(event).inc()
+        DEBUG_BUFFER.record("event", event, payload=payload)
+        if not should_publish_event(event, payload):
+            return
 
-        # enrich with job data
-        if event in (
-            printnanny_octoprint_models.JobStatus.PRINT_STARTED.value,
-            printnanny_octoprint_models.JobStatus.PRINT_FAILED.value,
-            printnanny_octoprint_models.JobStatus.PRINT_CANCELLING.value,
-            printnanny_octoprint_models.JobStatus.PRINT_CANELLED.value,
-            printnanny_octoprint_models.JobStatus.PRINT_CANCELLING,
-            printnanny_octoprint_models.JobStatus.PRINT_PAUSED.value,
-            printnanny_octoprint_models.JobStatus.PRINT_RESUMED.value,
-        ):
+        # enrich with job data, the Job model is only rebuilt when the job changes
+        if event in JOB_ENRICHED_EVENTS:
             current_state_data = self._printer.get_current_data()
             try:
-                job = octoprint_state_data_to_job(current_state_data)
+                job = JOB_SNAPSHOT.get(current_state_data)
                 payload = dict(job=job, **payload)
             except PrintJobDataMissing:
                 payload = dict(job=None, **payload)
 
-        future = self.worker.run_coroutine_threadsafe(try_publish_nats(event, payload))
-        future.result()
+        # fire-and-forget: never block OctoPrint's event dispatch thread on a NATS round trip
+        self.event_queue.put(event, payload)
 
     def on_environment_detected(self, environment, *args, **kwargs):
         logger.info(
@@ -168,11 +355,25 @@ class OctoPrintNannyPlugin(
     ##~~ Progress plugin
 
     def on_print_progress(self, storage, path, _progress):
+        from octoprint_nanny.events import (
+            JOB_SNAPSHOT,
+            PrintJobDataMissing,
+            octoprint_state_data_to_progress,
+        )
+
         current_state_data = self._printer.get_current_data()
-        logger.info("on_print_progress state data: %s", current_state_data)
+        # full state data goes to the in-memory debug buffer, not to disk on every tick
+        DEBUG_BUFFER.record("progress", Events.PRINT_PROGRESS, state=current_state_data)
+        log_sampled(
+            logger,
+            logging.DEBUG,
+            "on_print_progress",
+            "on_print_progress state data: %s",
+            LazyRepr(current_state_data),
+        )
 
         try:
-            job = octoprint_state_data_to_job(current_state_data)
+            job = JOB_SNAPSHOT.get(current_state_data)
         except PrintJobDataMissing:
             job = None
         progress = octoprint_state_data_to_progress(current_state_data)
@@ -198,9 +399,10 @@ class OctoPrintNannyPlugin(
                 "discord_invite": "https://discord.gg/sf23bk2hPr",
                 "webapp": PRINTNANNY_API_BASE_URL,
             },
-            "is_printnanny_os": printnanny_os.is_printnanny_os(),
-            "issue_txt": printnanny_os.issue_txt(),
-            "etc_os_release": printnanny_os.etc_os_release(),
+            # served from memory, rendering templates shouldn't fork the printnanny CLI
+            "is_printnanny_os": printnanny_os.SYSTEM_INFO.is_printnanny_os(),
+            "issue_txt": printnanny_os.SYSTEM_INFO.issue_txt(),
+            "etc_os_release": printnanny_os.SYSTEM_INFO.etc_os_release(),
             "PRINTNANNY_CLOUD_PI": printnanny_os.PRINTNANNY_CLOUD_PI,
         }
         return custom
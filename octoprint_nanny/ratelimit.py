@@ -0,0 +1,73 @@
+import time
+from typing import Dict, NamedTuple, TypedDict
+
+
+class RateLimit(NamedTuple):
+    # tokens added per second, the sustained rate
+    rate: float
+    # bucket size, events allowed in a burst
+    burst: float
+
+
+class TokenBucketStats(TypedDict):
+    tokens: float
+    allowed: int
+    limited: int
+
+
+class TokenBucket:
+    """
+    Allows limit.burst events at once and limit.rate events per second after that
+
+    Starts full. Not thread-safe, used on the worker's event loop
+    """
+
+    def __init__(self, limit: RateLimit):
+        self.limit = limit
+        self.tokens = float(limit.burst)
+        self._updated_at = time.monotonic()
+        self.allowed = 0
+        self.limited = 0
+
+    def allow(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(
+            self.limit.burst, self.tokens + (now - self._updated_at) * self.limit.rate
+        )
+        self._updated_at = now
+        if self.tokens < 1:
+            self.limited += 1
+            return False
+        self.tokens -= 1
+        self.allowed += 1
+        return True
+
+    def stats(self) -> TokenBucketStats:
+        return TokenBucketStats(
+            tokens=round(self.tokens, 3), allowed=self.allowed, limited=self.limited
+        )
+
+
+class RateLimiter:
+    """
+    One TokenBucket per key, keys without a RateLimit are never limited
+    """
+
+    def __init__(self, limits: Dict[str, RateLimit]):
+        self.limits = limits
+        self._buckets: Dict[str, TokenBucket] = {
+            key: TokenBucket(limit) for key, limit in limits.items()
+        }
+
+    def reset(self):
+        """
+        Refill every bucket and clear its counters
+        """
+        self._buckets = {key: TokenBucket(limit) for key, limit in self.limits.items()}
+
+    def allow(self, key: str) -> bool:
+        bucket = self._buckets.get(key)
+        return bucket is None or bucket.allow()
+
+    def stats(self) -> Dict[str, TokenBucketStats]:
+        return {key: bucket.stats() for key, bucket in self._buckets.items()}
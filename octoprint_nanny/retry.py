@@ -0,0 +1,287 @@
+import asyncio
+import functools
+import logging
+import random
+import time
+from enum import Enum
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Type,
+    TypedDict,
+    TypeVar,
+)
+
+from octoprint_nanny.env import (
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+    CIRCUIT_BREAKER_RESET_TIMEOUT,
+    MAX_BACKOFF_TIME,
+    RETRY_BUDGET_MIN_PER_SECOND,
+    RETRY_BUDGET_RATIO,
+)
+from octoprint_nanny.exceptions import CircuitOpenError
+
+logger = logging.getLogger("octoprint.plugins.octoprint_nanny.retry")
+
+T = TypeVar("T")
+
+
+def never_giveup(e: Exception) -> bool:
+    return False
+
+
+class RetryPolicy(NamedTuple):
+    """
+    Exponential backoff with full jitter: the n-th retry waits random(0, min(max_delay, base_delay * 2 ** n)) seconds
+    """
+
+    retry_on: Tuple[Type[Exception], ...]
+    max_tries: int = 5
+    # seconds
+    max_time: float = MAX_BACKOFF_TIME
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+    # returns True for errors that are not worth retrying, e.g. HTTP 4xx
+    giveup: Callable[[Exception], bool] = never_giveup
+
+    def delay(self, retry: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**retry))
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreakerStats(TypedDict):
+    name: str
+    state: str
+    consecutive_failures: int
+    opened: int
+    rejected: int
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast while a dependency is down
+
+    After failure_threshold consecutive failures the circuit opens and allow() returns False
+    for reset_timeout seconds. Then a single trial call is let through (half-open):
+    success closes the circuit, failure opens it again
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = CIRCUIT_BREAKER_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_BREAKER_RESET_TIMEOUT,
+    ):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+        self._opened_at = 0.0
+
+        self.opened = 0
+        self.rejected = 0
+
+    def retry_in(self) -> float:
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state is CircuitState.CLOSED:
+            return True
+        if self.state is CircuitState.OPEN and self.retry_in() == 0:
+            self.state = CircuitState.HALF_OPEN
+            return True
+        # open, or half-open with the trial call still running
+        self.rejected += 1
+        return False
+
+    def record_success(self):
+        if self.state is not CircuitState.CLOSED:
+            logger.info("Circuit %s closed", self.name)
+        self.state = CircuitState.CLOSED
+        self.consecutive_failures = 0
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if (
+            self.state is CircuitState.HALF_OPEN
+            or self.consecutive_failures >= self.failure_threshold
+        ):
+            if self.state is not CircuitState.OPEN:
+                self.opened += 1
+                logger.warning(
+                    "Circuit %s opened after %s consecutive failures, failing fast for %ss",
+                    self.name,
+                    self.consecutive_failures,
+                    self.reset_timeout,
+                )
+            self.state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
+
+    def stats(self) -> CircuitBreakerStats:
+        return CircuitBreakerStats(
+            name=self.name,
+            state=self.state.value,
+            consecutive_failures=self.consecutive_failures,
+            opened=self.opened,
+            rejected=self.rejected,
+        )
+
+
+class RetryBudgetStats(TypedDict):
+    balance: float
+    calls: int
+    retries: int
+    exhausted: int
+
+
+class RetryBudget:
+    """
+    Caps retries at a fraction of calls, so an outage doesn't multiply load on the dependency
+
+    Every call deposits ratio tokens and every retry withdraws one. min_per_second tokens
+    are added each second (up to a burst of that many) so rarely-called endpoints can still retry
+    """
+
+    def __init__(
+        self,
+        ratio: float = RETRY_BUDGET_RATIO,
+        min_per_second: float = RETRY_BUDGET_MIN_PER_SECOND,
+        max_balance: float = 10.0,
+    ):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_balance = max_balance
+        self.balance = max(min_per_second, 1.0)
+        self._updated_at = time.monotonic()
+
+        self.calls = 0
+        self.retries = 0
+        self.exhausted = 0
+
+    def _refill(self, amount: float):
+        now = time.monotonic()
+        amount += (now - self._updated_at) * self.min_per_second
+        self._updated_at = now
+        self.balance = min(self.max_balance, self.balance + amount)
+
+    def record_call(self):
+        self.calls += 1
+        self._refill(self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill(0)
+        if self.balance < 1:
+            self.exhausted += 1
+            return False
+        self.balance -= 1
+        self.retries += 1
+        return True
+
+    def stats(self) -> RetryBudgetStats:
+        return RetryBudgetStats(
+            balance=self.balance,
+            calls=self.calls,
+            retries=self.retries,
+            exhausted=self.exhausted,
+        )
+
+
+async def call_with_retry(
+    fn: Callable[..., Awaitable[T]],
+    *args: Any,
+    policy: RetryPolicy,
+    breaker: Optional[CircuitBreaker] = None,
+    budget: Optional[RetryBudget] = None,
+    **kwargs: Any,
+) -> T:
+    """
+    Await fn(*args, **kwargs), retrying errors in policy.retry_on
+
+    Raises CircuitOpenError without calling fn if breaker is open, and re-raises the last error
+    once policy, budget or breaker say to stop retrying
+    """
+    if breaker is not None and not breaker.allow():
+        raise CircuitOpenError(breaker.name, breaker.retry_in())
+    if budget is not None:
+        budget.record_call()
+    started = time.monotonic()
+    tries = 0
+    while True:
+        tries += 1
+        try:
+            result = await fn(*args, **kwargs)
+        except policy.retry_on as e:
+            if policy.giveup(e):
+                # dependency answered, it's the request that is wrong
+                if breaker is not None:
+                    breaker.record_success()
+                raise
+            if breaker is not None:
+                breaker.record_failure()
+            delay = policy.delay(tries - 1)
+            if (
+                tries >= policy.max_tries
+                or time.monotonic() - started + delay > policy.max_time
+                or (breaker is not None and not breaker.allow())
+                or (budget is not None and not budget.withdraw())
+            ):
+                logger.error(
+                    "Giving up calling %s after %s tries: %s",
+                    getattr(fn, "__qualname__", fn),
+                    tries,
+                    e,
+                )
+                raise
+            logger.warning(
+                "Backing off %0.1f seconds after %s tries calling %s: %s",
+                delay,
+                tries,
+                getattr(fn, "__qualname__", fn),
+                e,
+            )
+            await asyncio.sleep(delay)
+            continue
+        except asyncio.CancelledError:
+            # a cancelled half-open trial would otherwise keep the circuit half-open for good
+            if breaker is not None and breaker.state is CircuitState.HALF_OPEN:
+                breaker.record_failure()
+            raise
+        except Exception:
+            # not retried, but the call still failed
+            if breaker is not None:
+                breaker.record_failure()
+            raise
+        if breaker is not None:
+            breaker.record_success()
+        return result
+
+
+def retry(
+    policy: RetryPolicy,
+    breaker: Optional[CircuitBreaker] = None,
+    budget: Optional[RetryBudget] = None,
+):
+    """
+    Decorator form of call_with_retry for coroutine functions and methods
+    """
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            return await call_with_retry(
+                fn, *args, policy=policy, breaker=breaker, budget=budget, **kwargs
+            )
+
+        return wrapper
+
+    return decorator
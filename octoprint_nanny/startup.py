@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from enum import Enum
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, TypedDict
+
+logger = logging.getLogger("octoprint.plugins.octoprint_nanny.startup")
+
+
+class StartupState(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    READY = "ready"
+    FAILED = "failed"
+    SKIPPED = "skipped"
+
+
+class StartupStepStats(TypedDict):
+    state: str
+    requires: List[str]
+    duration_ms: Optional[float]
+    error: Optional[str]
+
+
+class StartupStep:
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[], Awaitable[Any]],
+        requires: Sequence[str],
+    ):
+        self.name = name
+        self.fn = fn
+        self.requires = list(requires)
+        self.state = StartupState.PENDING
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.duration: Optional[float] = None
+
+    def stats(self) -> StartupStepStats:
+        return StartupStepStats(
+            state=self.state.value,
+            requires=self.requires,
+            duration_ms=round(self.duration * 1000, 3)
+            if self.duration is not None
+            else None,
+            error=self.error,
+        )
+
+
+class StartupPipeline:
+    """
+    Runs async initialization steps concurrently, each one as soon as the steps it requires are ready
+
+    A step that raises is marked failed and the steps requiring it are skipped, other steps keep going.
+    Steps must be added after the steps they require, so the graph can't contain cycles.
+    State is plain attributes, safe to read from OctoPrint's threads while run() is in progress
+    """
+
+    def __init__(self):
+        self._steps: Dict[str, StartupStep] = {}
+        self._tasks: Dict[str, asyncio.Future] = {}
+
+    def add_step(
+        self,
+        name: str,
+        fn: Callable[[], Awaitable[Any]],
+        requires: Sequence[str] = (),
+    ):
+        if name in self._steps:
+            raise ValueError(f"Startup step {name} is already registered")
+        missing = [r for r in requires if r not in self._steps]
+        if missing:
+            raise ValueError(
+                f"Startup step {name} requires unknown steps: {', '.join(missing)}"
+            )
+        self._steps[name] = StartupStep(name, fn, requires)
+
+    async def run(self) -> bool:
+        """
+        Run every step, returns True if all of them are ready
+        """
+        for name, step in self._steps.items():
+            self._tasks[name] = asyncio.ensure_future(self._run_step(step))
+        if self._tasks:
+            await asyncio.wait(list(self._tasks.values()))
+        return self.ready()
+
+    async def _run_step(self, step: StartupStep):
+        if step.requires:
+            # asyncio.wait, not gather: a cancelled dependent must not cancel shared steps
+            await asyncio.wait([self._tasks[r] for r in step.requires])
+            not_ready = [
+                r for r in step.requires if self._steps[r].state != StartupState.READY
+            ]
+            if not_ready:
+                step.state = StartupState.SKIPPED
+                step.error = f"requires {', '.join(not_ready)}"
+                logger.warning("Skipped startup step %s, %s", step.name, step.error)
+                return
+
+        step.state = StartupState.RUNNING
+        start = time.monotonic()
+        try:
+            step.result = await step.fn()
+            step.state = StartupState.READY
+            logger.info(
+                "Startup step %s ready in %0.3fs", step.name, time.monotonic() - start
+            )
+        except asyncio.CancelledError:
+            step.state = StartupState.FAILED
+            step.error = "cancelled"
+            raise
+        except Exception as e:
+            step.state = StartupState.FAILED
+            step.error = repr(e)
+            logger.error("Startup step %s failed: %s", step.name, e)
+        finally:
+            step.duration = time.monotonic() - start
+
+    def ready(self, name: Optional[str] = None) -> bool:
+        """
+        True if step name (or every step) finished successfully
+        """
+        if name is not None:
+            return self._steps[name].state == StartupState.READY
+        return all(step.state == StartupState.READY for step in self._steps.values())
+
+    def state(self, name: str) -> StartupState:
+        return self._steps[name].state
+
+    def result(self, name: str) -> Any:
+        return self._steps[name].result
+
+    async def wait(self, name: str) -> bool:
+        """
+        Wait for step name to finish, returns True if it is ready
+        """
+        task = self._tasks.get(name)
+        if task is None:
+            raise RuntimeError(f"Startup step {name} has not been started")
+        await asyncio.wait([task])
+        return self.ready(name)
+
+    def stats(self) -> Dict[str, StartupStepStats]:
+        return {name: step.stats() for name, step in self._steps.items()}
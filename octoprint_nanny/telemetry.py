@@ -0,0 +1,228 @@
+import asyncio
+import concurrent.futures
+import logging
+import math
+import time
+from array import array
+from typing import Any, Awaitable, Callable, Dict, Optional, TypedDict
+
+from octoprint_nanny.env import (
+    TELEMETRY_TEMPERATURE_PUBLISH_INTERVAL,
+    TELEMETRY_TEMPERATURE_SAMPLE_INTERVAL,
+)
+from octoprint_nanny.utils.encoder import dumps
+from octoprint_nanny.utils.logs import DEBUG_BUFFER
+
+logger = logging.getLogger("octoprint.plugins.octoprint_nanny.telemetry")
+
+# PrinterInterface.get_current_temperatures(), e.g.
+# {"tool0": {"actual": 210.3, "target": 210.0, "offset": 0}, "bed": {...}}
+TemperatureReader = Callable[[], Dict[str, Dict[str, Any]]]
+TelemetryPublisher = Callable[[bytes], Awaitable[bool]]
+
+TEMPERATURE_FIELDS = ("actual", "target")
+
+
+class WindowAggregate(TypedDict):
+    min: float
+    max: float
+    mean: float
+    last: float
+    samples: int
+
+
+class RingBuffer:
+    """
+    Fixed-capacity ring of floats backed by array("d"), appending never allocates
+
+    window() returns the values appended since the previous window(), at most capacity of them
+    """
+
+    __slots__ = ("capacity", "_values", "_next", "_pending")
+
+    def __init__(self, capacity: int):
+        if capacity < 1:
+            raise ValueError(f"RingBuffer capacity must be >= 1, got {capacity}")
+        self.capacity = capacity
+        self._values = array("d", bytes(8 * capacity))
+        self._next = 0
+        self._pending = 0
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def append(self, value: float):
+        self._values[self._next] = value
+        self._next = (self._next + 1) % self.capacity
+        if self._pending < self.capacity:
+            self._pending += 1
+
+    def window(self) -> array:
+        """
+        Values appended since the previous call, oldest first
+        """
+        n, self._pending = self._pending, 0
+        start = self._next - n
+        if start >= 0:
+            return self._values[start : self._next]
+        return self._values[start:] + self._values[: self._next]
+
+
+def aggregate(values: array) -> Optional[WindowAggregate]:
+    if not values:
+        return None
+    return WindowAggregate(
+        min=min(values),
+        max=max(values),
+        mean=round(math.fsum(values) / len(values), 2),
+        last=values[-1],
+        samples=len(values),
+    )
+
+
+class TemperatureTelemetryStats(TypedDict):
+    running: bool
+    sensors: int
+    samples: int
+    sample_errors: int
+    windows: int
+    published: int
+    failed: int
+
+
+class TemperatureTelemetry:
+    """
+    Samples tool/bed temperatures every sample_interval seconds into one RingBuffer per sensor and field,
+    publishes min/max/mean/last of each window every publish_interval seconds
+
+    Runs on AsyncTaskWorker's event loop, like EventQueue
+    """
+
+    def __init__(
+        self,
+        read_temperatures: TemperatureReader,
+        publish: TelemetryPublisher,
+        sample_interval: float = TELEMETRY_TEMPERATURE_SAMPLE_INTERVAL,
+        publish_interval: float = TELEMETRY_TEMPERATURE_PUBLISH_INTERVAL,
+    ):
+        self.read_temperatures = read_temperatures
+        self.publish = publish
+        self.sample_interval = sample_interval
+        self.publish_interval = publish_interval
+        # every sample of a window fits, with room for a late publish
+        self.capacity = (
+            max(1, math.ceil(publish_interval / sample_interval) * 2)
+            if self.enabled
+            else 1
+        )
+        # (sensor, field) -> samples since the last window
+        self._buffers: Dict[str, Dict[str, RingBuffer]] = {}
+        self._window_started = time.time()
+        self._task: Optional[concurrent.futures.Future] = None
+
+        self.samples = 0
+        self.sample_errors = 0
+        self.windows = 0
+        self.published = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_interval > 0 and self.publish_interval > 0
+
+    def start(self, worker: Any):
+        if not self.enabled:
+            logger.info("Temperature telemetry disabled")
+            return
+        if self._task is None:
+            self._task = worker.run_coroutine_threadsafe(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def sample(self):
+        try:
+            temperatures = self.read_temperatures()
+        except Exception as e:
+            self.sample_errors += 1
+            logger.debug("Error reading temperatures: %s", e)
+            return
+        for sensor, values in temperatures.items():
+            if not isinstance(values, dict):
+                continue
+            buffers = self._buffers.get(sensor)
+            if buffers is None:
+                buffers = self._buffers[sensor] = {
+                    field: RingBuffer(self.capacity) for field in TEMPERATURE_FIELDS
+                }
+            for field in TEMPERATURE_FIELDS:
+                value = values.get(field)
+                # target is None while a heater is off on some firmware
+                if value is not None:
+                    buffers[field].append(float(value))
+        self.samples += 1
+
+    def build_msg(self) -> Optional[bytes]:
+        """
+        Aggregate and clear the current window, None if nothing was sampled
+        """
+        now = time.time()
+        sensors: Dict[str, Dict[str, WindowAggregate]] = {}
+        for sensor, buffers in self._buffers.items():
+            fields = {}
+            for field, buffer in buffers.items():
+                result = aggregate(buffer.window())
+                if result is not None:
+                    fields[field] = result
+            if fields:
+                sensors[sensor] = fields
+        window_start, self._window_started = self._window_started, now
+        if not sensors:
+            return None
+        self.windows += 1
+        return dumps(dict(window_start=window_start, window_end=now, sensors=sensors))
+
+    async def publish_window(self) -> bool:
+        msg = self.build_msg()
+        if msg is None:
+            return False
+        try:
+            ok = await self.publish(msg)
+        except Exception as e:
+            logger.error("Error publishing temperature telemetry: %s", e)
+            ok = False
+        if ok:
+            self.published += 1
+        else:
+            self.failed += 1
+        DEBUG_BUFFER.record("telemetry", "temperature", ok=ok, msg=msg)
+        return ok
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        logger.info(
+            "Temperature telemetry started sample_interval=%s publish_interval=%s",
+            self.sample_interval,
+            self.publish_interval,
+        )
+        self._window_started = time.time()
+        publish_at = loop.time() + self.publish_interval
+        while True:
+            self.sample()
+            if loop.time() >= publish_at:
+                publish_at += self.publish_interval
+                await self.publish_window()
+            await asyncio.sleep(self.sample_interval)
+
+    def stats(self) -> TemperatureTelemetryStats:
+        return TemperatureTelemetryStats(
+            running=self._task is not None,
+            sensors=len(self._buffers),
+            samples=self.samples,
+            sample_errors=self.sample_errors,
+            windows=self.windows,
+            published=self.published,
+            failed=self.failed,
+        )
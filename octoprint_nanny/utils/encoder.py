@@ -1,21 +1,92 @@
 import json
 import base64
+import functools
+import logging
 from enum import Enum
 import datetime
 from io import BytesIO
-import base64
+from typing import Any, Callable
+
+from octoprint_nanny.env import JSON_BACKEND
+
+logger = logging.getLogger("octoprint.plugins.octoprint_nanny.utils.encoder")
+
+try:
+    import orjson
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+
+@functools.singledispatch
+def encode_default(obj: Any) -> Any:
+    """
+    Convert obj to a JSON-serializable value, dispatched on type instead of an isinstance chain
+    """
+    raise TypeError(f"Object of type {obj.__class__.__name__} is not JSON serializable")
+
+
+@encode_default.register(datetime.date)
+def _encode_date(obj: datetime.date) -> str:
+    # also handles datetime.datetime, a subclass of datetime.date
+    return obj.isoformat()
+
+
+@encode_default.register(BytesIO)
+def _encode_bytesio(obj: BytesIO) -> str:
+    obj.seek(0)
+    return base64.b64encode(obj.read()).decode()
+
+
+@encode_default.register(bytes)
+def _encode_bytes(obj: bytes) -> str:
+    return obj.decode()
+
+
+@encode_default.register(Enum)
+def _encode_enum(obj: Enum) -> Any:
+    return obj.value
 
 
 class JSONEncoder(json.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, (datetime.date, datetime.datetime)):
-            return obj.isoformat()
-        elif isinstance(obj, BytesIO):
-            obj.seek(0)
-            obj = obj.read()
-            return base64.b64encode(obj).decode()
-        elif isinstance(obj, bytes):
-            return obj.decode()
-        elif isinstance(obj, Enum):
-            return obj.value
-        return json.JSONEncoder.default(self, obj)
+        try:
+            return encode_default(obj)
+        except TypeError:
+            return json.JSONEncoder.default(self, obj)
+
+
+def _dumps_json(obj: Any) -> bytes:
+    return json.dumps(obj, cls=JSONEncoder, separators=(",", ":")).encode("utf-8")
+
+
+# hand datetimes to encode_default, so both backends produce the same isoformat() strings
+ORJSON_OPTIONS = (
+    orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+    if orjson is not None
+    else 0
+)
+
+
+def _dumps_orjson(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=encode_default, option=ORJSON_OPTIONS)
+
+
+def get_dumps(backend: str = JSON_BACKEND) -> Callable[[Any], bytes]:
+    """
+    Returns the compact JSON serializer for backend (auto, orjson or json)
+    """
+    if backend == "json":
+        return _dumps_json
+    if backend in ("auto", "orjson"):
+        if orjson is not None:
+            return _dumps_orjson
+        if backend == "orjson":
+            logger.warning(
+                "OCTOPRINT_NANNY_JSON_BACKEND=orjson but orjson is not installed, falling back to json"
+            )
+        return _dumps_json
+    raise ValueError(f"Unsupported JSON backend: {backend}")
+
+
+# serialize obj to compact UTF-8 encoded JSON
+dumps = get_dumps()
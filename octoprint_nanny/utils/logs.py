@@ -0,0 +1,181 @@
+import logging
+import reprlib
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple, TypedDict
+
+from octoprint_nanny.env import (
+    LOG_BUFFER_SIZE,
+    LOG_PAYLOAD_MAXLEN,
+    LOG_SAMPLE_EVERY,
+    LOG_SAMPLE_FIRST,
+)
+
+
+class LazyRepr:
+    """
+    Defers repr(obj) until a log record is actually formatted, truncated to maxlen characters
+
+    The result is kept, since every handler formats the record again
+    """
+
+    __slots__ = ("obj", "maxlen", "_text")
+
+    def __init__(self, obj: Any, maxlen: int = LOG_PAYLOAD_MAXLEN):
+        self.obj = obj
+        self.maxlen = maxlen
+        self._text: Optional[str] = None
+
+    def __str__(self) -> str:
+        if self._text is None:
+            text = repr(self.obj)
+            if len(text) > self.maxlen:
+                text = f"{text[:self.maxlen]}...({len(text)} chars)"
+            self._text = text
+        return self._text
+
+    __repr__ = __str__
+
+
+class LogSamplerStats(TypedDict):
+    keys: int
+    seen: int
+    suppressed: int
+
+
+class LogSampler:
+    """
+    Lets the first `first` occurrences of each key through, then one in every `every`
+
+    every <= 0 suppresses everything after the first occurrences
+    """
+
+    def __init__(self, first: int = LOG_SAMPLE_FIRST, every: int = LOG_SAMPLE_EVERY):
+        self.first = first
+        self.every = every
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.suppressed = 0
+
+    def sample(self, key: str) -> bool:
+        with self._lock:
+            n = self._counts.get(key, 0) + 1
+            self._counts[key] = n
+            if n <= self.first or (self.every > 0 and n % self.every == 0):
+                return True
+            self.suppressed += 1
+            return False
+
+    def count(self, key: str) -> int:
+        return self._counts.get(key, 0)
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+            self.suppressed = 0
+
+    def stats(self) -> LogSamplerStats:
+        with self._lock:
+            return LogSamplerStats(
+                keys=len(self._counts),
+                seen=sum(self._counts.values()),
+                suppressed=self.suppressed,
+            )
+
+
+LOG_SAMPLER = LogSampler()
+
+
+def log_sampled(
+    logger: logging.Logger,
+    level: int,
+    key: str,
+    msg: str,
+    *args: Any,
+    sampler: LogSampler = LOG_SAMPLER,
+):
+    """
+    logger.log(level, msg, *args) for a sample of calls sharing key, see LogSampler
+
+    Messages logged after suppressed ones note how many calls with key were seen so far
+    """
+    if not logger.isEnabledFor(level) or not sampler.sample(key):
+        return
+    n = sampler.count(key)
+    if n > sampler.first:
+        logger.log(level, msg + " (sampled, %s seen)", *args, n)
+    else:
+        logger.log(level, msg, *args)
+
+
+class DebugRecord(TypedDict):
+    ts: float
+    kind: str
+    name: str
+    fields: Dict[str, str]
+
+
+class DebugBufferStats(TypedDict):
+    size: int
+    maxlen: Optional[int]
+    recorded: int
+
+
+class DebugRingBuffer:
+    """
+    Fixed-size in-memory buffer of recent events, served by /printnanny/debug/events
+
+    record() stores references without formatting them, repr() only runs when the buffer is dumped.
+    Oldest records are discarded once maxlen is reached
+    """
+
+    def __init__(self, maxlen: int = LOG_BUFFER_SIZE):
+        self._records: Deque[Tuple[float, str, str, Dict[str, Any]]] = deque(
+            maxlen=maxlen
+        )
+        self.recorded = 0
+
+    def record(self, kind: str, name: str, **fields: Any):
+        # deque.append is atomic, safe from OctoPrint's threads and the worker loop
+        self._records.append((time.time(), kind, name, fields))
+        self.recorded += 1
+
+    def dump(
+        self, limit: Optional[int] = None, kind: Optional[str] = None
+    ) -> List[DebugRecord]:
+        """
+        Most recent records first
+        """
+        formatter = reprlib.Repr()
+        formatter.maxstring = formatter.maxother = LOG_PAYLOAD_MAXLEN * 5
+        formatter.maxdict = formatter.maxlist = formatter.maxtuple = 100
+        formatter.maxlevel = 8
+        result = []
+        for ts, record_kind, name, fields in reversed(list(self._records)):
+            if kind is not None and record_kind != kind:
+                continue
+            result.append(
+                DebugRecord(
+                    ts=ts,
+                    kind=record_kind,
+                    name=name,
+                    fields={k: formatter.repr(v) for k, v in fields.items()},
+                )
+            )
+            if limit is not None and len(result) >= limit:
+                break
+        return result
+
+    def clear(self):
+        self._records.clear()
+
+    def stats(self) -> DebugBufferStats:
+        return DebugBufferStats(
+            size=len(self._records),
+            maxlen=self._records.maxlen,
+            recorded=self.recorded,
+        )
+
+
+DEBUG_BUFFER = DebugRingBuffer()
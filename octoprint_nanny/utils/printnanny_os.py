@@ -1,11 +1,22 @@
 import os
-from typing import Optional, Any, Dict, List, TypedDict
+from typing import TYPE_CHECKING, Optional, Any, Callable, Dict, List, Tuple, TypedDict
 import logging
 import json
-import subprocess
-
-import printnanny_api_client
-from printnanny_api_client.models import Pi
+import asyncio
+import signal
+import threading
+import time
+
+from octoprint_nanny.env import (
+    PRINTNANNY_CLI_MAX_CONCURRENCY,
+    PRINTNANNY_CLI_TIMEOUT,
+    SYSTEM_INFO_TTL,
+)
+from octoprint_nanny.metrics import PRINTNANNY_CLI_CALLS, PRINTNANNY_CLI_DURATION
+
+# the generated API client is slow to import, get_template_vars needs this module at startup
+if TYPE_CHECKING:
+    from printnanny_api_client.models import Pi
 
 logger = logging.getLogger("octoprint.plugins.octoprint_nanny.utils")
 
@@ -14,7 +25,7 @@ PRINTNANNY_DEBUG = os.environ.get("PRINTNANNY_DEBUG", False)
 PRINTNANNY_DEBUG = PRINTNANNY_DEBUG in ["True", "true", "1", "yes"]
 
 
-PRINTNANNY_CLOUD_PI: Optional[Pi] = None
+PRINTNANNY_CLOUD_PI: Optional["Pi"] = None
 PRINTNANNY_CLOUD_NATS_CREDS: Optional[str] = None
 
 
@@ -35,12 +46,15 @@ class PrintNannyConfig(TypedDict):
     config: Optional[Dict[str, Any]]
 
 
-async def deserialize_pi(pi_dict) -> Pi:
+async def deserialize_pi(pi_dict) -> "Pi":
+    import printnanny_api_client
+    from printnanny_api_client.models import Pi
+
     async with printnanny_api_client.api_client.ApiClient() as client:
         return client._ApiClient__deserialize(pi_dict, Pi)  # type: ignore
 
 
-async def load_pi_model(pi_dict: Dict[str, Any]) -> Pi:
+async def load_pi_model(pi_dict: Dict[str, Any]) -> "Pi":
     result = await deserialize_pi(pi_dict)
     global PRINTNANNY_CLOUD_PI
     PRINTNANNY_CLOUD_PI = result
@@ -57,16 +71,96 @@ def load_api_config(api_config_dict: Dict[str, str]) -> PrintNannyApiConfig:
     return PRINTNANNY_CLOUD_API
 
 
-def sync_printnanny_cloud_data():
+class PrintNannyCliResult(TypedDict):
+    cmd: List[str]
+    stdout: str
+    stderr: str
+    returncode: Optional[int]
+
+
+# created lazily, asyncio primitives are bound to the event loop they are first used in
+_CLI_SEMAPHORE: Optional[Tuple[asyncio.AbstractEventLoop, asyncio.Semaphore]] = None
+# identical commands already running, concurrent callers share the result
+_CLI_INFLIGHT: Dict[Tuple[str, ...], "asyncio.Future[PrintNannyCliResult]"] = {}
+
+
+def _cli_semaphore() -> asyncio.Semaphore:
+    global _CLI_SEMAPHORE
+    loop = asyncio.get_running_loop()
+    if _CLI_SEMAPHORE is None or _CLI_SEMAPHORE[0] is not loop:
+        _CLI_SEMAPHORE = (loop, asyncio.Semaphore(PRINTNANNY_CLI_MAX_CONCURRENCY))
+    return _CLI_SEMAPHORE[1]
+
+
+async def _run_printnanny_cli(
+    cmd: Tuple[str, ...], timeout: float
+) -> PrintNannyCliResult:
+    # subcommand only, later args may hold secrets (e.g. cloud set ... api_key)
+    command = " ".join(cmd[1:3])
+    async with _cli_semaphore():
+        started = time.perf_counter()
+        try:
+            p = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                # own process group, so a timeout also kills anything the CLI spawned
+                start_new_session=True,
+            )
+        except FileNotFoundError:
+            PRINTNANNY_CLI_CALLS.labels(command, "not_found").inc()
+            raise
+        try:
+            stdout, stderr = await asyncio.wait_for(p.communicate(), timeout)
+        except asyncio.TimeoutError:
+            try:
+                os.killpg(p.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            await p.wait()
+            PRINTNANNY_CLI_CALLS.labels(command, "timeout").inc()
+            raise
+        finally:
+            PRINTNANNY_CLI_DURATION.labels(command).observe(
+                time.perf_counter() - started
+            )
+    PRINTNANNY_CLI_CALLS.labels(command, "ok" if p.returncode == 0 else "error").inc()
+    return PrintNannyCliResult(
+        cmd=list(cmd),
+        stdout=stdout.decode("utf-8"),
+        stderr=stderr.decode("utf-8"),
+        returncode=p.returncode,
+    )
+
+
+async def run_printnanny_cli(
+    *args: str, timeout: float = PRINTNANNY_CLI_TIMEOUT
+) -> PrintNannyCliResult:
+    """
+    Run PRINTNANNY_BIN with args without blocking the event loop
+
+    At most PRINTNANNY_CLI_MAX_CONCURRENCY commands run at once, and callers of a command that is
+    already running await the same result. The process is killed after timeout seconds.
+    Raises FileNotFoundError if PRINTNANNY_BIN is not installed and asyncio.TimeoutError on timeout
+    """
+    cmd = (PRINTNANNY_BIN, *args)
+    future = _CLI_INFLIGHT.get(cmd)
+    if future is None:
+        future = asyncio.ensure_future(_run_printnanny_cli(cmd, timeout))
+        _CLI_INFLIGHT[cmd] = future
+        future.add_done_callback(lambda _: _CLI_INFLIGHT.pop(cmd, None))
+    # a cancelled caller must not cancel the command for everyone else
+    return await asyncio.shield(future)
+
+
+async def sync_printnanny_cloud_data():
     logger.info("Attempting to sync PrintNanny Cloud data...")
     cmd = [PRINTNANNY_BIN, "cloud", "sync-models"]
     try:
-        p = subprocess.run(cmd, capture_output=True)
-        stdout = p.stdout.decode("utf-8")
-        stderr = p.stderr.decode("utf-8")
-        if p.returncode != 0:
+        p = await run_printnanny_cli("cloud", "sync-models", timeout=120)
+        if p["returncode"] != 0:
             logger.error(
-                f"Failed to get printnanny settings cmd={cmd} returncode={p.returncode} stdout={stdout} stderr={stderr}"
+                f"Failed to get printnanny settings cmd={cmd} returncode={p['returncode']} stdout={p['stdout']} stderr={p['stderr']}"
             )
             return
     except Exception as e:
@@ -77,16 +171,14 @@ async def load_printnanny_cloud_data():
     cmd = [PRINTNANNY_BIN, "cloud", "show"]
     # run /usr/bin/printnanny cloud show --format json
     try:
-        p = subprocess.run(cmd, capture_output=True)
-        stdout = p.stdout.decode("utf-8")
-        stderr = p.stderr.decode("utf-8")
-        if p.returncode != 0:
+        p = await run_printnanny_cli("cloud", "show")
+        if p["returncode"] != 0:
             logger.error(
-                f"Failed to get printnanny settings cmd={cmd} returncode={p.returncode} stdout={stdout} stderr={stderr}"
+                f"Failed to get printnanny settings cmd={cmd} returncode={p['returncode']} stdout={p['stdout']} stderr={p['stderr']}"
             )
             return
 
-        cloud_data = json.loads(stdout)
+        cloud_data = json.loads(p["stdout"])
         # try setting global PRINTNANNY_CLOUD_PI var
         result = await load_pi_model(cloud_data)
         logger.debug("Loaded PrintNanny Cloud pi data %s", result)
@@ -95,20 +187,20 @@ async def load_printnanny_cloud_data():
         logger.error("Error running cmd %s %s", cmd, e)
 
 
-def load_printnanny_settings() -> PrintNannyConfig:
+async def load_printnanny_settings() -> PrintNannyConfig:
     cmd = [PRINTNANNY_BIN, "settings", "show", "--format", "json"]
     returncode = None
     config = None
 
     # run /usr/bin/printnanny settings show -F json
     try:
-        p = subprocess.run(cmd, capture_output=True)
-        stdout = p.stdout.decode("utf-8")
-        stderr = p.stderr.decode("utf-8")
-        returncode = p.returncode
-        if p.returncode != 0:
+        p = await run_printnanny_cli("settings", "show", "--format", "json")
+        stdout = p["stdout"]
+        stderr = p["stderr"]
+        returncode = p["returncode"]
+        if returncode != 0:
             logger.error(
-                f"Failed to get printnanny settings cmd={cmd} returncode={p.returncode} stdout={stdout} stderr={stderr}"
+                f"Failed to get printnanny settings cmd={cmd} returncode={returncode} stdout={stdout} stderr={stderr}"
             )
             return PrintNannyConfig(
                 cmd=cmd,
@@ -127,6 +219,15 @@ def load_printnanny_settings() -> PrintNannyConfig:
             returncode=1,
             config=config,
         )
+    except asyncio.TimeoutError:
+        logger.error("Timed out running cmd=%s", cmd)
+        return PrintNannyConfig(
+            cmd=cmd,
+            stdout="",
+            stderr="",
+            returncode=None,
+            config=config,
+        )
     try:
         # parse JSON
         config = json.loads(stdout)
@@ -170,21 +271,12 @@ def issue_txt() -> str:
     return result
 
 
-def etc_os_release() -> Dict[str, str]:
-    """
-    Captures the contents of /etc/os-release as a dictionary
-    """
-    config = load_printnanny_settings()
-    os_release_path = "/etc/os-release"
-    if config["config"] is not None:
-        os_release_path = (
-            config["config"].get("paths", {}).get("os_release", os_release_path)
-        )
-
-    f = open(os_release_path, "r").read()
+def parse_os_release(
+    contents: str, os_release_path: str = "/etc/os-release"
+) -> Dict[str, str]:
     result = dict(ID="unknown")
     try:
-        lines = f.strip().split("\n")
+        lines = contents.strip().split("\n")
         for line in lines:
             k, v = line.split("=")
             result[k] = v
@@ -193,22 +285,157 @@ def etc_os_release() -> Dict[str, str]:
     return result
 
 
-def is_printnanny_os() -> bool:
-    osrelease = etc_os_release()
+def os_release_path(config: Optional[PrintNannyConfig]) -> str:
+    path = "/etc/os-release"
+    if config is not None and config["config"] is not None:
+        path = config["config"].get("paths", {}).get("os_release", path)
+    return path
+
+
+async def etc_os_release() -> Dict[str, str]:
+    """
+    Captures the contents of /etc/os-release as a dictionary
+    """
+    config = await load_printnanny_settings()
+    path = os_release_path(config)
+    f = open(path, "r").read()
+    return parse_os_release(f, path)
+
+
+async def is_printnanny_os() -> bool:
+    osrelease = await etc_os_release()
     return osrelease.get("ID") == "printnanny" or PRINTNANNY_DEBUG is True
 
 
-def set_octoprint_api_key(api_key: str):
+class SystemInfoStats(TypedDict):
+    hits: int
+    misses: int
+    settings_age: Optional[float]
+
+
+class SystemInfoCache:
+    """
+    In-memory copy of printnanny settings, /etc/os-release and /etc/issue
+
+    Settings come from the printnanny CLI via load_settings(), which runs on AsyncTaskWorker's loop.
+    Readers never wait on the CLI: once settings are older than ttl seconds, settings() schedules a
+    reload on that loop and returns the stale copy meanwhile. Files are re-read when their mtime changes
+    """
+
+    def __init__(self, ttl: float = SYSTEM_INFO_TTL, issue_path: str = "/etc/issue"):
+        self.ttl = ttl
+        self.issue_path = issue_path
+        # files are read from OctoPrint's request threads
+        self._lock = threading.Lock()
+        self._settings: Optional[PrintNannyConfig] = None
+        self._settings_loaded_at = 0.0
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # path -> (mtime, parsed contents)
+        self._files: Dict[str, Tuple[Optional[float], Any]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    async def load_settings(self) -> PrintNannyConfig:
+        self._loop = asyncio.get_running_loop()
+        settings = await load_printnanny_settings()
+        with self._lock:
+            self._settings = settings
+            self._settings_loaded_at = time.monotonic()
+        return settings
+
+    def refresh(self):
+        with self._lock:
+            self._settings_loaded_at = 0.0
+            self._files.clear()
+        self._schedule_load_settings()
+
+    def _schedule_load_settings(self):
+        if self._loop is not None and not self._loop.is_closed():
+            # run_printnanny_cli de-duplicates reloads scheduled by concurrent readers
+            asyncio.run_coroutine_threadsafe(self.load_settings(), self._loop)
+
+    def settings(self) -> Optional[PrintNannyConfig]:
+        """
+        Last loaded settings, None if load_settings() has not finished yet
+        """
+        with self._lock:
+            settings = self._settings
+            stale = time.monotonic() - self._settings_loaded_at >= self.ttl
+            if stale:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if stale:
+            self._schedule_load_settings()
+        return settings
+
+    def _read_file(self, path: str, parse: Callable[[Optional[str]], Any]) -> Any:
+        try:
+            mtime: Optional[float] = os.stat(path).st_mtime
+        except OSError:
+            mtime = None
+        with self._lock:
+            cached = self._files.get(path)
+            # a missing file stays cached as missing until it shows up
+            if cached is not None and cached[0] == mtime:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        # read outside the lock, concurrent misses parse the same file at worst
+        try:
+            with open(path, "r") as f:
+                contents: Optional[str] = f.read()
+        except Exception as e:
+            logger.error("Failed to read %s %s", path, e)
+            contents = None
+        result = parse(contents)
+        with self._lock:
+            self._files[path] = (mtime, result)
+        return result
+
+    def etc_os_release(self) -> Dict[str, str]:
+        path = os_release_path(self.settings())
+        return self._read_file(
+            path,
+            lambda contents: parse_os_release(contents or "", path),
+        )
+
+    def issue_txt(self) -> str:
+        return self._read_file(
+            self.issue_path,
+            lambda contents: contents.strip()
+            if contents is not None
+            else f"Failed to read {self.issue_path}",
+        )
+
+    def is_printnanny_os(self) -> bool:
+        return (
+            self.etc_os_release().get("ID") == "printnanny" or PRINTNANNY_DEBUG is True
+        )
+
+    def stats(self) -> SystemInfoStats:
+        return SystemInfoStats(
+            hits=self.hits,
+            misses=self.misses,
+            settings_age=time.monotonic() - self._settings_loaded_at
+            if self._settings is not None
+            else None,
+        )
+
+
+SYSTEM_INFO = SystemInfoCache()
+
+
+async def set_octoprint_api_key(api_key: str):
     cmd = [PRINTNANNY_BIN, "cloud", "set", "pi.octoprint_server.api_key", api_key]
-    # run /usr/bin/printnanny settings show -F json
     try:
-        p = subprocess.run(cmd, capture_output=True)
-        stdout = p.stdout.decode("utf-8")
-        stderr = p.stderr.decode("utf-8")
-        returncode = p.returncode
-        if p.returncode != 0:
+        p = await run_printnanny_cli(
+            "cloud", "set", "pi.octoprint_server.api_key", api_key
+        )
+        if p["returncode"] != 0:
             logger.error(
-                f"Failed to run cmd={cmd} returncode={p.returncode} stdout={stdout} stderr={stderr}"
+                f"Failed to run cmd={cmd} returncode={p['returncode']} stdout={p['stdout']} stderr={p['stderr']}"
             )
 
     except Exception as e:
@@ -1,14 +1,111 @@
 import threading
 import logging
 import asyncio
+import concurrent.futures
+import time
+from collections import deque
+from contextvars import ContextVar
 from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import (
+    Any,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypedDict,
+)
 
+from octoprint_nanny.env import (
+    WORKER_EXECUTOR_MAX_WORKERS,
+    WORKER_LAG_INTERVAL,
+    WORKER_SHUTDOWN_TIMEOUT,
+)
+from octoprint_nanny.metrics import (
+    EVENT_LOOP_LAG,
+    EVENTS_COALESCED,
+    EVENTS_DROPPED,
+    EVENTS_FAILED,
+    EVENTS_PUBLISHED,
+)
 
 logger = logging.getLogger("octoprint.plugins.octoprint_nanny.worker")
 
+# (event, enqueued_at) of the event EventQueue.run is handling. NatsBatchPublisher keeps it with the
+# event's message and observes EVENT_PUBLISH_LATENCY once the message's batch is flushed
+CURRENT_EVENT: ContextVar[Optional[Tuple[str, float]]] = ContextVar(
+    "octoprint_nanny_current_event", default=None
+)
+
+
+class WorkerStats(TypedDict):
+    running: bool
+    loop_lag_ms: float
+    max_loop_lag_ms: float
+    pending_tasks: int
+    executor_max_workers: int
+    executor_pending: int
+
+
+class CountingThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor that counts submitted calls which haven't finished, queued or running
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self._pending_lock = threading.Lock()
+        self.pending = 0
+
+    def submit(self, fn, /, *args, **kwargs):
+        # counted before submitting, a fast call can finish before submit() returns
+        with self._pending_lock:
+            self.pending += 1
+        try:
+            future = super().submit(fn, *args, **kwargs)
+        except BaseException:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, _future: Optional[concurrent.futures.Future]):
+        with self._pending_lock:
+            self.pending -= 1
+
 
 class AsyncTaskWorker:
-    def __init__(self):
+    """
+    asyncio event loop running in a daemon thread
+
+    The constructor returns once the loop is running, so run_coroutine_threadsafe is safe to call right away.
+    shutdown() gives a drain coroutine until the deadline to finish pending work, cancels whatever is left,
+    then stops and closes the loop from its own thread
+    """
+
+    def __init__(
+        self,
+        executor_max_workers: int = WORKER_EXECUTOR_MAX_WORKERS,
+        lag_interval: float = WORKER_LAG_INTERVAL,
+        ready_timeout: float = 10,
+    ):
+        self.executor_max_workers = executor_max_workers
+        self.lag_interval = lag_interval
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._executor = CountingThreadPoolExecutor(
+            max_workers=executor_max_workers, thread_name_prefix="PrintNanny"
+        )
+        self._ready = threading.Event()
+        self._stopping = False
+        self._lag_task: Optional[asyncio.Future] = None
+
+        self.loop_lag = 0.0
+        self.max_loop_lag = 0.0
+
         self._thread = threading.Thread(
             target=self.run,
             name=str(self.__class__),
@@ -16,20 +113,327 @@ class AsyncTaskWorker:
         self._thread.daemon = True
         logger.info(f"Starting thread {self._thread.name}")
         self._thread.start()
+        if not self._ready.wait(timeout=ready_timeout):
+            raise RuntimeError(f"{self._thread.name} did not start in {ready_timeout}s")
 
     def run(self):
-        self.loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(self.loop)
-        self.loop.set_default_executor(
-            ThreadPoolExecutor(thread_name_prefix="PrintNanny")
-        )
-        self.loop.run_forever()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        loop.set_default_executor(self._executor)
+        self.loop = loop
+        self._lag_task = loop.create_task(self._monitor_lag())
+        # set once run_forever is actually processing callbacks
+        loop.call_soon(self._ready.set)
+        try:
+            loop.run_forever()
+        finally:
+            loop.run_until_complete(loop.shutdown_default_executor())
+            loop.close()
+            logger.info(f"Stopped thread {self._thread.name}")
 
-    def shutdown(self, **kwargs):
-        logger.warning("NatsWorker shutdown initiated")
-        self.loop.stop()
-        self.loop.close()
-        self._thread.join()
+    async def _monitor_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            # how late the loop woke us up, i.e. how long callbacks were blocked
+            self.loop_lag = max(0.0, loop.time() - expected)
+            EVENT_LOOP_LAG.observe(self.loop_lag)
+            self.max_loop_lag = max(self.max_loop_lag, self.loop_lag)
+
+    async def _cancel_tasks(self):
+        current = asyncio.current_task()
+        tasks = [t for t in asyncio.all_tasks() if t is not current]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def shutdown(
+        self,
+        drain: Optional[Callable[[], Coroutine[Any, Any, Any]]] = None,
+        timeout: float = WORKER_SHUTDOWN_TIMEOUT,
+    ):
+        """
+        Await drain() for up to timeout seconds, then cancel remaining tasks and stop the loop
+        """
+        if self._stopping or self.loop is None:
+            return
+        logger.warning("AsyncTaskWorker shutdown initiated")
+        deadline = time.monotonic() + timeout
+        if drain is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(drain(), self.loop).result(
+                    timeout=timeout
+                )
+            except concurrent.futures.TimeoutError:
+                logger.error("AsyncTaskWorker drain did not finish in %ss", timeout)
+            except Exception as e:
+                logger.error("Error draining AsyncTaskWorker: %s", e)
+        self._stopping = True
+        try:
+            asyncio.run_coroutine_threadsafe(self._cancel_tasks(), self.loop).result(
+                timeout=max(0.1, deadline - time.monotonic())
+            )
+        except Exception as e:
+            logger.error("Error cancelling AsyncTaskWorker tasks: %s", e)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout=max(0.1, deadline - time.monotonic()))
 
     def run_coroutine_threadsafe(self, coro):
+        if self._stopping or self.loop is None:
+            coro.close()
+            raise RuntimeError("AsyncTaskWorker is shut down")
         return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stats(self) -> WorkerStats:
+        running = self.loop is not None and self.loop.is_running()
+        return WorkerStats(
+            running=running,
+            loop_lag_ms=self.loop_lag * 1000,
+            max_loop_lag_ms=self.max_loop_lag * 1000,
+            # all_tasks retries internally if the loop mutates its task set while we read it
+            pending_tasks=len(asyncio.all_tasks(self.loop)) if running else 0,
+            executor_max_workers=self.executor_max_workers,
+            executor_pending=self._executor.pending,
+        )
+
+
+class OverflowPolicy(str, Enum):
+    # discard the oldest queued event to make room for the new event
+    DROP_OLDEST = "drop_oldest"
+    # discard the new event, keep everything already queued
+    DROP_NEWEST = "drop_newest"
+    # replace the payload of a queued event with the same name, falling back to DROP_OLDEST
+    COALESCE = "coalesce"
+
+
+class EventOutcome(str, Enum):
+    """
+    What an EventQueue handler did with an event, each outcome increments exactly one counter
+    """
+
+    # handed to the NATS publisher, EVENTS_PUBLISHED
+    PUBLISHED = "published"
+    # held or replaced by a newer event of the same subject, EVENTS_COALESCED
+    COALESCED = "coalesced"
+    # discarded before publishing, EVENTS_DROPPED with the value as reason
+    RATE_LIMITED = "rate_limited"
+    NATS_UNAVAILABLE = "nats_unavailable"
+    UNTRACKED = "untracked"
+    # building or publishing the message failed, EVENTS_FAILED
+    FAILED = "failed"
+
+
+DROPPED_OUTCOMES = frozenset(
+    (EventOutcome.RATE_LIMITED, EventOutcome.NATS_UNAVAILABLE, EventOutcome.UNTRACKED)
+)
+
+
+class EventQueueStats(TypedDict):
+    depth: int
+    maxsize: int
+    overflow_policy: str
+    enqueued: int
+    # dropped/coalesced by overflow_policy while queued
+    dropped: int
+    coalesced: int
+    # outcome of every handled event, see EventOutcome
+    published: int
+    held: int
+    rejected: int
+    failed: int
+
+
+# plain bool handlers are treated as PUBLISHED (True) or FAILED (False)
+EventHandler = Callable[[str, Dict[Any, Any]], Awaitable[Any]]
+
+
+class EventQueue:
+    """
+    Bounded, thread-safe queue of (event, payload) pairs
+
+    put() is called from OctoPrint's event dispatch thread and never blocks on i/o.
+    run() is scheduled on AsyncTaskWorker's event loop and awaits handler(event, payload) for each queued item
+    """
+
+    def __init__(
+        self,
+        handler: EventHandler,
+        maxsize: int = 256,
+        overflow_policy: str = OverflowPolicy.DROP_OLDEST.value,
+    ):
+        if maxsize < 1:
+            raise ValueError(f"EventQueue maxsize must be >= 1, got {maxsize}")
+        self.handler = handler
+        self.maxsize = maxsize
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+
+        self._lock = threading.Lock()
+        # items are mutable [event, payload, enqueued_at] lists, so COALESCE can swap the payload in-place
+        self._items: Deque[List[Any]] = deque()
+        # most recently queued item for each event name
+        self._latest: Dict[str, List[Any]] = {}
+        # True while run() is parked waiting for new items
+        self._idle = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        # set while run() is parked with nothing left to handle, see drain()
+        self._parked: Optional[asyncio.Event] = None
+        self._task: Optional[concurrent.futures.Future] = None
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.published = 0
+        self.held = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def start(self, worker: AsyncTaskWorker):
+        self._loop = worker.loop
+        self._task = worker.run_coroutine_threadsafe(self.run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def wait_idle(self):
+        """
+        Wait until every queued event has been handled. Runs on the worker's event loop
+        """
+        if self._task is not None and self._parked is not None:
+            while not self._parked.is_set() or self._items:
+                await self._parked.wait()
+                # let a wakeup scheduled by a late put() run first
+                await asyncio.sleep(0)
+
+    async def drain(self):
+        """
+        Wait until every queued event has been handled, then stop. Runs on the worker's event loop
+        """
+        await self.wait_idle()
+        self.stop()
+
+    def put(self, event: str, payload: Dict[Any, Any]) -> bool:
+        """
+        Enqueue event without blocking, applying overflow_policy if the queue is full
+
+        Returns False if the event was dropped
+        """
+        with self._lock:
+            if len(self._items) >= self.maxsize:
+                accepted = self._overflow(event, payload)
+            else:
+                self._append(event, payload)
+                accepted = True
+            wakeup = accepted and self._idle
+            if wakeup:
+                self._idle = False
+
+        # only cross threads when the drain loop is actually parked
+        if wakeup and self._loop is not None and self._wakeup is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return accepted
+
+    def _append(self, event: str, payload: Dict[Any, Any]):
+        item = [event, payload, time.monotonic()]
+        self._items.append(item)
+        self._latest[event] = item
+        self.enqueued += 1
+
+    def _popleft(self) -> List[Any]:
+        item = self._items.popleft()
+        if self._latest.get(item[0]) is item:
+            del self._latest[item[0]]
+        return item
+
+    def _overflow(self, event: str, payload: Dict[Any, Any]) -> bool:
+        if self.overflow_policy is OverflowPolicy.DROP_NEWEST:
+            self.dropped += 1
+            EVENTS_DROPPED.labels("queue_full").inc()
+            logger.debug("EventQueue full, dropped newest event=%s", event)
+            return False
+
+        if self.overflow_policy is OverflowPolicy.COALESCE:
+            queued = self._latest.get(event)
+            if queued is not None:
+                queued[1] = payload
+                self.coalesced += 1
+                return True
+
+        dropped = self._popleft()
+        self.dropped += 1
+        EVENTS_DROPPED.labels("queue_full").inc()
+        logger.debug("EventQueue full, dropped oldest event=%s", dropped[0])
+        self._append(event, payload)
+        return True
+
+    def _get(self) -> Optional[List[Any]]:
+        with self._lock:
+            if self._items:
+                return self._popleft()
+            self._idle = True
+            return None
+
+    async def run(self):
+        self._wakeup = asyncio.Event()
+        self._parked = asyncio.Event()
+        logger.info(
+            "EventQueue started maxsize=%s overflow_policy=%s",
+            self.maxsize,
+            self.overflow_policy.value,
+        )
+        while True:
+            item = self._get()
+            if item is None:
+                self._parked.set()
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                self._parked.clear()
+                continue
+            event, payload, enqueued_at = item
+            token = CURRENT_EVENT.set((event, enqueued_at))
+            try:
+                outcome = await self.handler(event, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error handling queued event=%s error=%s", event, e)
+                self.failed += 1
+                EVENTS_FAILED.labels("exception").inc()
+                continue
+            finally:
+                CURRENT_EVENT.reset(token)
+            self._count(event, outcome)
+
+    def _count(self, event: str, outcome: Any):
+        if outcome is True or outcome is EventOutcome.PUBLISHED:
+            self.published += 1
+            EVENTS_PUBLISHED.labels(event).inc()
+        elif outcome is EventOutcome.COALESCED:
+            self.held += 1
+            EVENTS_COALESCED.labels(event).inc()
+        elif outcome in DROPPED_OUTCOMES:
+            self.rejected += 1
+            EVENTS_DROPPED.labels(outcome.value).inc()
+        else:
+            self.failed += 1
+            EVENTS_FAILED.labels("rejected").inc()
+
+    def stats(self) -> EventQueueStats:
+        return EventQueueStats(
+            depth=len(self._items),
+            maxsize=self.maxsize,
+            overflow_policy=self.overflow_policy.value,
+            enqueued=self.enqueued,
+            dropped=self.dropped,
+            coalesced=self.coalesced,
+            published=self.published,
+            held=self.held,
+            rejected=self.rejected,
+            failed=self.failed,
+        )
@@ -62,7 +62,9 @@ dev_requires = [
     "pytest-asyncio",
     "twine",
 ]
-extra_requires = {"dev": dev_requires}
+# optional, faster JSON serialization of outgoing messages (see utils/encoder.py)
+speedups_requires = ["orjson>=3.8"]
+extra_requires = {"dev": dev_requires, "speedups": speedups_requires}
 
 
 ### --------------------------------------------------------------------------------------------------------------------
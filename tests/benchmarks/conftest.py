@@ -0,0 +1,108 @@
+import asyncio
+import json
+import pytest
+
+
+def pytest_collection_modifyitems(config, items):
+    """
+    Benchmarks assert absolute numbers (see baselines.json), so they only run with --benchmark-only (make bench)
+    """
+    if config.getoption("benchmark_only", default=False):
+        return
+    selected, deselected = [], []
+    for item in items:
+        if "benchmark" in getattr(item, "fixturenames", ()):
+            deselected.append(item)
+        else:
+            selected.append(item)
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+        items[:] = selected
+
+
+class NatsStandIn:
+    """
+    Minimal in-process NATS server, speaks just enough of the client protocol
+    (INFO, CONNECT, PING/PONG, PUB/HPUB) for nats-py to connect and publish.
+    Published messages are counted and discarded.
+    """
+
+    def __init__(self, host: str = "127.0.0.1"):
+        self.host = host
+        self.port = 0
+        self.messages = 0
+        self.bytes = 0
+        self.subjects: dict = {}
+        self._server = None
+
+    @property
+    def url(self) -> str:
+        return f"nats://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        info = dict(
+            server_id="printnanny-standin",
+            version="2.9.0",
+            go="go1.19",
+            host=self.host,
+            port=self.port,
+            headers=True,
+            max_payload=1048576,
+            proto=1,
+        )
+        writer.write(b"INFO " + json.dumps(info).encode() + b"\r\n")
+        await writer.drain()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                parts = line.split()
+                if not parts:
+                    continue
+                op = parts[0].upper()
+                if op in (b"PUB", b"HPUB"):
+                    size = int(parts[-1])
+                    await reader.readexactly(size + 2)
+                    self.messages += 1
+                    self.bytes += size
+                    subject = parts[1].decode()
+                    self.subjects[subject] = self.subjects.get(subject, 0) + 1
+                elif op == b"PING":
+                    writer.write(b"PONG\r\n")
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+
+@pytest.fixture
+def event_loop_standin():
+    """
+    A private event loop and running NatsStandIn, for benchmarks that drive
+    coroutines from pytest-benchmark's synchronous timer
+    """
+    loop = asyncio.new_event_loop()
+    server = NatsStandIn()
+    loop.run_until_complete(server.start())
+    yield loop, server
+    loop.run_until_complete(server.stop())
+    loop.close()
+
+
+@pytest.fixture
+def nats_standin():
+    """
+    A NatsStandIn that isn't started yet, for benchmarks that run it on their own event loop
+    """
+    return NatsStandIn()
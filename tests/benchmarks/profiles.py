@@ -0,0 +1,166 @@
+"""
+Synthetic OctoPrint event streams for the end-to-end plugin benchmarks
+
+A trace is a list of steps, replayed in order by replay():
+    {"type": "event", "event": "PrintStarted", "payload": {...}} -> plugin.on_event
+    {"type": "progress", "storage": "local", "path": "...", "progress": 42} -> plugin.on_print_progress
+
+Recorded traces are JSON lines files in tests/fixtures/traces, one step per line
+"""
+import copy
+import json
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List
+
+TRACES_DIR = os.path.join(os.path.dirname(__file__), "..", "fixtures", "traces")
+
+GCODE_FILE = dict(
+    name="benchy_0.2mm_PLA_MK3S_2h11m.gcode",
+    path="benchy_0.2mm_PLA_MK3S_2h11m.gcode",
+    display="benchy_0.2mm_PLA_MK3S_2h11m.gcode",
+    origin="local",
+    size=4812317,
+    date=1679069626,
+)
+
+GCODE_EVENTS = ["Dwell", "Home", "Cooling", "Alert"]
+
+Step = Dict[str, Any]
+
+
+class FakePrinter:
+    """
+    Stands in for OctoPrint's PrinterInterface, get_current_data() follows the replayed progress
+    """
+
+    def __init__(self, print_time: float = 7860.0):
+        self.print_time = print_time
+        self.completion = 0.0
+
+    def get_current_data(self) -> Dict[str, Any]:
+        elapsed = int(self.print_time * self.completion / 100)
+        return {
+            "state": {"text": "Printing", "flags": {"printing": True}, "error": ""},
+            "job": {
+                "file": dict(GCODE_FILE),
+                "estimatedPrintTime": self.print_time,
+                "averagePrintTime": self.print_time * 0.97,
+                "lastPrintTime": self.print_time * 0.98,
+                "filament": {"tool0": {"length": 4650.2, "volume": 11.18}},
+                "user": "admin",
+            },
+            "currentZ": round(0.2 + self.completion * 0.48, 2),
+            "progress": {
+                "completion": self.completion,
+                "filepos": int(GCODE_FILE["size"] * self.completion / 100),
+                "printTime": elapsed,
+                "printTimeLeft": int(self.print_time) - elapsed,
+                "printTimeLeftOrigin": "estimate",
+            },
+            "offsets": {},
+            "resends": {"count": 0, "transmitted": 0, "ratio": 0},
+        }
+
+
+def event(event_name: str, **payload: Any) -> Step:
+    # OctoPrint payloads use name for the gcode file name
+    return dict(type="event", event=event_name, payload=payload)
+
+
+def state_changed(state_id: str, state_string: str) -> Step:
+    return event("PrinterStateChanged", state_id=state_id, state_string=state_string)
+
+
+def long_print(ticks: int = 2000, seed: int = 0) -> List[Step]:
+    """
+    A print with progress ticks, Z changes, gcode events, two pause/resume cycles and state changes
+    """
+    rng = random.Random(seed)
+    steps = [
+        event("Connected", port="/dev/ttyACM0", baudrate=115200),
+        state_changed("OPERATIONAL", "Operational"),
+        event("PrintStarted", name=GCODE_FILE["name"], path=GCODE_FILE["path"]),
+        state_changed("PRINTING", "Printing"),
+        event("Home"),
+    ]
+    pauses = {ticks // 3, 2 * ticks // 3}
+    for tick in range(ticks):
+        completion = round(100 * tick / ticks, 3)
+        steps.append(
+            dict(
+                type="progress",
+                storage="local",
+                path=GCODE_FILE["path"],
+                progress=completion,
+            )
+        )
+        # OctoPrint fires ZChange per layer, it isn't published
+        if tick % 5 == 0:
+            steps.append(event("ZChange", new=round(completion * 0.48, 2), old=None))
+        if rng.random() < 0.05:
+            steps.append(event(rng.choice(GCODE_EVENTS)))
+        if tick in pauses:
+            steps += [
+                event("PrintPaused", name=GCODE_FILE["name"]),
+                state_changed("PAUSED", "Paused"),
+                event("Dwell"),
+                event("PrintResumed", name=GCODE_FILE["name"]),
+                state_changed("PRINTING", "Printing"),
+            ]
+    steps += [
+        event("PrintDone", name=GCODE_FILE["name"], time=7860.0),
+        state_changed("OPERATIONAL", "Operational"),
+        event("Cooling"),
+    ]
+    return steps
+
+
+def firmware_loop(n: int = 2000) -> List[Step]:
+    """
+    Misbehaving firmware repeating Dwell/Home, exercises the gcode subject's rate limit
+    """
+    return [event("Dwell" if i % 2 else "Home") for i in range(n)]
+
+
+def load_trace(name: str) -> List[Step]:
+    with open(os.path.join(TRACES_DIR, name)) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def replay(
+    plugin: Any,
+    printer: FakePrinter,
+    steps: List[Step],
+    dispatch_ns: List[int],
+    wait: Callable[[], None],
+):
+    """
+    Dispatch every step to plugin like OctoPrint would, appending each call's duration to dispatch_ns
+
+    wait() is called whenever the plugin's event queue is full, so events are measured instead of dropped
+    """
+    maxsize = plugin.event_queue.maxsize
+    for step in steps:
+        while len(plugin.event_queue) >= maxsize - 1:
+            wait()
+        if step["type"] == "progress":
+            printer.completion = step["progress"]
+            started = time.perf_counter_ns()
+            plugin.on_print_progress(
+                step["storage"], step["path"], int(step["progress"])
+            )
+        else:
+            # OctoPrint hands every handler its own payload
+            payload = copy.copy(step["payload"])
+            started = time.perf_counter_ns()
+            plugin.on_event(step["event"], payload)
+        dispatch_ns.append(time.perf_counter_ns() - started)
+
+
+PROFILES: Dict[str, Callable[[], List[Step]]] = {
+    "long_print": long_print,
+    "firmware_loop": firmware_loop,
+    "recorded_short_print": lambda: load_trace("short_print.jsonl"),
+}
@@ -0,0 +1,45 @@
+"""
+build_nats_msg throughput per event type
+
+Run with: pytest tests/benchmarks/test_build_nats_msg.py --benchmark-only
+"""
+import pytest
+
+import printnanny_octoprint_models
+
+from octoprint_nanny.events import build_nats_msg, build_nats_payload
+
+PROGRESS = printnanny_octoprint_models.JobProgress(
+    completion=42.0,
+    filepos=1024,
+    printTime=600,
+    printTimeLeft=900,
+    printTimeLeftOrigin="estimate",
+)
+
+EVENTS = [
+    ("Startup", dict()),
+    ("Home", dict()),
+    ("PowerOn", dict()),
+    ("PrintDone", dict(job=None)),
+    ("PrinterStateChanged", dict(state_id="PRINTING", job=None)),
+    (
+        "PrintProgress",
+        dict(job=None, storage="local", path="benchmark.gcode", progress=PROGRESS),
+    ),
+]
+
+
+@pytest.mark.benchmark(group="build_nats_msg")
+@pytest.mark.parametrize("event,payload", EVENTS, ids=[e[0] for e in EVENTS])
+def test_benchmark_build_nats_msg(benchmark, event, payload):
+    msg = benchmark(build_nats_msg, event, payload)
+    assert msg
+
+
+@pytest.mark.benchmark(group="build_nats_payload")
+@pytest.mark.parametrize("event,payload", EVENTS, ids=[e[0] for e in EVENTS])
+def test_benchmark_build_nats_payload(benchmark, event, payload):
+    # constant events hit CONSTANT_PAYLOAD_CACHE after the first round
+    msg = benchmark(build_nats_payload, event, payload)
+    assert msg
@@ -0,0 +1,66 @@
+"""
+Plugin import cost during OctoPrint's plugin discovery
+
+Run with: pytest tests/benchmarks/test_import_time.py --benchmark-only
+Per-module breakdown: python -X importtime -c "import octoprint_nanny.plugins"
+"""
+import json
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+# OctoPrint has already imported these by the time it discovers plugins
+PRELOAD = "import octoprint.plugin, flask"
+
+DEFERRED_MODULES = (
+    "aiohttp",
+    "backoff",
+    "nats",
+    "printnanny_api_client",
+    "printnanny_octoprint_models",
+    "octoprint_nanny.clients.nats",
+    "octoprint_nanny.clients.rest",
+    "octoprint_nanny.events",
+)
+
+
+def importtime(module: str) -> Dict[str, int]:
+    """
+    Cumulative import time in microseconds per module, from a fresh interpreter
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"{PRELOAD}; import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    timings = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        timings[name.strip()] = int(cumulative_us)
+    return timings
+
+
+def test_plugin_import_defers_heavy_modules():
+    script = (
+        f"{PRELOAD}; import json, sys; import octoprint_nanny.plugins; "
+        "print(json.dumps(sorted(sys.modules)))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    loaded = set(json.loads(result.stdout))
+    assert [m for m in DEFERRED_MODULES if m in loaded] == []
+
+
+@pytest.mark.benchmark(group="import_time")
+def test_benchmark_plugin_import_time(benchmark):
+    timings = benchmark.pedantic(
+        importtime, args=("octoprint_nanny.plugins",), rounds=3, iterations=1
+    )
+    benchmark.extra_info["cumulative_us"] = timings["octoprint_nanny.plugins"]
+    assert "nats" not in timings
@@ -0,0 +1,63 @@
+"""
+Serialization cost of representative NATS messages: pydantic .json() against encoder.dumps backends
+
+Run with: pytest tests/benchmarks/test_json_backends.py --benchmark-only
+"""
+import pytest
+
+import printnanny_octoprint_models
+
+from octoprint_nanny.utils.encoder import get_dumps
+
+JOB = printnanny_octoprint_models.Job(
+    file=printnanny_octoprint_models.GcodeFile(
+        fileName="benchmark.gcode",
+        display="benchmark.gcode",
+        filePath="benchmark.gcode",
+        origin="local",
+        size=4 * 1024 * 1024,
+        timestamp=1667305815,
+    ),
+    averagePrintTime=3600.0,
+    estimatedPrintTime=3500.0,
+    lastPrintTime=3650.0,
+    filaments=[
+        printnanny_octoprint_models.Filament(
+            length=4200.5, volume=10.1, toolName="tool0"
+        )
+    ],
+)
+
+MESSAGES = dict(
+    JobProgressChanged=printnanny_octoprint_models.JobProgressChanged(
+        job=JOB,
+        storage="local",
+        path="benchmark.gcode",
+        progress=printnanny_octoprint_models.JobProgress(
+            completion=42.0,
+            filepos=1024,
+            printTime=600,
+            printTimeLeft=900,
+            printTimeLeftOrigin="estimate",
+        ),
+    ),
+    PrinterStatusChanged=printnanny_octoprint_models.PrinterStatusChanged(
+        job=JOB, status=printnanny_octoprint_models.PrinterStatus.PRINTING
+    ),
+)
+
+
+@pytest.mark.benchmark(group="json-serialize")
+@pytest.mark.parametrize("name", MESSAGES.keys())
+def test_benchmark_pydantic_json(benchmark, name):
+    msg = MESSAGES[name]
+    assert benchmark(lambda: msg.json().encode("utf-8"))
+
+
+@pytest.mark.benchmark(group="json-serialize")
+@pytest.mark.parametrize("backend", ["json", "orjson"])
+@pytest.mark.parametrize("name", MESSAGES.keys())
+def test_benchmark_dumps(benchmark, name, backend):
+    msg = MESSAGES[name]
+    dumps = get_dumps(backend)
+    assert benchmark(lambda: dumps(msg.dict()))
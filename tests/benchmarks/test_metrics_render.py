@@ -0,0 +1,37 @@
+"""
+Cost of rendering /printnanny/metrics with every tracked event type observed
+
+Run with: pytest tests/benchmarks/test_metrics_render.py --benchmark-only
+"""
+import pytest
+
+from octoprint_nanny.events import EVENT_REGISTRY
+from octoprint_nanny.metrics import (
+    EVENT_PUBLISH_LATENCY,
+    EVENTS_PUBLISHED,
+    EVENTS_SEEN,
+    NATS_MSG_BUILD_TIME,
+    NATS_MSG_SERIALIZE_TIME,
+    REGISTRY,
+)
+
+
+@pytest.fixture
+def observed_registry():
+    for event in EVENT_REGISTRY:
+        EVENTS_SEEN.labels(event).inc()
+        EVENTS_PUBLISHED.labels(event).inc()
+        for histogram in (
+            EVENT_PUBLISH_LATENCY,
+            NATS_MSG_BUILD_TIME,
+            NATS_MSG_SERIALIZE_TIME,
+        ):
+            histogram.labels(event).observe(0.001)
+    return REGISTRY
+
+
+@pytest.mark.benchmark(group="metrics")
+def test_benchmark_render_metrics(benchmark, observed_registry):
+    text = benchmark(observed_registry.render)
+    benchmark.extra_info["bytes"] = len(text)
+    assert text.endswith("\n")
@@ -0,0 +1,82 @@
+"""
+Compare NATS publish throughput of the per-message path (publish + log each message)
+against NatsBatchPublisher, using an in-process NATS stand-in
+
+Run with: pytest tests/benchmarks/test_nats_batch_publish.py --benchmark-only
+"""
+import logging
+import nats
+import pytest
+
+from octoprint_nanny.events import BatchPolicy, NatsBatchPublisher
+
+logger = logging.getLogger("octoprint.plugins.octoprint_nanny.benchmarks")
+
+SUBJECT = "pi.benchmark.octoprint.event.printer.job_progress"
+MSG = b'{"job": null, "storage": "local", "path": "benchmark.gcode", "progress": {"completion": 42.0, "filepos": 1024, "printTime": 600, "printTimeLeft": 900, "printTimeLeftOrigin": "estimate"}}'
+N_MESSAGES = 1000
+
+
+async def publish_per_message(nc, n: int):
+    for _ in range(n):
+        await nc.publish(SUBJECT, MSG)
+        logger.info("Published NATS message: subject=%s message=%s", SUBJECT, MSG)
+    await nc.flush()
+
+
+async def publish_batched(publisher: NatsBatchPublisher, n: int, policy: BatchPolicy):
+    for _ in range(n):
+        await publisher.publish(SUBJECT, MSG, policy)
+    await publisher.flush()
+
+
+@pytest.fixture
+def plugin_log_file(tmp_path):
+    # OctoPrint writes plugin INFO logs to disk, include that cost in the comparison
+    handler = logging.FileHandler(tmp_path / "octoprint.log")
+    plugin_logger = logging.getLogger("octoprint.plugins.octoprint_nanny")
+    level = plugin_logger.level
+    plugin_logger.addHandler(handler)
+    plugin_logger.setLevel(logging.INFO)
+    yield
+    plugin_logger.setLevel(level)
+    plugin_logger.removeHandler(handler)
+    handler.close()
+
+
+@pytest.fixture
+def nats_client(event_loop_standin, plugin_log_file):
+    loop, server = event_loop_standin
+    nc = loop.run_until_complete(nats.connect(servers=[server.url]))
+    yield loop, server, nc
+    loop.run_until_complete(nc.close())
+
+
+def _report(benchmark, server, rounds_n: int):
+    stats = benchmark.stats.stats
+    benchmark.extra_info["messages_per_sec"] = rounds_n / stats.mean
+    # every published message reached the stand-in
+    assert server.messages == N_MESSAGES * stats.rounds
+
+
+@pytest.mark.benchmark(group="nats-publish")
+def test_benchmark_publish_per_message(benchmark, nats_client):
+    loop, server, nc = nats_client
+    benchmark.pedantic(
+        lambda: loop.run_until_complete(publish_per_message(nc, N_MESSAGES)),
+        rounds=10,
+    )
+    _report(benchmark, server, N_MESSAGES)
+
+
+@pytest.mark.benchmark(group="nats-publish")
+@pytest.mark.parametrize("max_messages", [10, 100])
+def test_benchmark_publish_batched(benchmark, nats_client, max_messages):
+    loop, server, nc = nats_client
+    publisher = NatsBatchPublisher(nc)
+    policy = BatchPolicy(max_messages=max_messages, max_delay_ms=250)
+    benchmark.pedantic(
+        lambda: loop.run_until_complete(publish_batched(publisher, N_MESSAGES, policy)),
+        rounds=10,
+    )
+    _report(benchmark, server, N_MESSAGES)
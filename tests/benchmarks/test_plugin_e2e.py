@@ -0,0 +1,165 @@
+"""
+End-to-end plugin benchmarks: OctoPrint event streams replayed through OctoPrintNannyPlugin.on_event
+and on_print_progress, published to an in-process NATS stand-in
+
+Reports events/sec, p50/p99 on_event dispatch time (OctoPrint's thread), p50/p99 enqueue-to-flush
+latency (including batch delays) and memory per event, and fails if a profile regresses past baselines.json
+
+Run with: pytest tests/benchmarks/test_plugin_e2e.py --benchmark-only
+Update baselines: OCTOPRINT_NANNY_UPDATE_BASELINES=1 pytest tests/benchmarks/test_plugin_e2e.py --benchmark-only
+"""
+import gc
+import json
+import os
+import time
+import tracemalloc
+from typing import Any, Dict, List
+from unittest.mock import patch
+
+import pytest
+
+from octoprint_nanny.events import NATS_RATE_LIMITER
+from octoprint_nanny.plugins import OctoPrintNannyPlugin
+
+from profiles import PROFILES, FakePrinter, replay
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+UPDATE_BASELINES = os.environ.get("OCTOPRINT_NANNY_UPDATE_BASELINES") in (
+    "1",
+    "true",
+    "True",
+)
+
+
+class LatencyRecorder:
+    """
+    Replaces events.EVENT_PUBLISH_LATENCY, keeps every observation instead of histogram buckets
+    """
+
+    def __init__(self):
+        self.values: List[float] = []
+
+    def labels(self, *_labels: str) -> "LatencyRecorder":
+        return self
+
+    def observe(self, value: float):
+        self.values.append(value)
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+@pytest.fixture
+def e2e_plugin(tmp_path, monkeypatch, nats_standin):
+    server = nats_standin
+    plugin = OctoPrintNannyPlugin()
+    printer = FakePrinter()
+    plugin._printer = printer
+    plugin._data_folder = str(tmp_path)
+    NATS_RATE_LIMITER.reset()
+
+    plugin.worker.run_coroutine_threadsafe(server.start()).result(5)
+    monkeypatch.setenv("PRINTNANNY_OS_NATS_URL", server.url)
+    plugin.on_startup()
+    plugin.worker.run_coroutine_threadsafe(plugin.nats_connection.connect()).result(5)
+    # the first event imports the message models, keep that out of the measurements
+    plugin.on_event("Connected", {})
+    plugin.worker.run_coroutine_threadsafe(plugin.event_queue.wait_idle()).result(5)
+    yield plugin, printer, server
+
+    async def drain():
+        await plugin.drain()
+        await server.stop()
+
+    plugin.worker.shutdown(drain=drain)
+    NATS_RATE_LIMITER.reset()
+
+
+def run_profile(plugin: OctoPrintNannyPlugin, printer: FakePrinter, steps, dispatch_ns):
+    replay(plugin, printer, steps, dispatch_ns, wait=lambda: time.sleep(0.0005))
+    plugin.worker.run_coroutine_threadsafe(plugin.event_queue.wait_idle()).result(60)
+
+
+def measure_memory(plugin, printer, steps) -> Dict[str, float]:
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before, _ = tracemalloc.get_traced_memory()
+        run_profile(plugin, printer, steps, [])
+        gc.collect()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return dict(
+        retained_bytes_per_event=round(max(0, after - before) / len(steps), 1),
+        peak_bytes_per_event=round((peak - before) / len(steps), 1),
+    )
+
+
+def load_baselines() -> Dict[str, Any]:
+    with open(BASELINES_PATH) as f:
+        return json.load(f)
+
+
+def check_baseline(profile: str, results: Dict[str, float]):
+    baselines = load_baselines()
+    if UPDATE_BASELINES:
+        baselines["profiles"][profile] = {
+            key: results[key] for key in baselines["tolerance"]
+        }
+        with open(BASELINES_PATH, "w") as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write("\n")
+        return
+
+    baseline = baselines["profiles"].get(profile)
+    assert baseline is not None, f"No baseline for profile {profile}, see module docs"
+    failures = []
+    for key, tolerance in baselines["tolerance"].items():
+        # events_per_sec must not drop below baseline * tolerance, everything else
+        # must not exceed baseline * tolerance + slack, small baselines are noisy
+        if key == "events_per_sec":
+            limit = baseline[key] * tolerance
+            failed = results[key] < limit
+        else:
+            limit = baseline[key] * tolerance + baselines["slack"].get(key, 0)
+            failed = results[key] > limit
+        if failed:
+            failures.append(
+                f"{key}={results[key]} baseline={baseline[key]} limit={limit:0.1f}"
+            )
+    assert not failures, f"{profile} regressed: {', '.join(failures)}"
+
+
+@pytest.mark.benchmark(group="plugin-e2e")
+@pytest.mark.parametrize("profile", list(PROFILES))
+def test_benchmark_plugin_e2e(benchmark, e2e_plugin, profile):
+    plugin, printer, server = e2e_plugin
+    steps = PROFILES[profile]()
+    dispatch_ns: List[int] = []
+    latency = LatencyRecorder()
+
+    with patch("octoprint_nanny.events.EVENT_PUBLISH_LATENCY", latency):
+        benchmark.pedantic(
+            run_profile, args=(plugin, printer, steps, dispatch_ns), rounds=3
+        )
+    memory = measure_memory(plugin, printer, steps)
+
+    results = dict(
+        events=len(steps),
+        events_per_sec=round(len(steps) / benchmark.stats.stats.mean, 1),
+        dispatch_p50_us=round(percentile(dispatch_ns, 0.5) / 1000, 1),
+        dispatch_p99_us=round(percentile(dispatch_ns, 0.99) / 1000, 1),
+        publish_p50_ms=round(percentile(latency.values, 0.5) * 1000, 3),
+        publish_p99_ms=round(percentile(latency.values, 0.99) * 1000, 3),
+        nats_messages=server.messages,
+        **memory,
+    )
+    benchmark.extra_info.update(results)
+
+    # the replay waits for queue space, nothing is dropped on the way to the worker loop
+    assert plugin.event_queue.stats()["dropped"] == 0
+    assert server.messages > 0
+    check_baseline(profile, results)
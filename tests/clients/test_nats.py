@@ -0,0 +1,77 @@
+import asyncio
+import socket
+
+import nats
+import pytest
+from unittest.mock import patch
+
+from octoprint_nanny.clients.nats import NatsConnectionManager, NatsConnectionState
+from octoprint_nanny.events import default_nats_publisher
+
+
+@pytest.mark.asyncio
+@patch("nats.connect")
+async def test_connection_healthy(mock_nats):
+    connection = NatsConnectionManager(servers=["nats://localhost:4223"])
+    assert connection.healthy is False
+
+    mock_nats.return_value.pending_data_size = 0
+    await connection.connect()
+    assert connection.state is NatsConnectionState.CONNECTED
+    assert connection.healthy is True
+
+    # outbound buffer is over the limit, apply backpressure
+    mock_nats.return_value.pending_data_size = connection.max_pending_bytes
+    assert connection.healthy is False
+
+
+@pytest.mark.asyncio
+@patch("nats.connect")
+async def test_connection_reconnect_callbacks(mock_nats):
+    mock_nats.return_value.pending_data_size = 0
+    connection = NatsConnectionManager(servers=["nats://localhost:4223"])
+    await connection.connect()
+
+    await connection._disconnected_cb()
+    assert connection.state is NatsConnectionState.RECONNECTING
+    assert connection.healthy is False
+
+    await connection._reconnected_cb()
+    assert connection.state is NatsConnectionState.CONNECTED
+    stats = connection.stats()
+    assert stats["disconnects"] == 1
+    assert stats["reconnects"] == 1
+
+
+def unused_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_connect_gives_up_without_broker():
+    connection = NatsConnectionManager(
+        servers=[f"nats://127.0.0.1:{unused_port()}"],
+        connect_timeout=1,
+        reconnect_time_wait=0,
+        max_reconnect_attempts=2,
+    )
+    # bounded by max_reconnect_attempts instead of retrying the first connect forever
+    with pytest.raises(nats.errors.NoServersError):
+        await asyncio.wait_for(connection.connect(), 5)
+    assert connection.state is NatsConnectionState.DISCONNECTED
+    assert connection.errors == 3
+
+
+@pytest.mark.asyncio
+async def test_default_nats_publisher_connects_in_background():
+    with patch("octoprint_nanny.events.NATS_CONNECTION", None), patch(
+        "octoprint_nanny.events.NATS_BATCH_PUBLISHER", None
+    ), patch(
+        "octoprint_nanny.events.printnanny_os_nats_url",
+        return_value=f"nats://127.0.0.1:{unused_port()}",
+    ):
+        publisher = await asyncio.wait_for(default_nats_publisher(), 1)
+        assert publisher.connection.healthy is False
+        await publisher.connection.close()
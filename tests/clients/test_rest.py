@@ -0,0 +1,65 @@
+import aiohttp
+import printnanny_api_client
+import printnanny_api_client.rest
+import pytest
+
+from octoprint_nanny.clients.rest import PrintNannyCloudAPIClient, fatal_code
+
+
+@pytest.mark.asyncio
+async def test_api_client_is_pooled():
+    client = PrintNannyCloudAPIClient(
+        base_path="https://printnanny.ai/api/",
+        bearer_access_token="token",
+        connection_limit=4,
+        dns_cache_ttl=60,
+    )
+    assert client._api_config.host == "https://printnanny.ai"
+    assert client._api_config.access_token == "token"
+
+    api_client = await client._get_api_client()
+    # every request shares one ApiClient and session
+    assert await client._get_api_client() is api_client
+    session = api_client.rest_client.pool_manager
+    assert session.connector.limit == 4
+    assert session.connector.use_dns_cache
+    assert session.connector._keepalive_timeout == client.keepalive_timeout
+
+    await client.close()
+    assert session.closed
+    # a new session is created on next use
+    api_client = await client._get_api_client()
+    assert not api_client.rest_client.pool_manager.closed
+    await client.close()
+
+
+@pytest.mark.asyncio
+async def test_api_client_session_matches_generated_client():
+    client = PrintNannyCloudAPIClient(
+        base_path="https://printnanny.ai/api/", connection_limit=4
+    )
+    generated = printnanny_api_client.rest.RESTClientObject(client._api_config)
+    api_client = await client._get_api_client()
+    session = api_client.rest_client.pool_manager
+    try:
+        # proxy environment variables and .netrc still apply
+        assert session.trust_env is generated.pool_manager.trust_env is True
+        assert session.connector.limit == generated.pool_manager.connector.limit
+        assert (
+            session.connector._ssl.verify_mode
+            == generated.pool_manager.connector._ssl.verify_mode
+        )
+        assert api_client.rest_client.proxy == generated.proxy
+    finally:
+        await generated.pool_manager.close()
+        await client.close()
+
+
+@pytest.mark.parametrize(
+    "status,expected",
+    [(400, True), (404, True), (429, False), (500, False), (503, False)],
+)
+def test_fatal_code(status, expected):
+    e = printnanny_api_client.exceptions.ApiException(status=status)
+    assert fatal_code(e) is expected
+    assert fatal_code(aiohttp.ClientConnectionError()) is False
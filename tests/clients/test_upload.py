@@ -0,0 +1,94 @@
+import tracemalloc
+
+import pytest
+import pytest_asyncio
+from aiohttp import web
+
+from octoprint_nanny.clients.rest import PrintNannyCloudAPIClient
+from octoprint_nanny.metrics import REST_REQUESTS
+
+ARCHIVE_SIZE = 8 * 1024 * 1024
+
+
+@pytest_asyncio.fixture
+async def backups_server():
+    received = dict()
+
+    async def create_backup(request):
+        reader = await request.multipart()
+        async for part in reader:
+            if part.filename is None:
+                received[part.name] = await part.text()
+                continue
+            size = 0
+            while True:
+                chunk = await part.read_chunk()
+                if not chunk:
+                    break
+                size += len(chunk)
+            received["filename"] = part.filename
+            received["size"] = size
+        received["chunked"] = request.headers.get("Transfer-Encoding") == "chunked"
+        return web.json_response(
+            dict(
+                id=1,
+                created_dt="2022-11-01T12:00:00Z",
+                hostname=received["hostname"],
+                name=received["name"],
+                octoprint_version=received["octoprint_version"],
+                file=received["filename"],
+                user=1,
+            ),
+            status=201,
+        )
+
+    app = web.Application()
+    app.router.add_post("/api/octoprint/backups/", create_backup)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    yield f"http://127.0.0.1:{port}", received
+    await runner.cleanup()
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / "octoprint-backup.zip"
+    with open(path, "wb") as f:
+        for _ in range(ARCHIVE_SIZE // (1024 * 1024)):
+            f.write(b"\0" * 1024 * 1024)
+    return str(path)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chunked", [False, True])
+async def test_create_backup_streams_archive(backups_server, archive, chunked):
+    url, received = backups_server
+    client = PrintNannyCloudAPIClient(base_path=url)
+    progress = []
+    requests = REST_REQUESTS.labels("create_backup", "2xx").value
+
+    tracemalloc.start()
+    try:
+        backup = await client.create_backup(
+            "octoprint",
+            "octoprint-backup.zip",
+            "1.8.6",
+            archive,
+            progress_callback=lambda sent, total: progress.append((sent, total)),
+            chunked=chunked,
+        )
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+        await client.close()
+
+    assert backup.id == 1
+    assert REST_REQUESTS.labels("create_backup", "2xx").value == requests + 1
+    assert received["size"] == ARCHIVE_SIZE
+    assert received["chunked"] is chunked
+    assert progress[-1] == (ARCHIVE_SIZE, ARCHIVE_SIZE)
+    # the archive is never held in memory, client and test server included
+    assert peak < ARCHIVE_SIZE / 4
@@ -18,8 +18,11 @@ class MockResponse(object):
 
 @pytest.fixture
 def current_temperatures():
-    # TODO get payload structure https://docs.octoprint.org/en/master/modules/printer.html#octoprint.printer.PrinterInterface.get_current_temperatures
-    return dict()
+    # https://docs.octoprint.org/en/master/modules/printer.html#octoprint.printer.PrinterInterface.get_current_temperatures
+    return {
+        "tool0": {"actual": 210.3, "target": 210.0, "offset": 0},
+        "bed": {"actual": 60.1, "target": 60.0, "offset": 0},
+    }
 
 
 @pytest.fixture
@@ -1,9 +1,34 @@
+import asyncio
+import copy
 import pytest
 import json
 from unittest.mock import patch, MagicMock, AsyncMock
-from octoprint_nanny.events import octoprint_event_to_nats_subject, try_publish_nats
+from octoprint_nanny.events import (
+    octoprint_event_to_nats_subject,
+    try_publish_nats,
+    build_nats_msg,
+    build_nats_payload,
+    clear_constant_payload_cache,
+    constant_payload_cache_info,
+    default_nats_publisher,
+    BatchPolicy,
+    EventCoalescer,
+    NatsBatchPublisher,
+    EVENT_MAPPINGS,
+    JOB_SNAPSHOT,
+    JobSnapshot,
+    NatsSubjectResolver,
+    ProgressDeltaEncoder,
+    PrintJobDataMissing,
+)
+from octoprint_nanny.outbox import NatsOutbox
+from octoprint_nanny.plugins import OctoPrintNannyPlugin
+from octoprint_nanny.ratelimit import RateLimit, RateLimiter
+from octoprint_nanny.retry import RetryPolicy
 from octoprint_nanny.utils import printnanny_os
+from octoprint_nanny.worker import CURRENT_EVENT, EventOutcome
 import socket
+import time
 
 MOCK_PI_JSON = """{
     "id": 2,
@@ -126,7 +151,7 @@ MOCK_STATE_DATA = {
 @patch("nats.connect")
 async def test_handle_untracked_event(mock_nats):
     result = await try_publish_nats("someuntrackedevent", dict())
-    assert result is False
+    assert result is EventOutcome.UNTRACKED
     assert mock_nats.connect.called is False
 
 
@@ -136,12 +161,360 @@ async def test_handle_tracked_event(mock_nats):
 
     MOCK_PI = await printnanny_os.load_pi_model(json.loads(MOCK_PI_JSON))
     printnanny_os.PRINTNANNY_CLOUD_PI = MOCK_PI
+    mock_nats.return_value.pending_data_size = 0
+    # the default connection is started in the background
+    publisher = await default_nats_publisher()
+    for _ in range(100):
+        if publisher.connection.healthy:
+            break
+        await asyncio.sleep(0.01)
     result = await try_publish_nats("Startup", dict())
 
-    assert result is True
+    assert result is EventOutcome.PUBLISHED
     assert mock_nats.called is True
     assert mock_nats.return_value.publish.called is True
     call_args = mock_nats.return_value.publish.call_args[0]
+    # cloud Pi id is preferred over the hostname once loaded
+    assert call_args[0] == "pi.2.octoprint.event.server.startup"
+    assert json.loads(call_args[1]) == {"status": "Startup"}
+
+
+@pytest.mark.asyncio
+async def test_batch_publisher_flushes_on_max_messages():
+    nc = AsyncMock()
+    publisher = NatsBatchPublisher(nc)
+    policy = BatchPolicy(max_messages=3, max_delay_ms=60000)
+    for i in range(3):
+        assert await publisher.publish("pi.test.gcode", f"{i}".encode(), policy)
+    assert nc.publish.call_count == 3
+    assert nc.flush.call_count == 1
+    assert publisher.published == 3
+
+
+@pytest.mark.asyncio
+async def test_batch_publisher_retry_does_not_republish_sent_messages():
+    nc = AsyncMock()
+    publisher = NatsBatchPublisher(
+        nc, retry_policy=RetryPolicy(retry_on=(asyncio.TimeoutError,), base_delay=0)
+    )
+    policy = BatchPolicy(max_messages=100, max_delay_ms=60000)
+    for i in range(3):
+        await publisher.publish("pi.test.gcode", f"{i}".encode(), policy)
+    nc.publish.side_effect = [None, asyncio.TimeoutError, None, None]
+    assert await publisher.flush() is True
+    # the retry resumes at the message that failed
+    assert [c.args[1] for c in nc.publish.call_args_list] == [b"0", b"1", b"1", b"2"]
+    assert nc.flush.call_count == 1
+    assert publisher.published == 3
+
+
+@pytest.mark.asyncio
+async def test_batch_publisher_flushes_on_max_delay():
+    nc = AsyncMock()
+    publisher = NatsBatchPublisher(nc)
+    policy = BatchPolicy(max_messages=100, max_delay_ms=10)
+    await publisher.publish("pi.test.job_progress", b"1", policy)
+    await publisher.publish("pi.test.job_progress", b"2", policy)
+    assert nc.publish.called is False
+    await asyncio.sleep(0.05)
+    assert nc.publish.call_count == 2
+    assert nc.flush.call_count == 1
+
+
+@pytest.mark.asyncio
+async def test_batch_publisher_observes_latency_when_batch_is_flushed():
+    nc = AsyncMock()
+    publisher = NatsBatchPublisher(nc)
+    policy = BatchPolicy(max_messages=100, max_delay_ms=60000)
+    with patch("octoprint_nanny.events.EVENT_PUBLISH_LATENCY") as latency:
+        token = CURRENT_EVENT.set(("PrintProgress", time.monotonic() - 1))
+        try:
+            await publisher.publish("pi.test.job_progress", b"1", policy)
+        finally:
+            CURRENT_EVENT.reset(token)
+        # buffered, not published yet
+        assert latency.labels.called is False
+        await publisher.flush()
+    latency.labels.assert_called_once_with("PrintProgress")
+    assert latency.labels.return_value.observe.call_args.args[0] >= 1
+
+
+@pytest.mark.asyncio
+async def test_batch_publisher_writes_durable_messages_to_outbox(tmp_path):
+    connection = AsyncMock()
+    connection.healthy = False
+    outbox = NatsOutbox(str(tmp_path), replay_rate=100000)
+    publisher = NatsBatchPublisher(connection, outbox=outbox)
+
+    assert await publisher.publish("pi.test.job_status", b"1", durable=True) is True
+    assert connection.publish.called is False
+    assert outbox.stats()["appended"] == 1
+
+    # connection comes back, outbox is replayed
+    connection.healthy = True
+    connection.publish.reset_mock()
+    await publisher.replay_outbox()
+    connection.publish.assert_called_once_with("pi.test.job_status", b"1")
+    assert bool(outbox) is False
+
+
+@pytest.mark.asyncio
+async def test_coalescer_publishes_latest_at_end_of_window():
+    coalescer = EventCoalescer({"pi.{pi_id}.octoprint.event.printer.job_progress": 20})
+    publish = AsyncMock(return_value=True)
+    assert coalescer.coalesces("PrintProgress") is True
+    assert coalescer.coalesces("PrintDone") is False
+
+    assert coalescer.submit("PrintProgress", dict(n=1), publish) is True
+    assert coalescer.submit("PrintProgress", dict(n=2), publish) is False
+    assert coalescer.submit("PrintProgress", dict(n=3), publish) is False
+    await asyncio.sleep(0.05)
+    publish.assert_called_once_with("PrintProgress", dict(n=3))
+    assert coalescer.coalesced == 1
+
+
+@pytest.mark.asyncio
+async def test_try_publish_nats_flushes_coalesced_before_job_status():
+    coalescer = EventCoalescer(
+        {"pi.{pi_id}.octoprint.event.printer.job_progress": 60000}
+    )
+    publisher = NatsBatchPublisher(AsyncMock())
+    with patch("octoprint_nanny.events.publish_nats_event") as publish:
+        await try_publish_nats("PrintProgress", dict(n=1), publisher, coalescer)
+        await try_publish_nats("PrintProgress", dict(n=2), publisher, coalescer)
+        await try_publish_nats("PrintDone", dict(), publisher, coalescer)
+    assert [c.args for c in publish.call_args_list] == [
+        ("PrintProgress", dict(n=1)),
+        ("PrintProgress", dict(n=2)),
+        ("PrintDone", dict()),
+    ]
+
+
+@pytest.mark.parametrize(
+    "event,expected",
+    [
+        ("Home", {"gcode": "Home__G28"}),
+        ("PowerOff", {"gcode": "PowerOff__M81"}),
+        ("Shutdown", {"status": "Shutdown"}),
+        ("PrintCancelled", {"job": None, "status": "PrintCanelled"}),
+    ],
+)
+def test_build_nats_msg(event, expected):
+    assert json.loads(build_nats_msg(event, dict())) == expected
+
+
+def test_constant_payload_cache():
+    clear_constant_payload_cache()
+    payload = build_nats_payload("Home", dict())
+    assert payload == build_nats_msg("Home", dict())
+    # cached payload is returned as-is
+    assert build_nats_payload("Home", dict()) is payload
+    assert constant_payload_cache_info() == {"Home": payload.decode("utf-8")}
+
+    # payload-dependent events are never cached
+    build_nats_payload("PrinterStateChanged", dict(state_id="PRINTING", job=None))
+    assert "PrinterStateChanged" not in constant_payload_cache_info()
+
+    clear_constant_payload_cache()
+    assert constant_payload_cache_info() == {}
+
+
+def test_job_snapshot_rebuilds_only_when_job_changes():
+    state_data = dict(
+        job=dict(
+            file=dict(
+                name="benchy.gcode",
+                path="benchy.gcode",
+                file_path="/home/pi/.octoprint/uploads/benchy.gcode",
+                origin="local",
+                size=37332,
+                date=1679069626,
+            ),
+            estimatedPrintTime=30.7,
+            averagePrintTime=25.5,
+            lastPrintTime=26.5,
+            filament=dict(tool0=dict(length=22.6, volume=0.05)),
+        )
+    )
+    snapshot = JobSnapshot()
+    job = snapshot.get(state_data)
+    assert job.file.fileName == "benchy.gcode"
+    assert snapshot.get(copy.deepcopy(state_data)) is job
+    assert (snapshot.hits, snapshot.misses) == (1, 1)
+
+    # re-uploaded file with the same name
+    state_data["job"]["file"]["date"] = 1679070000
+    assert snapshot.get(state_data) is not job
+    assert snapshot.misses == 2
+
+    with pytest.raises(PrintJobDataMissing):
+        snapshot.get(dict(job=None))
+
+
+# OctoPrint's get_current_data() printing an SD card file it hasn't analysed
+SD_PRINT_STATE_DATA = {
+    "state": {"text": "Printing from SD", "flags": {"printing": True}, "error": ""},
+    "job": {
+        "file": {
+            "name": "benchy~1.gco",
+            "path": "benchy~1.gco",
+            "display": "benchy~1.gco",
+            "origin": "sdcard",
+            "size": 4812317,
+            "date": None,
+        },
+        "estimatedPrintTime": None,
+        "lastPrintTime": None,
+        "filament": {"tool0": {"length": None, "volume": None}},
+        "user": "admin",
+    },
+    "currentZ": 0.2,
+    "progress": {
+        "completion": 1.5,
+        "filepos": 72184,
+        "printTime": 91,
+        "printTimeLeft": None,
+        "printTimeLeftOrigin": None,
+    },
+    "offsets": {},
+    "resends": {"count": 0, "transmitted": 0, "ratio": 0},
+}
+
+
+@pytest.mark.parametrize("state", ["idle", "sd_print"])
+def test_job_snapshot_caches_invalid_job_as_none(state, current_printer_state):
+    state_data = current_printer_state if state == "idle" else SD_PRINT_STATE_DATA
+    snapshot = JobSnapshot()
+    assert snapshot.get(state_data) is None
+    # the failed build isn't retried on every progress tick
+    assert snapshot.get(copy.deepcopy(state_data)) is None
+    assert snapshot.stats()["failures"] == 1
+    assert (snapshot.hits, snapshot.misses) == (1, 1)
+
+
+@pytest.mark.parametrize("state", ["idle", "sd_print"])
+def test_plugin_enqueues_events_without_job(state, current_printer_state):
+    state_data = current_printer_state if state == "idle" else SD_PRINT_STATE_DATA
+    plugin = OctoPrintNannyPlugin()
+    plugin._printer = MagicMock()
+    plugin._printer.get_current_data.return_value = state_data
+    JOB_SNAPSHOT.clear()
+
+    plugin.on_event("PrintStarted", dict(name="benchy~1.gco", origin="sdcard"))
+    plugin.on_print_progress("sdcard", "benchy~1.gco", 1)
+    assert [item[0] for item in plugin.event_queue._items] == [
+        "PrintStarted",
+        "PrintProgress",
+    ]
+    assert all(item[1]["job"] is None for item in plugin.event_queue._items)
+    JOB_SNAPSHOT.clear()
+
+
+def test_progress_delta_encoder():
+    encoder = ProgressDeltaEncoder(keyframe_interval=3)
+    msg = dict(
+        job=None,
+        storage="local",
+        path="benchy.gcode",
+        progress=dict(completion=1.0, filepos=10, printTime=5, printTimeLeft=100),
+    )
+    keyframe = encoder.encode(msg)
+    assert keyframe == dict(msg, encoding="keyframe", seq=1)
+
+    msg["progress"] = dict(msg["progress"], completion=2.0, filepos=20)
+    assert encoder.encode(msg) == dict(
+        encoding="delta",
+        seq=2,
+        keyframe_seq=1,
+        progress=dict(completion=2.0, filepos=20),
+    )
+    assert encoder.encode(msg)["progress"] == {}
+    # one keyframe every keyframe_interval messages
+    assert encoder.encode(msg)["encoding"] == "keyframe"
+
+    # a different file is a new keyframe
+    assert encoder.encode(dict(msg, path="cube.gcode"))["encoding"] == "keyframe"
+    encoder.reset()
+    assert encoder.encode(dict(msg, path="cube.gcode"))["encoding"] == "keyframe"
+    assert encoder.stats() == dict(seq=6, keyframe_seq=6, keyframes=4, deltas=2)
+
+    encoder = ProgressDeltaEncoder(keyframe_interval=3)
+    encodings = "".join(encoder.encode(msg)["encoding"][0] for _ in range(10))
+    assert encodings == "kddkddkddk"
+
+
+def test_build_nats_payload_delta_progress():
+    encoder = ProgressDeltaEncoder()
+    payload = dict(job=None, storage="local", path="benchy.gcode", progress=None)
+    with patch("octoprint_nanny.events.PROGRESS_DELTA_ENCODER", encoder):
+        first = json.loads(build_nats_payload("PrintProgress", payload))
+        second = json.loads(build_nats_payload("PrintProgress", payload))
+        build_nats_payload("PrintStarted", dict(job=None))
+        third = json.loads(build_nats_payload("PrintProgress", payload))
+    assert (first["encoding"], first["seq"]) == ("keyframe", 1)
+    assert second == dict(encoding="delta", seq=2, keyframe_seq=1, progress={})
+    assert (third["encoding"], third["seq"]) == ("keyframe", 3)
+
+
+@pytest.mark.asyncio
+async def test_try_publish_nats_rate_limits_before_building_msg():
+    limiter = RateLimiter({"pi.{pi_id}.octoprint.event.gcode": RateLimit(0, 3)})
+    coalescer = EventCoalescer({})
+    publisher = NatsBatchPublisher(AsyncMock())
+    with patch(
+        "octoprint_nanny.events.publish_nats_event",
+        AsyncMock(return_value=EventOutcome.PUBLISHED),
+    ) as publish:
+        results = [
+            await try_publish_nats("Dwell", dict(), publisher, coalescer, limiter)
+            for _ in range(5)
+        ]
+        # other subjects have their own budget
+        assert (
+            await try_publish_nats("PrintDone", dict(), publisher, coalescer, limiter)
+            is EventOutcome.PUBLISHED
+        )
+    assert results == [EventOutcome.PUBLISHED] * 3 + [EventOutcome.RATE_LIMITED] * 2
+    assert publish.call_count == 4
+    assert limiter.stats()["pi.{pi_id}.octoprint.event.gcode"]["limited"] == 2
+
+
+@pytest.mark.asyncio
+async def test_try_publish_nats_rate_limit_coalesces():
+    subject = "pi.{pi_id}.octoprint.event.printer.job_progress"
+    limiter = RateLimiter({subject: RateLimit(0, 1)})
+    coalescer = EventCoalescer({subject: 60000})
+    publisher = NatsBatchPublisher(AsyncMock())
+    with patch("octoprint_nanny.events.publish_nats_event") as publish:
+        await try_publish_nats(
+            "PrintProgress", dict(n=1), publisher, coalescer, limiter
+        )
+        # window closed early, bucket is empty
+        coalescer._timers.pop(subject).cancel()
+        assert (
+            await try_publish_nats(
+                "PrintProgress", dict(n=2), publisher, coalescer, limiter
+            )
+            is EventOutcome.COALESCED
+        )
+        assert publish.call_count == 1
+        await coalescer.flush()
+    assert publish.call_args.args == ("PrintProgress", dict(n=2))
+    coalescer._timers.pop(subject).cancel()
+
+
+def test_nats_subject_resolver_prefers_cloud_pi_id():
     hostname = socket.gethostname()
-    assert call_args[0] == f"pi.{hostname}.octoprint.event.server.startup"
-    assert call_args[1] == b'{"status": "Startup"}'
+    with patch.object(printnanny_os, "PRINTNANNY_CLOUD_PI", None):
+        resolver = NatsSubjectResolver(EVENT_MAPPINGS)
+        assert resolver.subject("Home") == f"pi.{hostname}.octoprint.event.gcode"
+        assert resolver.stats()["source"] == "hostname"
+
+        printnanny_os.PRINTNANNY_CLOUD_PI = MagicMock(id=7)
+        assert resolver.subject("Home") == "pi.7.octoprint.event.gcode"
+        # a reloaded Pi with the same id reuses the resolved subjects
+        subjects = resolver._subjects
+        printnanny_os.PRINTNANNY_CLOUD_PI = MagicMock(id=7)
+        assert resolver.pi_id == "7"
+        assert resolver._subjects is subjects
+        assert resolver.stats() == dict(pi_id="7", source="cloud", refreshes=2)
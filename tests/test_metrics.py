@@ -0,0 +1,102 @@
+import math
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from octoprint_nanny.events import build_nats_msg
+from octoprint_nanny.metrics import (
+    PRINTNANNY_CLI_CALLS,
+    NATS_MSG_BUILD_TIME,
+    NATS_MSG_SERIALIZE_TIME,
+    Histogram,
+    MetricsRegistry,
+    hdr_buckets,
+)
+from octoprint_nanny.utils import printnanny_os
+
+
+def test_hdr_buckets():
+    bounds = hdr_buckets(lowest=0.001, highest=1, sub_buckets=4)
+    assert bounds == tuple(sorted(bounds))
+    assert 0.001 <= bounds[0] <= 0.001 * 1.25
+    assert bounds[-1] >= 1
+    # constant relative bucket width
+    for lower, upper in zip(bounds[4:], bounds[5:]):
+        assert upper / lower <= 1.25 + 1e-9
+
+
+def test_histogram_quantile():
+    histogram = Histogram(hdr_buckets(lowest=0.001, highest=10, sub_buckets=4))
+    for n in range(1, 101):
+        histogram.observe(n / 1000)
+    assert histogram.count == 100
+    assert histogram.sum == pytest.approx(5.05)
+    assert 0.05 <= histogram.quantile(0.5) <= 0.05 * 1.25
+    assert 0.099 <= histogram.quantile(0.99) <= 0.1 * 1.25
+
+    histogram.observe(100)
+    assert histogram.quantile(1.0) == math.inf
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    latency = registry.histogram(
+        "test_latency_seconds", "Test latency", ["event"], bounds=(0.1, 1.0)
+    )
+    latency.labels('Print"Done').observe(0.05)
+    latency.labels('Print"Done').observe(0.5)
+    assert registry.histogram("test_latency_seconds", "Test latency") is latency
+    with pytest.raises(ValueError):
+        latency.labels("a", "b")
+
+    assert registry.render().splitlines() == [
+        "# HELP test_latency_seconds Test latency",
+        "# TYPE test_latency_seconds histogram",
+        'test_latency_seconds_bucket{event="Print\\"Done",le="0.1"} 1',
+        'test_latency_seconds_bucket{event="Print\\"Done",le="1"} 2',
+        'test_latency_seconds_bucket{event="Print\\"Done",le="+Inf"} 2',
+        'test_latency_seconds_sum{event="Print\\"Done"} 0.55',
+        'test_latency_seconds_count{event="Print\\"Done"} 2',
+    ]
+
+
+def test_build_nats_msg_is_timed():
+    build_count = NATS_MSG_BUILD_TIME.labels("Home").count
+    serialize_count = NATS_MSG_SERIALIZE_TIME.labels("Home").count
+    build_nats_msg("Home", dict())
+    assert NATS_MSG_BUILD_TIME.labels("Home").count == build_count + 1
+    assert NATS_MSG_SERIALIZE_TIME.labels("Home").count == serialize_count + 1
+
+
+def test_counter_threads():
+    registry = MetricsRegistry()
+    counter = registry.counter("test_events_total", "Test events", ["event"])
+
+    def work():
+        for _ in range(10000):
+            counter.labels("Home").inc()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # no increments lost without a lock
+    assert counter.labels("Home").value == 40000
+    assert registry.render().splitlines() == [
+        "# HELP test_events_total Test events",
+        "# TYPE test_events_total counter",
+        'test_events_total{event="Home"} 40000',
+    ]
+
+
+@pytest.mark.asyncio
+async def test_printnanny_cli_is_counted(tmp_path):
+    not_found = PRINTNANNY_CLI_CALLS.labels("settings show", "not_found")
+    count = not_found.value
+    with patch(
+        "octoprint_nanny.utils.printnanny_os.PRINTNANNY_BIN", str(tmp_path / "missing")
+    ):
+        await printnanny_os.load_printnanny_settings()
+    assert not_found.value == count + 1
@@ -0,0 +1,131 @@
+import os
+import pytest
+from unittest.mock import AsyncMock
+
+from octoprint_nanny.outbox import NatsOutbox, encode_frame
+
+
+def make_outbox(path, **kwargs):
+    kwargs.setdefault("replay_rate", 100000)
+    return NatsOutbox(str(path), **kwargs)
+
+
+@pytest.mark.asyncio
+async def test_outbox_replays_in_order(tmp_path):
+    outbox = make_outbox(tmp_path, max_segment_bytes=64)
+    for i in range(10):
+        outbox.append("pi.test.job_status", f"msg{i}".encode())
+    assert bool(outbox) is True
+    assert outbox.stats()["segments"] > 1
+
+    publish = AsyncMock(return_value=True)
+    assert await outbox.replay(publish) == 10
+    assert [c.args[1] for c in publish.call_args_list] == [
+        f"msg{i}".encode() for i in range(10)
+    ]
+    assert bool(outbox) is False
+    assert outbox.stats()["segments"] == 0
+
+
+@pytest.mark.asyncio
+async def test_outbox_resumes_after_failed_publish_and_restart(tmp_path):
+    outbox = make_outbox(tmp_path)
+    for i in range(5):
+        outbox.append("pi.test.job_status", f"msg{i}".encode())
+
+    publish = AsyncMock(side_effect=[True, True, False])
+    assert await outbox.replay(publish) == 2
+    outbox.close()
+
+    # cursor is persisted, a new outbox picks up where replay stopped
+    outbox = make_outbox(tmp_path)
+    publish = AsyncMock(return_value=True)
+    assert await outbox.replay(publish) == 3
+    assert [c.args[1] for c in publish.call_args_list] == [b"msg2", b"msg3", b"msg4"]
+
+
+def test_outbox_max_bytes_drops_oldest_segments(tmp_path):
+    frame_size = len(encode_frame("pi.test.job_status", b"x" * 32))
+    outbox = make_outbox(
+        tmp_path, max_segment_bytes=frame_size * 2, max_bytes=frame_size * 4
+    )
+    for _ in range(10):
+        outbox.append("pi.test.job_status", b"x" * 32)
+    stats = outbox.stats()
+    assert stats["bytes"] <= frame_size * 4
+    assert stats["dropped_bytes"] == frame_size * 6
+
+
+@pytest.mark.asyncio
+async def test_outbox_stops_at_truncated_frame(tmp_path):
+    outbox = make_outbox(tmp_path)
+    outbox.append("pi.test.job_status", b"complete")
+    outbox.close()
+    # simulate power loss in the middle of a write
+    segment = os.path.join(tmp_path, sorted(os.listdir(tmp_path))[0])
+    with open(segment, "ab") as f:
+        f.write(encode_frame("pi.test.job_status", b"partial")[:-3])
+
+    outbox = make_outbox(tmp_path)
+    # new frames don't land after the torn one
+    outbox.append("pi.test.job_status", b"after restart")
+    publish = AsyncMock(return_value=True)
+    assert await outbox.replay(publish) == 2
+    assert [c.args[1] for c in publish.call_args_list] == [
+        b"complete",
+        b"after restart",
+    ]
+    assert outbox.stats()["corrupt"] == 1
+
+
+@pytest.mark.asyncio
+async def test_outbox_moves_aside_segment_with_corrupt_frame(tmp_path):
+    outbox = make_outbox(tmp_path)
+    for i in range(3):
+        outbox.append("pi.test.job_status", f"msg{i}".encode())
+    outbox.close()
+    # flip a payload byte of the middle frame
+    frame_size = len(encode_frame("pi.test.job_status", b"msg0"))
+    segment = os.path.join(tmp_path, sorted(os.listdir(tmp_path))[0])
+    with open(segment, "r+b") as f:
+        f.seek(frame_size * 2 - 1)
+        f.write(b"X")
+
+    outbox = make_outbox(tmp_path)
+    outbox.append("pi.test.job_status", b"after restart")
+    publish = AsyncMock(return_value=True)
+    # frames after the corrupt one are counted as lost, later segments still replay
+    assert await outbox.replay(publish) == 2
+    assert [c.args[1] for c in publish.call_args_list] == [b"msg0", b"after restart"]
+    stats = outbox.stats()
+    assert stats["corrupt"] == 1
+    assert stats["corrupt_bytes"] == frame_size * 2
+    assert os.path.exists(segment[: -len(".seg")] + ".corrupt")
+
+
+@pytest.mark.asyncio
+async def test_outbox_keeps_segment_being_replayed_over_max_bytes(tmp_path):
+    frame_size = len(encode_frame("pi.test.job_status", b"x" * 32))
+    outbox = make_outbox(
+        tmp_path, max_segment_bytes=frame_size * 2, max_bytes=frame_size * 4
+    )
+    for _ in range(4):
+        outbox.append("pi.test.job_status", b"x" * 32)
+    replayed = []
+
+    async def publish(subject, payload):
+        replayed.append(payload)
+        # durable messages arrive while the outbox replays, going over max_bytes
+        if len(replayed) == 1:
+            for _ in range(4):
+                outbox.append("pi.test.job_status", b"y" * 32)
+        return True
+
+    # used to delete the segment being read, then fail with ValueError
+    assert await outbox.replay(publish) == 4
+    stats = outbox.stats()
+    assert stats["dropped_bytes"] == frame_size * 4
+    # the segment being read is kept, the next (oldest droppable) ones go
+    assert replayed[:2] == [b"x" * 32, b"x" * 32]
+    assert stats["segments"] == 0
+    assert bool(outbox) is False
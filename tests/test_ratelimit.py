@@ -0,0 +1,22 @@
+import time
+
+from octoprint_nanny.ratelimit import RateLimit, RateLimiter, TokenBucket
+
+
+def test_token_bucket_allows_burst_then_rate():
+    bucket = TokenBucket(RateLimit(rate=100, burst=2))
+    assert bucket.allow() is True
+    assert bucket.allow() is True
+    assert bucket.allow() is False
+    time.sleep(0.02)
+    assert bucket.allow() is True
+    assert bucket.stats()["allowed"] == 3
+    assert bucket.stats()["limited"] == 1
+
+
+def test_rate_limiter_ignores_unknown_keys():
+    limiter = RateLimiter({"limited": RateLimit(rate=0, burst=1)})
+    assert limiter.allow("limited") is True
+    assert limiter.allow("limited") is False
+    assert all(limiter.allow("unlimited") for _ in range(100))
+    assert list(limiter.stats()) == ["limited"]
@@ -0,0 +1,114 @@
+import asyncio
+import time
+
+import pytest
+
+from octoprint_nanny.exceptions import CircuitOpenError
+from octoprint_nanny.retry import (
+    CircuitBreaker,
+    CircuitState,
+    RetryBudget,
+    RetryPolicy,
+    call_with_retry,
+)
+
+POLICY = RetryPolicy(retry_on=(ConnectionError,), max_tries=3, base_delay=0.001)
+
+
+class Flaky:
+    def __init__(self, failures: int, exc: Exception = ConnectionError("down")):
+        self.failures = failures
+        self.exc = exc
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.exc
+        return "ok"
+
+
+@pytest.mark.asyncio
+async def test_retry_until_success():
+    fn = Flaky(failures=2)
+    assert await call_with_retry(fn, policy=POLICY) == "ok"
+    assert fn.calls == 3
+
+
+@pytest.mark.asyncio
+async def test_retry_gives_up():
+    fn = Flaky(failures=5)
+    with pytest.raises(ConnectionError):
+        await call_with_retry(fn, policy=POLICY)
+    assert fn.calls == POLICY.max_tries
+
+    # fatal errors and errors outside retry_on are raised on the first try
+    fn = Flaky(failures=5)
+    with pytest.raises(ConnectionError):
+        await call_with_retry(fn, policy=POLICY._replace(giveup=lambda e: True))
+    assert fn.calls == 1
+    fn = Flaky(failures=5, exc=ValueError("bad request"))
+    with pytest.raises(ValueError):
+        await call_with_retry(fn, policy=POLICY)
+    assert fn.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast():
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=60)
+    fn = Flaky(failures=100)
+    with pytest.raises(ConnectionError):
+        await call_with_retry(fn, policy=POLICY, breaker=breaker)
+    assert breaker.state is CircuitState.OPEN
+    assert fn.calls == 3
+
+    started = time.monotonic()
+    for _ in range(100):
+        with pytest.raises(CircuitOpenError):
+            await call_with_retry(fn, policy=POLICY, breaker=breaker)
+    assert time.monotonic() - started < 0.1
+    assert fn.calls == 3
+    assert breaker.stats()["rejected"] == 100
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_half_open():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    with pytest.raises(ConnectionError):
+        await call_with_retry(
+            Flaky(failures=1), policy=POLICY._replace(max_tries=1), breaker=breaker
+        )
+    assert breaker.state is CircuitState.OPEN
+    # reset_timeout elapsed, the trial call succeeds and closes the circuit
+    assert await call_with_retry(Flaky(failures=0), policy=POLICY, breaker=breaker)
+    assert breaker.state is CircuitState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_retry_budget():
+    budget = RetryBudget(ratio=0.0, min_per_second=0.0)
+    budget.balance = 1
+    fn = Flaky(failures=100)
+    with pytest.raises(ConnectionError):
+        await call_with_retry(fn, policy=POLICY._replace(max_tries=10), budget=budget)
+    # one retry allowed by the budget
+    assert fn.calls == 2
+    assert budget.stats()["exhausted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_half_open_error_outside_retry_on():
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=0)
+    breaker.record_failure()
+    assert breaker.state is CircuitState.OPEN
+    # the trial call raises something the policy doesn't retry, the circuit opens again
+    with pytest.raises(asyncio.TimeoutError):
+        await call_with_retry(
+            Flaky(failures=1, exc=asyncio.TimeoutError()),
+            policy=POLICY,
+            breaker=breaker,
+        )
+    assert breaker.state is CircuitState.OPEN
+    # instead of rejecting every later call
+    assert await call_with_retry(Flaky(failures=0), policy=POLICY, breaker=breaker)
+    assert breaker.state is CircuitState.CLOSED
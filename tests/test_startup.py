@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from octoprint_nanny.exceptions import StartupStepError
+from octoprint_nanny.startup import StartupPipeline, StartupState
+
+
+@pytest.mark.asyncio
+async def test_startup_pipeline_runs_independent_steps_concurrently():
+    started = []
+
+    def step(name):
+        async def run():
+            started.append(name)
+            await asyncio.sleep(0.05)
+            return name
+
+        return run
+
+    pipeline = StartupPipeline()
+    pipeline.add_step("a", step("a"))
+    pipeline.add_step("b", step("b"))
+    pipeline.add_step("c", step("c"), requires=["a", "b"])
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    assert await pipeline.run() is True
+    # a and b overlap, c waits for both
+    assert loop.time() - start < 0.14
+    assert started[-1] == "c"
+    assert pipeline.result("c") == "c"
+    assert pipeline.stats()["c"]["state"] == "ready"
+
+
+@pytest.mark.asyncio
+async def test_startup_pipeline_skips_dependents_of_failed_step():
+    async def fail():
+        raise StartupStepError("no settings")
+
+    async def ok():
+        return True
+
+    pipeline = StartupPipeline()
+    pipeline.add_step("settings", fail)
+    pipeline.add_step("api_client", ok, requires=["settings"])
+    pipeline.add_step("nats", ok)
+
+    assert await pipeline.run() is False
+    assert pipeline.state("settings") == StartupState.FAILED
+    assert pipeline.state("api_client") == StartupState.SKIPPED
+    assert pipeline.ready("nats") is True
+    assert await pipeline.wait("nats") is True
+    assert pipeline.stats()["api_client"]["error"] == "requires settings"
+
+
+def test_startup_pipeline_rejects_unknown_requirement():
+    async def ok():
+        return True
+
+    pipeline = StartupPipeline()
+    with pytest.raises(ValueError):
+        pipeline.add_step("api_client", ok, requires=["settings"])
@@ -0,0 +1,117 @@
+import asyncio
+import json
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from octoprint_nanny.events import publish_nats_telemetry
+from octoprint_nanny.telemetry import RingBuffer, TemperatureTelemetry, aggregate
+
+
+def test_ring_buffer_window_wraps_and_keeps_newest():
+    buffer = RingBuffer(4)
+    for value in range(6):
+        buffer.append(float(value))
+    assert list(buffer.window()) == [2.0, 3.0, 4.0, 5.0]
+    # window() clears pending samples
+    assert len(buffer) == 0
+    assert list(buffer.window()) == []
+
+    buffer.append(6.0)
+    buffer.append(7.0)
+    assert list(buffer.window()) == [6.0, 7.0]
+
+
+def test_aggregate():
+    buffer = RingBuffer(8)
+    for value in (200.0, 205.0, 210.0, 209.0):
+        buffer.append(value)
+    assert aggregate(buffer.window()) == dict(
+        min=200.0, max=210.0, mean=206.0, last=209.0, samples=4
+    )
+    assert aggregate(buffer.window()) is None
+
+
+def test_temperature_telemetry_build_msg(current_temperatures):
+    telemetry = TemperatureTelemetry(
+        lambda: current_temperatures,
+        AsyncMock(),
+        sample_interval=1,
+        publish_interval=10,
+    )
+    telemetry.sample()
+    current_temperatures["tool0"]["actual"] = 212.3
+    current_temperatures["bed"]["target"] = None
+    telemetry.sample()
+
+    msg = json.loads(telemetry.build_msg())
+    assert msg["sensors"]["tool0"]["actual"] == dict(
+        min=210.3, max=212.3, mean=211.3, last=212.3, samples=2
+    )
+    # samples without a target are skipped
+    assert msg["sensors"]["bed"]["target"]["samples"] == 1
+    assert "offset" not in msg["sensors"]["bed"]
+    assert telemetry.build_msg() is None
+    assert telemetry.stats()["windows"] == 1
+
+
+@pytest.mark.asyncio
+async def test_temperature_telemetry_run_publishes_windows(current_temperatures):
+    publish = AsyncMock(return_value=True)
+    telemetry = TemperatureTelemetry(
+        lambda: current_temperatures,
+        publish,
+        sample_interval=0.01,
+        publish_interval=0.05,
+    )
+    task = asyncio.create_task(telemetry.run())
+    await asyncio.sleep(0.13)
+    task.cancel()
+
+    assert publish.await_count >= 2
+    msg = json.loads(publish.await_args.args[0])
+    assert msg["sensors"]["bed"]["actual"]["last"] == 60.1
+    assert telemetry.stats()["published"] == publish.await_count
+
+
+@pytest.mark.parametrize(
+    "sample_interval,publish_interval", [(0, 30), (2, 0), (-1, 30)]
+)
+def test_temperature_telemetry_disabled(sample_interval, publish_interval):
+    telemetry = TemperatureTelemetry(
+        MagicMock(),
+        AsyncMock(),
+        sample_interval=sample_interval,
+        publish_interval=publish_interval,
+    )
+    assert telemetry.enabled is False
+    worker = MagicMock()
+    telemetry.start(worker)
+    assert worker.run_coroutine_threadsafe.called is False
+    assert telemetry.stats()["running"] is False
+
+
+@pytest.mark.asyncio
+async def test_temperature_telemetry_counts_read_errors():
+    def read():
+        raise RuntimeError("printer not connected")
+
+    telemetry = TemperatureTelemetry(read, AsyncMock())
+    telemetry.sample()
+    assert telemetry.stats()["sample_errors"] == 1
+    assert await telemetry.publish_window() is False
+
+
+@pytest.mark.asyncio
+async def test_publish_nats_telemetry_resolves_subject():
+    publisher = MagicMock()
+    publisher.connection.healthy = True
+    publisher.publish = AsyncMock(return_value=True)
+    assert await publish_nats_telemetry(b"{}", publisher=publisher) is True
+    subject = publisher.publish.await_args.args[0]
+    assert subject.startswith("pi.") and subject.endswith(
+        ".octoprint.telemetry.temperature"
+    )
+
+    publisher.connection.healthy = False
+    assert await publish_nats_telemetry(b"{}", publisher=publisher) is False
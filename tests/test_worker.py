@@ -0,0 +1,189 @@
+import asyncio
+import threading
+import time
+import pytest
+from unittest.mock import AsyncMock
+
+from octoprint_nanny.metrics import (
+    EVENTS_COALESCED,
+    EVENTS_DROPPED,
+    EVENTS_FAILED,
+    EVENTS_PUBLISHED,
+)
+from octoprint_nanny.worker import (
+    AsyncTaskWorker,
+    EventOutcome,
+    EventQueue,
+    OverflowPolicy,
+)
+
+
+def test_event_queue_drop_oldest():
+    queue = EventQueue(AsyncMock(), maxsize=2)
+    assert queue.put("Home", dict(n=1)) is True
+    assert queue.put("Home", dict(n=2)) is True
+    assert queue.put("Dwell", dict(n=3)) is True
+    assert [item[1]["n"] for item in queue._items] == [2, 3]
+    stats = queue.stats()
+    assert stats["enqueued"] == 3
+    assert stats["dropped"] == 1
+    assert stats["depth"] == 2
+
+
+def test_event_queue_drop_newest():
+    queue = EventQueue(
+        AsyncMock(), maxsize=2, overflow_policy=OverflowPolicy.DROP_NEWEST.value
+    )
+    queue.put("Home", dict(n=1))
+    queue.put("Home", dict(n=2))
+    assert queue.put("Dwell", dict(n=3)) is False
+    assert [item[1]["n"] for item in queue._items] == [1, 2]
+    assert queue.stats()["dropped"] == 1
+
+
+def test_event_queue_coalesce():
+    queue = EventQueue(
+        AsyncMock(), maxsize=2, overflow_policy=OverflowPolicy.COALESCE.value
+    )
+    queue.put("PrintProgress", dict(n=1))
+    queue.put("PrinterStateChanged", dict(n=2))
+    # replaces queued PrintProgress payload in-place
+    assert queue.put("PrintProgress", dict(n=3)) is True
+    assert [item[1]["n"] for item in queue._items] == [3, 2]
+    # nothing to coalesce with, falls back to dropping the oldest item
+    assert queue.put("Home", dict(n=4)) is True
+    assert [item[0] for item in queue._items] == ["PrinterStateChanged", "Home"]
+    stats = queue.stats()
+    assert stats["coalesced"] == 1
+    assert stats["dropped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_event_queue_run_drains_in_order():
+    handler = AsyncMock(side_effect=[True, False, True])
+    queue = EventQueue(handler)
+    queue._loop = asyncio.get_running_loop()
+    queue.put("Startup", dict())
+    task = asyncio.ensure_future(queue.run())
+    await asyncio.sleep(0)
+    # wake the parked drain loop from another thread, the way OctoPrint's event dispatch does
+    await asyncio.get_running_loop().run_in_executor(None, queue.put, "Home", dict())
+    queue.put("Dwell", dict())
+    for _ in range(10):
+        await asyncio.sleep(0)
+    task.cancel()
+
+    assert [c.args[0] for c in handler.call_args_list] == ["Startup", "Home", "Dwell"]
+    stats = queue.stats()
+    assert stats["published"] == 2
+    assert stats["failed"] == 1
+    assert stats["depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_event_queue_counts_each_outcome_once():
+    outcomes = [
+        EventOutcome.PUBLISHED,
+        EventOutcome.COALESCED,
+        EventOutcome.RATE_LIMITED,
+        EventOutcome.FAILED,
+    ]
+    counters = [
+        EVENTS_PUBLISHED.labels("PrintProgress"),
+        EVENTS_COALESCED.labels("PrintProgress"),
+        EVENTS_DROPPED.labels("rate_limited"),
+        EVENTS_FAILED.labels("rejected"),
+    ]
+    before = [c.value for c in counters]
+    queue = EventQueue(AsyncMock(side_effect=outcomes))
+    for n in range(len(outcomes)):
+        queue.put("PrintProgress", dict(n=n))
+    task = asyncio.ensure_future(queue.run())
+    for _ in range(10):
+        await asyncio.sleep(0)
+    task.cancel()
+
+    assert [c.value - b for c, b in zip(counters, before)] == [1, 1, 1, 1]
+    stats = queue.stats()
+    assert (
+        stats["published"],
+        stats["held"],
+        stats["rejected"],
+        stats["failed"],
+    ) == (1, 1, 1, 1)
+
+
+def test_worker_ready_on_construction():
+    worker = AsyncTaskWorker(executor_max_workers=2)
+    # no race with the worker thread creating its loop
+    assert worker.run_coroutine_threadsafe(asyncio.sleep(0, "ok")).result(1) == "ok"
+    stats = worker.stats()
+    assert stats["running"] is True
+    assert stats["executor_max_workers"] == 2
+    worker.shutdown()
+    assert worker.loop.is_closed()
+    assert not worker._thread.is_alive()
+    with pytest.raises(RuntimeError):
+        worker.run_coroutine_threadsafe(asyncio.sleep(0))
+
+
+def test_worker_counts_pending_executor_calls():
+    worker = AsyncTaskWorker(executor_max_workers=1)
+    release = threading.Event()
+
+    async def submit():
+        loop = asyncio.get_running_loop()
+        return [loop.run_in_executor(None, release.wait, 5) for _ in range(3)]
+
+    futures = worker.run_coroutine_threadsafe(submit()).result(1)
+    # one running, two queued
+    assert worker.stats()["executor_pending"] == 3
+    release.set()
+
+    async def wait():
+        await asyncio.gather(*futures)
+
+    worker.run_coroutine_threadsafe(wait()).result(5)
+    assert worker.stats()["executor_pending"] == 0
+    worker.shutdown()
+
+
+def test_worker_shutdown_drains_event_queue():
+    handled = []
+
+    async def handler(event, payload):
+        await asyncio.sleep(0.01)
+        handled.append(event)
+        return True
+
+    worker = AsyncTaskWorker()
+    queue = EventQueue(handler)
+    queue.start(worker)
+    for n in range(10):
+        queue.put(f"Event{n}", dict())
+    worker.shutdown(drain=queue.drain, timeout=5)
+    assert handled == [f"Event{n}" for n in range(10)]
+    assert worker.loop.is_closed()
+
+
+def test_worker_shutdown_deadline():
+    async def drain():
+        await asyncio.sleep(60)
+
+    worker = AsyncTaskWorker()
+    started = time.monotonic()
+    worker.shutdown(drain=drain, timeout=0.2)
+    assert time.monotonic() - started < 2
+    assert not worker._thread.is_alive()
+
+
+def test_worker_loop_lag():
+    worker = AsyncTaskWorker(lag_interval=0.01)
+
+    async def block():
+        time.sleep(0.1)
+
+    worker.run_coroutine_threadsafe(block()).result(1)
+    time.sleep(0.05)
+    assert worker.stats()["max_loop_lag_ms"] >= 50
+    worker.shutdown()
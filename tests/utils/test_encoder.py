@@ -0,0 +1,44 @@
+import datetime
+import json
+from io import BytesIO
+
+import pytest
+
+import printnanny_octoprint_models
+
+from octoprint_nanny.utils.encoder import JSONEncoder, get_dumps
+
+BACKENDS = ["json", "orjson"]
+
+OBJ = dict(
+    created=datetime.datetime(2022, 11, 1, 12, 30, 15, 1234),
+    created_tz=datetime.datetime(2022, 11, 1, 12, 30, tzinfo=datetime.timezone.utc),
+    date=datetime.date(2022, 11, 1),
+    status=printnanny_octoprint_models.PrinterStatus.PRINTING,
+    raw=b"gcode",
+    upload=BytesIO(b"\x00\x01gcode"),
+    nested=[dict(n=1, f=1.5, s="Ender 3", none=None)],
+)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_dumps_matches_json_encoder(backend):
+    expected = json.loads(json.dumps(OBJ, cls=JSONEncoder))
+    result = get_dumps(backend)(OBJ)
+    assert isinstance(result, bytes)
+    assert json.loads(result) == expected
+
+
+def test_dumps_backends_identical():
+    assert get_dumps("json")(OBJ) == get_dumps("orjson")(OBJ)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_dumps_unsupported_type(backend):
+    with pytest.raises(TypeError):
+        get_dumps(backend)(dict(value=object()))
+
+
+def test_unsupported_backend():
+    with pytest.raises(ValueError):
+        get_dumps("pickle")
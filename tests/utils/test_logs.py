@@ -0,0 +1,55 @@
+import logging
+
+from octoprint_nanny.utils.logs import (
+    DebugRingBuffer,
+    LazyRepr,
+    LogSampler,
+    log_sampled,
+)
+
+
+class ReprCounter:
+    calls = 0
+
+    def __repr__(self):
+        ReprCounter.calls += 1
+        return "x" * 1000
+
+
+def test_lazy_repr_formats_only_when_emitted(caplog):
+    logger = logging.getLogger("octoprint.plugins.octoprint_nanny.test_logs")
+    payload = ReprCounter()
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        logger.debug("payload=%s", LazyRepr(payload))
+        assert ReprCounter.calls == 0
+        logger.info("payload=%s", LazyRepr(payload, maxlen=10))
+    assert ReprCounter.calls == 1
+    assert caplog.records[-1].getMessage() == "payload=xxxxxxxxxx...(1000 chars)"
+
+
+def test_log_sampled(caplog):
+    logger = logging.getLogger("octoprint.plugins.octoprint_nanny.test_logs")
+    sampler = LogSampler(first=2, every=5)
+    with caplog.at_level(logging.INFO, logger=logger.name):
+        for i in range(10):
+            log_sampled(logger, logging.INFO, "tick", "tick %s", i, sampler=sampler)
+    assert [r.getMessage() for r in caplog.records] == [
+        "tick 0",
+        "tick 1",
+        "tick 4 (sampled, 5 seen)",
+        "tick 9 (sampled, 10 seen)",
+    ]
+    assert sampler.stats() == dict(keys=1, seen=10, suppressed=6)
+
+
+def test_debug_ring_buffer_keeps_most_recent():
+    buffer = DebugRingBuffer(maxlen=3)
+    for i in range(5):
+        buffer.record("event", f"Event{i}", payload=dict(n=i))
+    buffer.record("progress", "PrintProgress", state=dict(progress=None))
+
+    records = buffer.dump()
+    assert [r["name"] for r in records] == ["PrintProgress", "Event4", "Event3"]
+    assert records[1]["fields"] == {"payload": "{'n': 4}"}
+    assert [r["name"] for r in buffer.dump(kind="event", limit=1)] == ["Event4"]
+    assert buffer.stats() == dict(size=3, maxlen=3, recorded=6)
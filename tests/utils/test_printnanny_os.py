@@ -1,4 +1,9 @@
-from unittest.mock import patch, mock_open
+import concurrent.futures
+import os
+import asyncio
+from unittest.mock import AsyncMock, patch, mock_open
+
+import pytest
 
 from octoprint_nanny.utils import printnanny_os
 
@@ -28,35 +33,145 @@ UBUNTU_CODENAME=jammy
 """
 
 
+def patch_load_printnanny_settings():
+    return patch(
+        "octoprint_nanny.utils.printnanny_os.load_printnanny_settings",
+        new_callable=AsyncMock,
+    )
+
+
+@pytest.mark.asyncio
 @patch("builtins.open", new_callable=mock_open, read_data=MOCK_PRINTNANNY_OS_RELEASE)
-@patch("octoprint_nanny.utils.printnanny_os.load_printnanny_settings")
-def test_known_etc_os_release(mock_printnanny_config, mock_file):
-    result = printnanny_os.etc_os_release()
+@patch_load_printnanny_settings()
+async def test_known_etc_os_release(mock_printnanny_config, mock_file):
+    result = await printnanny_os.etc_os_release()
     assert result["ID"] == "printnanny"
     assert mock_file.called is True
     assert mock_printnanny_config.called is True
 
 
+@pytest.mark.asyncio
 @patch("builtins.open", new_callable=mock_open, read_data="NONE=NONE")
-@patch("octoprint_nanny.utils.printnanny_os.load_printnanny_settings")
-def test_unknown_etc_os_release(mock_printnanny_config, mock_file):
-    result = printnanny_os.etc_os_release()
+@patch_load_printnanny_settings()
+async def test_unknown_etc_os_release(mock_printnanny_config, mock_file):
+    result = await printnanny_os.etc_os_release()
     assert result["ID"] == "unknown"
     assert mock_file.called
     assert mock_printnanny_config.called is True
 
 
+@pytest.mark.asyncio
 @patch("builtins.open", new_callable=mock_open, read_data=MOCK_PRINTNANNY_OS_RELEASE)
-@patch("octoprint_nanny.utils.printnanny_os.load_printnanny_settings")
-def test_is_printnanny_os(mock_printnanny_config, mock_file):
-    assert printnanny_os.is_printnanny_os() is True
+@patch_load_printnanny_settings()
+async def test_is_printnanny_os(mock_printnanny_config, mock_file):
+    assert await printnanny_os.is_printnanny_os() is True
     assert mock_file.called
     assert mock_printnanny_config.called is True
 
 
+@pytest.mark.asyncio
 @patch("builtins.open", new_callable=mock_open, read_data=MOCK_OTHER_OS_RELEASE)
-@patch("octoprint_nanny.utils.printnanny_os.load_printnanny_settings")
-def test_is_printnanny_os(mock_printnanny_config, mock_file):
-    assert printnanny_os.is_printnanny_os() is False
+@patch_load_printnanny_settings()
+async def test_is_not_printnanny_os(mock_printnanny_config, mock_file):
+    assert await printnanny_os.is_printnanny_os() is False
     assert mock_file.called
     assert mock_printnanny_config.called is True
+
+
+@pytest.mark.asyncio
+async def test_run_printnanny_cli_dedup(tmp_path):
+    calls = tmp_path / "calls"
+    script = f"echo run >> {calls}; sleep 0.1; echo ok"
+    with patch("octoprint_nanny.utils.printnanny_os.PRINTNANNY_BIN", "/bin/sh"):
+        results = await asyncio.gather(
+            *[printnanny_os.run_printnanny_cli("-c", script) for _ in range(3)]
+        )
+    assert [r["stdout"] for r in results] == ["ok\n"] * 3
+    assert all(r["returncode"] == 0 for r in results)
+    # identical in-flight commands ran once
+    assert calls.read_text() == "run\n"
+
+
+@pytest.mark.asyncio
+async def test_run_printnanny_cli_timeout():
+    with patch("octoprint_nanny.utils.printnanny_os.PRINTNANNY_BIN", "/bin/sh"):
+        with pytest.raises(asyncio.TimeoutError):
+            await printnanny_os.run_printnanny_cli("-c", "sleep 5", timeout=0.1)
+
+
+@pytest.mark.asyncio
+async def test_load_printnanny_settings_not_installed(tmp_path):
+    with patch(
+        "octoprint_nanny.utils.printnanny_os.PRINTNANNY_BIN", str(tmp_path / "missing")
+    ):
+        result = await printnanny_os.load_printnanny_settings()
+    assert result["returncode"] == 1
+    assert result["config"] is None
+
+
+def mock_settings(os_release_path):
+    return printnanny_os.PrintNannyConfig(
+        cmd=[],
+        stdout="",
+        stderr="",
+        returncode=0,
+        config=dict(paths=dict(os_release=str(os_release_path))),
+    )
+
+
+@pytest.mark.asyncio
+@patch_load_printnanny_settings()
+async def test_system_info_cache(mock_printnanny_config, tmp_path):
+    os_release = tmp_path / "os-release"
+    os_release.write_text(MOCK_PRINTNANNY_OS_RELEASE)
+    issue = tmp_path / "issue"
+    issue.write_text("PrintNanny OS \\n \\l\n")
+    mock_printnanny_config.return_value = mock_settings(os_release)
+
+    cache = printnanny_os.SystemInfoCache(issue_path=str(issue))
+    await cache.load_settings()
+    for _ in range(3):
+        assert cache.is_printnanny_os() is True
+        assert cache.etc_os_release()["ID"] == "printnanny"
+        assert cache.issue_txt() == "PrintNanny OS \\n \\l"
+    # printnanny CLI ran once
+    assert mock_printnanny_config.call_count == 1
+
+    # changed files are re-read
+    os_release.write_text(MOCK_OTHER_OS_RELEASE)
+    os.utime(os_release, (0, 0))
+    assert cache.is_printnanny_os() is False
+
+    # refresh reloads settings in the background
+    cache.refresh()
+    await asyncio.sleep(0.01)
+    assert mock_printnanny_config.call_count == 2
+
+
+@pytest.mark.asyncio
+@patch_load_printnanny_settings()
+async def test_system_info_cache_ttl(mock_printnanny_config, tmp_path):
+    mock_printnanny_config.return_value = mock_settings(tmp_path / "missing")
+    cache = printnanny_os.SystemInfoCache(ttl=0, issue_path=str(tmp_path / "issue"))
+    # nothing loaded yet, readers fall back to defaults instead of waiting on the CLI
+    assert cache.settings() is None
+    assert mock_printnanny_config.call_count == 0
+
+    await cache.load_settings()
+    assert cache.etc_os_release()["ID"] == "unknown"
+    assert cache.issue_txt() == f"Failed to read {tmp_path / 'issue'}"
+    # stale settings are returned while a reload is scheduled
+    assert cache.settings() is not None
+    await asyncio.sleep(0.01)
+    assert mock_printnanny_config.call_count >= 2
+
+
+def test_system_info_cache_read_file_from_threads(tmp_path):
+    issue = tmp_path / "issue"
+    issue.write_text("PrintNanny OS\n")
+    cache = printnanny_os.SystemInfoCache(issue_path=str(issue))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: cache.issue_txt(), range(400)))
+    assert set(results) == {"PrintNanny OS"}
+    # every read is counted once, as a hit or a miss
+    assert cache.hits + cache.misses == 400